@@ -0,0 +1,139 @@
+"""
+Benchmark: event loop and HTTP parser of the proxy on streamed responses.
+
+Starts the local fake upstream (`fake_upstream.py`) streaming NDJSON chunks, then
+runs the proxy with each available combination of event loop (asyncio, uvloop) and
+HTTP/1.1 parser (h11, httptools) and measures streamed throughput under concurrency.
+
+Usage:
+    uv run python benchmarks/bench_event_loop.py [--requests 400] [--concurrency 32]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+
+import httpx
+
+from ollama_deproxy.server_backends import select_event_loop, select_http_parser
+
+UPSTREAM_PORT = 18101
+PROXY_PORT = 18102
+
+
+def start_server(args: list[str], env: dict = None):
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", *args, "--log-level", "warning"],
+        env={**os.environ, **(env or {})},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def wait_ready(url: str, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.TransportError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not start")
+
+
+async def drive(requests: int, concurrency: int) -> tuple[float, int]:
+    body = json.dumps({"model": "bench", "messages": []}).encode()
+    limits = httpx.Limits(max_connections=concurrency)
+    received = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(
+        base_url=f"http://127.0.0.1:{PROXY_PORT}", limits=limits, timeout=60
+    ) as client:
+
+        async def one():
+            nonlocal received
+            async with semaphore:
+                async with client.stream("POST", "/api/chat", content=body) as r:
+                    async for chunk in r.aiter_raw():
+                        received += len(chunk)
+
+        await one()  # warm up connections and caches
+        received = 0
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(requests)))
+        return time.perf_counter() - start, received
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--chunks", type=int, default=200)
+    parser.add_argument("--chunk-size", type=int, default=256)
+    args = parser.parse_args()
+
+    bench_dir = os.path.dirname(os.path.abspath(__file__))
+
+    loops = sorted({"asyncio", select_event_loop("auto")})
+    parsers = sorted({"h11", select_http_parser("auto")})
+    upstream = start_server(
+        ["--app-dir", bench_dir, "fake_upstream:app", "--port", str(UPSTREAM_PORT)],
+        env={
+            "FAKE_TOKENS": str(args.chunks),
+            "FAKE_TOKEN_SIZE": str(args.chunk_size),
+            "FAKE_GZIP": "0",
+        },
+    )
+    proxy_env = {
+        "REMOTE_URL": f"http://127.0.0.1:{UPSTREAM_PORT}",
+        "REMOTE_URL_HTTP2": "False",
+        "HASH_ALGORITHM": "sha256",
+        "JSON_BACKEND": "json",
+        "LOG_LEVEL": "WARNING",
+        "METRICS_ENABLED": os.environ.get("METRICS_ENABLED", "True"),
+    }
+    print(
+        f"{args.requests} streamed requests x {args.chunks} chunks of {args.chunk_size} bytes, "
+        f"concurrency {args.concurrency}"
+    )
+    print(f"{'loop':<10} {'http':<10} {'req/s':>10} {'MiB/s':>10}")
+    try:
+        wait_ready(f"http://127.0.0.1:{UPSTREAM_PORT}/")
+        for loop in loops:
+            for http in parsers:
+                proxy = start_server(
+                    [
+                        "ollama_deproxy.main:app",
+                        "--port",
+                        str(PROXY_PORT),
+                        "--loop",
+                        loop,
+                        "--http",
+                        http,
+                    ],
+                    env=proxy_env,
+                )
+                try:
+                    wait_ready(f"http://127.0.0.1:{PROXY_PORT}/")
+                    seconds, received = asyncio.run(
+                        drive(args.requests, args.concurrency)
+                    )
+                finally:
+                    proxy.terminate()
+                    proxy.wait()
+                print(
+                    f"{loop:<10} {http:<10} {args.requests / seconds:>10.1f} "
+                    f"{received / seconds / 1024 / 1024:>10.1f}"
+                )
+    finally:
+        upstream.terminate()
+        upstream.wait()
+
+
+if __name__ == "__main__":
+    main()
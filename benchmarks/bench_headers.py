@@ -0,0 +1,118 @@
+"""
+Micro-benchmark: per-request header processing.
+
+Compares the precomputed header filters with the previous implementation: a
+request header dict copy without host and auth, and response headers filtered by a
+copied exclusion set with every name lowercased. Both the request headers sent by
+httpx and the response headers built by Starlette are included, as they depend on
+the form the filters produce.
+
+Usage:
+    uv run python benchmarks/bench_headers.py
+"""
+
+import os
+import timeit
+
+os.environ.setdefault("REMOTE_URL", "http://127.0.0.1:11434")
+
+from httpx import Headers, Request as HttpxRequest  # noqa: E402
+from starlette.requests import Request  # noqa: E402
+from starlette.responses import Response  # noqa: E402
+
+from ollama_deproxy.handlers import build_proxy_headers  # noqa: E402
+from ollama_deproxy.utils import excluded_headers, filter_headers  # noqa: E402
+
+REQUEST_HEADERS = [
+    (b"host", b"127.0.0.1:11434"),
+    (b"user-agent", b"ollama-python/0.4.7 (x86_64 linux) Python/3.12.3"),
+    (b"accept", b"application/json"),
+    (b"accept-encoding", b"gzip, deflate, br, zstd"),
+    (b"connection", b"keep-alive"),
+    (b"content-type", b"application/json"),
+    (b"content-length", b"512"),
+    (b"authorization", b"Bearer local-token"),
+    (b"x-request-id", b"5f0c2a7e-4a59-4d0b-9d0e-2f6c9b1f3e21"),
+    (b"traceparent", b"00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"),
+]
+
+RESPONSE_HEADERS = Headers(
+    [
+        ("Content-Type", "application/json; charset=utf-8"),
+        ("Content-Length", "1024"),
+        ("Content-Encoding", "gzip"),
+        ("Date", "Sat, 17 Oct 2026 10:00:00 GMT"),
+        ("Server", "nginx"),
+        ("Connection", "keep-alive"),
+        ("Vary", "Accept-Encoding"),
+        ("Alt-Svc", 'h3=":443"; ma=86400'),
+        ("X-Request-Id", "5f0c2a7e-4a59-4d0b-9d0e-2f6c9b1f3e21"),
+        ("Strict-Transport-Security", "max-age=63072000"),
+    ]
+)
+
+
+def legacy_proxy_headers(request: Request) -> dict:
+    proxy_headers = dict(request.headers)
+    proxy_headers.pop("host", None)
+    proxy_headers.pop("authorization", None)
+    return proxy_headers
+
+
+def legacy_filter_headers(headers, decode_response: bool = None) -> dict:
+    excluded_headers_set = set(excluded_headers)
+    if decode_response:
+        excluded_headers_set.add("content-encoding")
+    return {k: v for k, v in headers.items() if k.lower() not in excluded_headers_set}
+
+
+def run(build_request_headers, filter_response_headers):
+    # A new request object, as Starlette caches its parsed headers per request
+    request = Request({"type": "http", "headers": REQUEST_HEADERS})
+    HttpxRequest(
+        "POST",
+        "http://127.0.0.1:11434/api/chat",
+        headers=build_request_headers(request),
+    )
+    Response(b"", headers=filter_response_headers(RESPONSE_HEADERS, False))
+
+
+def measure(*args) -> float:
+    number = 20000
+    return min(timeit.repeat(lambda: run(*args), number=number, repeat=5)) / number
+
+
+def measure_part(function, *args) -> float:
+    number = 100000
+    return min(timeit.repeat(lambda: function(*args), number=number, repeat=7)) / number
+
+
+def main():
+    request = Request({"type": "http", "headers": REQUEST_HEADERS})
+    rows = [
+        (
+            "request headers",
+            measure_part(legacy_proxy_headers, request),
+            measure_part(build_proxy_headers, request),
+        ),
+        (
+            "response headers",
+            measure_part(legacy_filter_headers, RESPONSE_HEADERS, False),
+            measure_part(filter_headers, RESPONSE_HEADERS, False),
+        ),
+        (
+            "per request",
+            measure(legacy_proxy_headers, legacy_filter_headers),
+            measure(build_proxy_headers, filter_headers),
+        ),
+    ]
+    print(f"{'':<20}{'legacy':>12}{'current':>12}{'speedup':>10}")
+    for name, t_legacy, t_current in rows:
+        print(
+            f"{name:<20}{t_legacy * 1e6:>10.2f}us{t_current * 1e6:>10.2f}us"
+            f"{t_legacy / t_current:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
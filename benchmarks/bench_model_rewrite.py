@@ -0,0 +1,98 @@
+"""
+Micro-benchmark: numbered model name rewrite.
+
+Compares the incremental splice in `OllamaHelper.replace_numbered_model` with the
+previous full `json.loads` / `json.dumps` round trip on small and multi-MB bodies.
+
+Usage:
+    uv run python benchmarks/bench_model_rewrite.py
+"""
+
+import asyncio
+import base64
+import json
+import os
+import timeit
+
+os.environ.setdefault("REMOTE_URL", "http://127.0.0.1:11434")
+
+from ollama_deproxy.ollama_helper import ModelRegistry, OllamaHelper  # noqa: E402
+
+
+class LegacyOllamaHelper(OllamaHelper):
+    """Previous implementation: full JSON decode and re-encode."""
+
+    async def replace_numbered_model(self, data: bytes) -> bytes:
+        if not data:
+            return data
+        try:
+            data_dict = json.loads(data.decode())
+        except json.JSONDecodeError:
+            return data
+        model_name: str = data_dict.get("model", "")
+        if model_name and model_name.isdigit():
+            data_dict["model"] = await self.get_model_name(int(model_name))
+            return json.dumps(data_dict, ensure_ascii=False).encode()
+        return data
+
+
+def build_bodies() -> dict[str, bytes]:
+    image = base64.b64encode(os.urandom(3 * 1024 * 1024)).decode()
+    history = [
+        {"role": "user" if i % 2 else "assistant", "content": f"message {i} " * 40}
+        for i in range(4000)
+    ]
+    return {
+        "small chat": json.dumps(
+            {"model": "1", "messages": [{"role": "user", "content": "Hi"}]}
+        ).encode(),
+        "small named": json.dumps(
+            {"model": "llama3.1:8b", "messages": [{"role": "user", "content": "Hi"}]}
+        ).encode(),
+        "4 MiB image, model first": json.dumps(
+            {"model": "1", "messages": [{"role": "user", "images": [image]}]}
+        ).encode(),
+        "4 MiB image, named model": json.dumps(
+            {"model": "llava:7b", "messages": [{"role": "user", "images": [image]}]}
+        ).encode(),
+        "4 MiB image, model last": json.dumps(
+            {"messages": [{"role": "user", "images": [image]}], "model": "1"}
+        ).encode(),
+        "history, model last": json.dumps({"messages": history, "model": "1"}).encode(),
+    }
+
+
+def measure(helper: OllamaHelper, body: bytes, number: int) -> float:
+    loop = asyncio.new_event_loop()
+    try:
+
+        def run():
+            loop.run_until_complete(helper.replace_numbered_model(body))
+
+        run()
+        return min(timeit.repeat(run, number=number, repeat=5)) / number
+    finally:
+        loop.close()
+
+
+def main():
+    registry = ModelRegistry.from_tags(
+        {"models": [{"name": f"model-{i}:latest"} for i in range(32)]}
+    )
+    current, legacy = OllamaHelper(), LegacyOllamaHelper()
+    current.registry = legacy.registry = registry
+
+    print(f"{'body':<28}{'size':>12}{'legacy':>14}{'current':>14}{'speedup':>10}")
+    for name, body in build_bodies().items():
+        number = 2000 if len(body) < 64 * 1024 else 10
+        t_legacy = measure(legacy, body, number)
+        t_current = measure(current, body, number)
+        print(
+            f"{name:<28}{len(body) / 1024:>10.1f}KB"
+            f"{t_legacy * 1e6:>12.1f}us{t_current * 1e6:>12.1f}us"
+            f"{t_legacy / t_current:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+"""
+Micro-benchmark: size-aware offloading of CPU bound work.
+
+Compares cache key hashing of small request bodies always sent to the Starlette
+threadpool with the calibrated `Offload` policy, which hashes them inline, and the
+longest event loop stall while a multi-MB request body is scanned for a numbered
+model name, on the loop versus on the offload executor.
+
+Usage:
+    uv run python benchmarks/bench_offload.py
+"""
+
+import asyncio
+import os
+import time
+
+os.environ.setdefault("REMOTE_URL", "http://127.0.0.1:11434")
+os.environ.setdefault("HASH_ALGORITHM", "blake2b")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from starlette.concurrency import run_in_threadpool  # noqa: E402
+
+from ollama_deproxy.cache_base import CacheBase  # noqa: E402
+from ollama_deproxy.json_codec import JsonCodec  # noqa: E402
+from ollama_deproxy.offload import Offload  # noqa: E402
+from ollama_deproxy.ollama_helper import OllamaHelper  # noqa: E402
+
+SMALL_BODY = JsonCodec.dumps(
+    {"model": "llama3:8b", "messages": [{"role": "user", "content": "Hello!" * 40}]}
+)
+LARGE_BODY = JsonCodec.dumps(
+    {
+        "messages": [
+            {"role": "user", "content": f"message {i} " * 8} for i in range(40000)
+        ],
+        "model": "1",
+    }
+)
+
+
+async def per_call(function, number: int = 5000) -> float:
+    best = float("inf")
+    for _ in range(5):
+        start = time.perf_counter()
+        for _ in range(number):
+            await function()
+        best = min(best, (time.perf_counter() - start) / number)
+    return best
+
+
+async def max_stall(function, number: int = 5) -> float:
+    """Longest gap between ticks of a 1 ms ticker while `function` runs."""
+    stall = 0.0
+    done = False
+
+    async def ticker():
+        nonlocal stall
+        last = time.perf_counter()
+        while not done:
+            await asyncio.sleep(0.001)
+            now = time.perf_counter()
+            stall = max(stall, now - last)
+            last = now
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(0.01)
+    for _ in range(number):
+        await function()
+        # Let the ticker run between calls, so a stall is of one call
+        await asyncio.sleep(0.002)
+    done = True
+    await task
+    return stall
+
+
+async def run():
+    Offload.configure("auto")
+    cache = CacheBase()
+    path, method = "api/chat", "POST"
+
+    t_threadpool = await per_call(
+        lambda: run_in_threadpool(cache.build_cache_key, path, method, SMALL_BODY)
+    )
+    t_offload = await per_call(
+        lambda: cache.async_build_cache_key(path, method, SMALL_BODY)
+    )
+
+    async def scan_inline():
+        OllamaHelper.find_numbered_model(LARGE_BODY)
+
+    async def scan_offload():
+        await Offload.run(
+            "scan", len(LARGE_BODY), OllamaHelper.find_numbered_model, LARGE_BODY
+        )
+
+    s_inline = await max_stall(scan_inline)
+    s_offload = await max_stall(scan_offload)
+
+    print(f"thresholds: {Offload.format_thresholds(Offload._THRESHOLDS)}")
+    print(f"{'':<34}{'threadpool':>12}{'offload':>12}{'speedup':>10}")
+    print(
+        f"{f'cache key, {len(SMALL_BODY)} B body':<34}{t_threadpool * 1e6:>10.2f}us"
+        f"{t_offload * 1e6:>10.2f}us{t_threadpool / t_offload:>9.1f}x"
+    )
+    print(f"{'':<34}{'inline':>12}{'offload':>12}")
+    print(
+        f"{f'loop stall, {len(LARGE_BODY) >> 20} MiB model scan':<34}"
+        f"{s_inline * 1e3:>10.2f}ms{s_offload * 1e3:>10.2f}ms"
+    )
+    Offload.shutdown()
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
@@ -0,0 +1,118 @@
+"""
+Micro-benchmark: per-request routing overhead.
+
+Compares the precomputed `RouteTable` lookup with the previous per-request work:
+`gen_path` prefix classification, the metrics route label, the linear
+`ResponseCache.is_cached` / `is_completion_cached` scans and the upstream URL built
+from the client base URL.
+
+Usage:
+    uv run python benchmarks/bench_routing.py
+"""
+
+import os
+import timeit
+
+os.environ.setdefault("REMOTE_URL", "http://127.0.0.1:11434")
+os.environ.setdefault("HASH_ALGORITHM", "blake2b")
+os.environ.setdefault("CACHE_COMPLETIONS", "true")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from httpx import URL  # noqa: E402
+
+from ollama_deproxy.config import settings  # noqa: E402
+from ollama_deproxy.ollama_helper import OllamaHelper  # noqa: E402
+from ollama_deproxy.response_cache import ResponseCache  # noqa: E402
+from ollama_deproxy.routes import RouteTable  # noqa: E402
+
+PATHS = [
+    "api/chat",
+    "api/generate",
+    "api/tags",
+    "api/show",
+    "v1/chat/completions",
+    "v1/embeddings",
+    "v1/messages",
+    "chat/completions",
+    "",
+]
+
+
+def legacy_gen_path(path: str):
+    path_split = path.split("/", maxsplit=1)[0]
+    if path_split == "":
+        return path, path_split
+    for prefix in ("v1/messages",):
+        if path.startswith(prefix):
+            return settings.path_api + path, path_split
+    if path_split in {"api", "v1"}:
+        return settings.path_proxy_ollama + path, path_split
+    return settings.path_proxy_ollama + "v1/" + path, path_split
+
+
+def legacy_route_label(path: str) -> str:
+    path_split = path.split("/", maxsplit=1)[0]
+    if path_split == "":
+        return "root"
+    if path.startswith(("v1/messages",)):
+        return "anthropic"
+    if path_split == "api":
+        return "ollama"
+    return "openai"
+
+
+def legacy(cache: ResponseCache, base_url: URL):
+    for raw_path in PATHS:
+        legacy_route_label(raw_path)
+        path, path_split = legacy_gen_path(raw_path)
+        if path_split == "":
+            continue
+        cache.is_completion_cached(path)
+        cache.is_cached(path)
+        settings.correct_numbered_model_names and not path.startswith(
+            OllamaHelper.MODEL_PATH
+        )
+        f"{str(base_url).rstrip('/')}/{path.lstrip('/')}"
+
+
+def current(table: RouteTable, url_prefix: str):
+    for raw_path in PATHS:
+        table.label(raw_path)
+        route = table.resolve(raw_path)
+        if route.family == "root":
+            continue
+        route.completion_cached
+        route.cached
+        route.rewrite_model
+        url_prefix + route.path
+
+
+def main():
+    cache = ResponseCache()
+    table = RouteTable(
+        cached_paths=ResponseCache.CACHED_PATHS,
+        completion_paths=ResponseCache.COMPLETION_PATHS,
+        model_path=OllamaHelper.MODEL_PATH,
+    )
+    base_url = URL(str(settings.remote_url))
+    url_prefix = str(base_url).rstrip("/") + "/"
+
+    number = 20000
+    t_legacy = (
+        min(timeit.repeat(lambda: legacy(cache, base_url), number=number, repeat=5))
+        / number
+        / len(PATHS)
+    )
+    t_current = (
+        min(timeit.repeat(lambda: current(table, url_prefix), number=number, repeat=5))
+        / number
+        / len(PATHS)
+    )
+    print(f"{'':<10}{'per request':>14}")
+    print(f"{'legacy':<10}{t_legacy * 1e9:>12.0f}ns")
+    print(f"{'current':<10}{t_current * 1e9:>12.0f}ns")
+    print(f"{'speedup':<10}{t_legacy / t_current:>13.1f}x")
+
+
+if __name__ == "__main__":
+    main()
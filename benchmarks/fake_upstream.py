@@ -0,0 +1,237 @@
+"""
+Fake Ollama upstream for benchmarks.
+
+Emulates `/api/tags`, `/api/show`, `/api/version`, streaming `/api/chat` and
+`/api/generate` NDJSON, OpenAI `v1/chat/completions` SSE and embeddings
+(`/api/embed`, `v1/embeddings`), under the `ollama/` prefix like OpenWebUI. Configured by environment variables:
+    FAKE_TOKENS             tokens per completion (default: 200)
+    FAKE_TOKEN_SIZE         content bytes per token chunk (default: 16)
+    FAKE_TOKENS_PER_SECOND  generation speed, 0 streams without delays (default: 0)
+    FAKE_TTFT               seconds before the first token (default: 0)
+    FAKE_MODELS             number of models in `/api/tags` (default: 32)
+    FAKE_SHOW_SIZE          bytes of the `/api/show` modelfile (default: 16384)
+    FAKE_GZIP               gzip responses when the client accepts it (default: 1)
+    FAKE_EMBED_DIMENSIONS   dimensions of embedding vectors (default: 768)
+    FAKE_EMBED_LATENCY      seconds per embedding request, any batch size (default: 0.01)
+
+Usage:
+    uv run uvicorn --app-dir benchmarks fake_upstream:app --port 18101
+    # HTTP/2 needs TLS and an HTTP/2 server, e.g.:
+    uv run hypercorn --certfile cert.pem --keyfile key.pem -b 127.0.0.1:18101 benchmarks.fake_upstream:app
+"""
+
+import asyncio
+import json
+import os
+import time
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.gzip import GZipMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+TOKENS = int(os.environ.get("FAKE_TOKENS", 200))
+TOKEN_SIZE = int(os.environ.get("FAKE_TOKEN_SIZE", 16))
+TOKENS_PER_SECOND = float(os.environ.get("FAKE_TOKENS_PER_SECOND", 0))
+TTFT = float(os.environ.get("FAKE_TTFT", 0))
+MODELS = int(os.environ.get("FAKE_MODELS", 32))
+SHOW_SIZE = int(os.environ.get("FAKE_SHOW_SIZE", 16 * 1024))
+GZIP = os.environ.get("FAKE_GZIP", "1").lower() in ("1", "true", "yes")
+EMBED_DIMENSIONS = int(os.environ.get("FAKE_EMBED_DIMENSIONS", 768))
+EMBED_LATENCY = float(os.environ.get("FAKE_EMBED_LATENCY", 0.01))
+
+TOKEN = "x" * TOKEN_SIZE
+TAGS = {
+    "models": [
+        {
+            "name": f"model-{i}:latest",
+            "model": f"model-{i}:latest",
+            "modified_at": "2026-03-12T10:00:00.000000000Z",
+            "size": 4_661_224_676 + i,
+            "digest": f"{i:064x}",
+            "details": {
+                "format": "gguf",
+                "family": "llama",
+                "parameter_size": "8.0B",
+                "quantization_level": "Q4_K_M",
+            },
+        }
+        for i in range(MODELS)
+    ]
+}
+
+
+async def tokens():
+    """Yield token indexes at the configured speed."""
+    if TTFT:
+        await asyncio.sleep(TTFT)
+    interval = 1 / TOKENS_PER_SECOND if TOKENS_PER_SECOND else 0
+    start = time.perf_counter()
+    for i in range(TOKENS):
+        if interval:
+            delay = start + i * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        yield i
+
+
+async def body_of(request: Request) -> dict:
+    try:
+        return json.loads(await request.body() or b"{}")
+    except ValueError:
+        return {}
+
+
+async def tags(request: Request):
+    return JSONResponse(TAGS)
+
+
+async def show(request: Request):
+    body = await body_of(request)
+    return JSONResponse(
+        {"modelfile": "#" * SHOW_SIZE, "model": body.get("model") or body.get("name")}
+    )
+
+
+async def version(request: Request):
+    return JSONResponse({"version": "0.0.0-fake"})
+
+
+async def chat(request: Request):
+    body = await body_of(request)
+    model = body.get("model", "model-0:latest")
+    generate = request.url.path.endswith("generate")
+    start = time.perf_counter()
+
+    def line(data: dict) -> bytes:
+        return json.dumps(data).encode() + b"\n"
+
+    def token_line() -> bytes:
+        if generate:
+            return line({"model": model, "response": TOKEN, "done": False})
+        return line(
+            {
+                "model": model,
+                "message": {"role": "assistant", "content": TOKEN},
+                "done": False,
+            }
+        )
+
+    def last_line() -> bytes:
+        return line(
+            {
+                "model": model,
+                "done": True,
+                "prompt_eval_count": 16,
+                "eval_count": TOKENS,
+                "eval_duration": int((time.perf_counter() - start) * 1e9),
+            }
+        )
+
+    if body.get("stream") is False:
+        async for _ in tokens():
+            pass
+        content = TOKEN * TOKENS
+        data = json.loads(last_line())
+        if generate:
+            data["response"] = content
+        else:
+            data["message"] = {"role": "assistant", "content": content}
+        return JSONResponse(data)
+
+    async def gen():
+        async for _ in tokens():
+            yield token_line()
+        yield last_line()
+
+    return StreamingResponse(gen(), media_type="application/x-ndjson")
+
+
+async def openai_chat(request: Request):
+    body = await body_of(request)
+    model = body.get("model", "model-0:latest")
+    usage = {"prompt_tokens": 16, "completion_tokens": TOKENS}
+
+    if not body.get("stream"):
+        async for _ in tokens():
+            pass
+        return JSONResponse(
+            {
+                "object": "chat.completion",
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": TOKEN * TOKENS},
+                    }
+                ],
+                "usage": usage,
+            }
+        )
+
+    def event(data: dict) -> bytes:
+        return b"data: " + json.dumps(data).encode() + b"\n\n"
+
+    async def gen():
+        async for _ in tokens():
+            yield event(
+                {
+                    "object": "chat.completion.chunk",
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {"content": TOKEN}}],
+                }
+            )
+        yield event({"model": model, "choices": [], "usage": usage})
+        yield b"data: [DONE]\n\n"
+
+    return StreamingResponse(gen(), media_type="text/event-stream")
+
+
+def vector_of(text: str) -> list[float]:
+    """Deterministic vector of a text."""
+    seed = sum(str(text).encode()) % 1000
+    return [round((seed + i) % 1000 / 1000, 6) for i in range(EMBED_DIMENSIONS)]
+
+
+async def embed(request: Request):
+    body = await body_of(request)
+    inputs = body.get("input", "")
+    inputs = [inputs] if isinstance(inputs, str) else inputs
+    await asyncio.sleep(EMBED_LATENCY)
+    tokens = sum(len(str(text)) // 4 + 1 for text in inputs)
+    if request.url.path.endswith("api/embed"):
+        return JSONResponse(
+            {
+                "model": body.get("model"),
+                "embeddings": [vector_of(text) for text in inputs],
+                "prompt_eval_count": tokens,
+            }
+        )
+    return JSONResponse(
+        {
+            "object": "list",
+            "data": [
+                {"object": "embedding", "index": i, "embedding": vector_of(text)}
+                for i, text in enumerate(inputs)
+            ],
+            "model": body.get("model"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+    )
+
+
+app = Starlette(
+    routes=[
+        Route("/ollama/api/tags", tags),
+        Route("/ollama/api/show", show, methods=["POST"]),
+        Route("/ollama/api/version", version),
+        Route("/ollama/api/chat", chat, methods=["POST"]),
+        Route("/ollama/api/generate", chat, methods=["POST"]),
+        Route("/ollama/v1/chat/completions", openai_chat, methods=["POST"]),
+        Route("/ollama/api/embed", embed, methods=["POST"]),
+        Route("/ollama/v1/embeddings", embed, methods=["POST"]),
+    ],
+    middleware=[Middleware(GZipMiddleware, minimum_size=500)] if GZIP else [],
+)
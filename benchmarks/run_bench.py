@@ -0,0 +1,501 @@
+"""
+Load-test driver: proxy throughput, latency, TTFT overhead and memory under concurrency.
+
+Starts the local fake upstream (`fake_upstream.py`) and the proxy for each scenario
+of the matrix:
+    mode       stream / buffered       (STREAM_RESPONSE)
+    decode     off / on                (DECODE_RESPONSE)
+    upstream   http1 / http2           (HTTP/2 needs `hypercorn` and `openssl`)
+    cache      on / off                (CACHE_ENABLED)
+and runs the workloads `tags`, `show`, `chat` (NDJSON stream) and `openai` (SSE
+stream) against it. TTFT overhead is the proxy TTFT minus the TTFT measured directly
+against the upstream. Peak RSS of the proxy process is read from /proc (Linux).
+
+The report is printed and saved as JSON with the proxy version, so runs of
+different versions can be compared with `--compare`.
+
+Usage:
+    uv run python benchmarks/run_bench.py
+    uv run python benchmarks/run_bench.py --mode stream --upstream http1 --requests 200
+    uv run python benchmarks/run_bench.py --compare benchmarks/results/old.json
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+import httpx
+
+BENCH_DIR = Path(__file__).resolve().parent
+UPSTREAM_PORT = 18111
+PROXY_PORT = 18112
+
+WORKLOADS = {
+    # name: (method, path, body, streamed)
+    "tags": ("GET", "/api/tags", None, False),
+    "show": ("POST", "/api/show", {"model": "model-0:latest"}, False),
+    "chat": (
+        "POST",
+        "/api/chat",
+        {"model": "model-0:latest", "messages": [{"role": "user", "content": "Hi"}]},
+        True,
+    ),
+    "openai": (
+        "POST",
+        "/v1/chat/completions",
+        {
+            "model": "model-0:latest",
+            "stream": True,
+            "messages": [{"role": "user", "content": "Hi"}],
+        },
+        True,
+    ),
+}
+
+
+@dataclass
+class Result:
+    scenario: str
+    workload: str
+    requests: int
+    errors: int
+    rps: float
+    mib_per_sec: float
+    p50_ms: float
+    p99_ms: float
+    ttft_p50_ms: float | None = None
+    ttft_p99_ms: float | None = None
+    ttft_overhead_ms: float | None = None
+    rss_mib: float | None = None
+
+
+def percentile(values: list[float], q: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(q / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def peak_rss_mib(pid: int) -> float | None:
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def start_process(args: list[str], env: dict = None) -> subprocess.Popen:
+    return subprocess.Popen(
+        args,
+        env={**os.environ, **(env or {})},
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+
+def stop_process(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+
+def wait_ready(url: str, verify=True, timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            httpx.get(url, timeout=1.0, verify=verify)
+            return
+        except httpx.TransportError:
+            time.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not start")
+
+
+def make_certificate(directory: str) -> tuple[str, str] | None:
+    """Create a self-signed certificate for 127.0.0.1, needed for an HTTP/2 upstream."""
+    if shutil.which("openssl") is None:
+        return None
+    cert, key = f"{directory}/cert.pem", f"{directory}/key.pem"
+    subprocess.run(
+        [
+            "openssl",
+            "req",
+            "-x509",
+            "-newkey",
+            "rsa:2048",
+            "-nodes",
+            "-days",
+            "1",
+            "-subj",
+            "/CN=127.0.0.1",
+            "-addext",
+            "subjectAltName=IP:127.0.0.1",
+            "-keyout",
+            key,
+            "-out",
+            cert,
+        ],
+        check=True,
+        capture_output=True,
+    )
+    return cert, key
+
+
+class Upstream:
+    """The fake upstream process over HTTP/1.1 (uvicorn) or HTTP/2 with TLS (hypercorn)."""
+
+    def __init__(self, kind: str, env: dict, certificate: tuple[str, str] | None):
+        self.kind = kind
+        self.env = env
+        self.certificate = certificate
+        self.process: subprocess.Popen | None = None
+
+    @property
+    def url(self) -> str:
+        scheme = "https" if self.kind == "http2" else "http"
+        return f"{scheme}://127.0.0.1:{UPSTREAM_PORT}"
+
+    def start(self):
+        if self.kind == "http2":
+            cert, key = self.certificate
+            args = [
+                sys.executable,
+                "-m",
+                "hypercorn",
+                "--certfile",
+                cert,
+                "--keyfile",
+                key,
+                "-b",
+                f"127.0.0.1:{UPSTREAM_PORT}",
+                "--log-level",
+                "warning",
+                "fake_upstream:app",
+            ]
+            env = {**self.env, "PYTHONPATH": str(BENCH_DIR)}
+        else:
+            args = [
+                sys.executable,
+                "-m",
+                "uvicorn",
+                "--app-dir",
+                str(BENCH_DIR),
+                "fake_upstream:app",
+                "--port",
+                str(UPSTREAM_PORT),
+                "--log-level",
+                "warning",
+            ]
+            env = self.env
+        self.process = start_process(args, env)
+        wait_ready(f"{self.url}/ollama/api/version", verify=self.verify)
+
+    @property
+    def verify(self):
+        return self.certificate[0] if self.kind == "http2" else True
+
+    def stop(self):
+        if self.process is not None:
+            stop_process(self.process)
+            self.process = None
+
+
+async def run_workload(
+    base_url: str,
+    workload: str,
+    requests: int,
+    concurrency: int,
+    prefix: str = "",
+    verify=True,
+) -> tuple[dict, int]:
+    method, path, body, streamed = WORKLOADS[workload]
+    content = json.dumps(body).encode() if body is not None else None
+    latencies: list[float] = []
+    ttfts: list[float] = []
+    received = 0
+    errors = 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async with httpx.AsyncClient(
+        base_url=base_url,
+        timeout=120,
+        verify=verify,
+        http2=base_url.startswith("https"),
+        limits=httpx.Limits(max_connections=concurrency),
+    ) as client:
+
+        async def one(record: bool = True):
+            nonlocal received, errors
+            async with semaphore:
+                start = time.perf_counter()
+                ttft = None
+                size = 0
+                try:
+                    async with client.stream(
+                        method, prefix + path, content=content
+                    ) as response:
+                        async for chunk in response.aiter_bytes():
+                            if ttft is None and chunk:
+                                ttft = time.perf_counter() - start
+                            size += len(chunk)
+                        if response.status_code >= 400:
+                            errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                    return
+                if record:
+                    latencies.append(time.perf_counter() - start)
+                    received += size
+                    if streamed and ttft is not None:
+                        ttfts.append(ttft)
+
+        await one(record=False)  # warm up connections and caches
+        start = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(requests)))
+        seconds = time.perf_counter() - start
+
+    stats = {
+        "rps": requests / seconds,
+        "mib_per_sec": received / seconds / 1024 / 1024,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+    }
+    if ttfts:
+        stats["ttft_p50_ms"] = percentile(ttfts, 50) * 1000
+        stats["ttft_p99_ms"] = percentile(ttfts, 99) * 1000
+    return stats, errors
+
+
+def proxy_env(upstream: Upstream, mode: str, decode: str, cache: str) -> dict:
+    from ollama_deproxy.best_hash import BestHash
+    from ollama_deproxy.json_codec import JsonCodec
+
+    env = {
+        "REMOTE_URL": upstream.url,
+        "REMOTE_URL_HTTP2": str(upstream.kind == "http2"),
+        "STREAM_RESPONSE": str(mode == "stream"),
+        "DECODE_RESPONSE": str(decode == "on"),
+        "CACHE_ENABLED": str(cache == "on"),
+        "CACHE_DIR": "",
+        "LOG_LEVEL": "WARNING",
+        # Resolve auto-selection once, not on each proxy start
+        "HASH_ALGORITHM": BestHash.select_best_hash(
+            os.environ.get("HASH_ALGORITHM", "auto")
+        ),
+        "JSON_BACKEND": JsonCodec.select_best_json(
+            os.environ.get("JSON_BACKEND", "auto")
+        ),
+    }
+    if upstream.kind == "http2":
+        env["SSL_CERT_FILE"] = upstream.certificate[0]
+    return env
+
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"],
+            cwd=BENCH_DIR,
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results: list[Result], baseline: dict[tuple, dict] = None):
+    header = (
+        f"{'scenario':<36} {'workload':<8} {'req/s':>9} {'MiB/s':>8} {'p50 ms':>8} "
+        f"{'p99 ms':>8} {'ttft ms':>8} {'+ttft':>7} {'rss MiB':>8} {'err':>4}"
+    )
+    if baseline:
+        header += f" {'req/s Δ':>9} {'p99 Δ':>8}"
+    print(header)
+    print("-" * len(header))
+
+    def fmt(value, width, digits=1):
+        return f"{value:>{width}.{digits}f}" if value is not None else f"{'-':>{width}}"
+
+    for r in results:
+        line = (
+            f"{r.scenario:<36} {r.workload:<8} {fmt(r.rps, 9)} {fmt(r.mib_per_sec, 8)} "
+            f"{fmt(r.p50_ms, 8)} {fmt(r.p99_ms, 8)} {fmt(r.ttft_p50_ms, 8)} "
+            f"{fmt(r.ttft_overhead_ms, 7, 2)} {fmt(r.rss_mib, 8)} {r.errors:>4}"
+        )
+        old = (baseline or {}).get((r.scenario, r.workload))
+        if old:
+            rps_delta = (r.rps / old["rps"] - 1) * 100 if old["rps"] else 0.0
+            p99_delta = (r.p99_ms / old["p99_ms"] - 1) * 100 if old["p99_ms"] else 0.0
+            line += f" {rps_delta:>+8.1f}% {p99_delta:>+7.1f}%"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--mode", default="stream,buffered")
+    parser.add_argument("--decode", default="off,on")
+    parser.add_argument("--upstream", default="http1,http2")
+    parser.add_argument("--cache", default="on,off")
+    parser.add_argument("--workloads", default=",".join(WORKLOADS))
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--token-size", type=int, default=16)
+    parser.add_argument(
+        "--token-rate", type=float, default=0, help="tokens/s, 0 for no delays"
+    )
+    parser.add_argument("--ttft", type=float, default=0, help="upstream TTFT, seconds")
+    parser.add_argument("--show-size", type=int, default=16 * 1024)
+    parser.add_argument("--output", type=str, help="report file, default: results/")
+    parser.add_argument("--compare", type=str, help="previous report to compare with")
+    args = parser.parse_args()
+
+    from ollama_deproxy.get_version import app_version
+
+    workloads = [w for w in args.workloads.split(",") if w in WORKLOADS]
+    upstream_env = {
+        "FAKE_TOKENS": str(args.tokens),
+        "FAKE_TOKEN_SIZE": str(args.token_size),
+        "FAKE_TOKENS_PER_SECOND": str(args.token_rate),
+        "FAKE_TTFT": str(args.ttft),
+        "FAKE_SHOW_SIZE": str(args.show_size),
+    }
+    tmp_dir = tempfile.mkdtemp(prefix="deproxy-bench-")
+    upstream_kinds = args.upstream.split(",")
+    certificate = None
+    if "http2" in upstream_kinds:
+        try:
+            import hypercorn  # noqa: F401
+
+            certificate = make_certificate(tmp_dir)
+        except ImportError:
+            pass
+        if certificate is None:
+            print("Skipping HTTP/2 upstream: `hypercorn` and `openssl` are required")
+            upstream_kinds.remove("http2")
+
+    results: list[Result] = []
+    try:
+        for kind in upstream_kinds:
+            upstream = Upstream(kind, upstream_env, certificate)
+            upstream.start()
+            try:
+                # Direct TTFT of the upstream, the baseline of the proxy TTFT overhead
+                direct_ttft = {}
+                for workload in workloads:
+                    if WORKLOADS[workload][3]:
+                        stats, _ = asyncio.run(
+                            run_workload(
+                                upstream.url,
+                                workload,
+                                args.requests,
+                                args.concurrency,
+                                prefix="/ollama",
+                                verify=upstream.verify,
+                            )
+                        )
+                        direct_ttft[workload] = stats.get("ttft_p50_ms")
+
+                for mode, decode, cache in itertools.product(
+                    args.mode.split(","), args.decode.split(","), args.cache.split(",")
+                ):
+                    scenario = f"{mode}/decode-{decode}/{kind}/cache-{cache}"
+                    proxy = start_process(
+                        [
+                            sys.executable,
+                            "-m",
+                            "uvicorn",
+                            "ollama_deproxy.main:app",
+                            "--port",
+                            str(PROXY_PORT),
+                            "--log-level",
+                            "warning",
+                        ],
+                        proxy_env(upstream, mode, decode, cache),
+                    )
+                    try:
+                        wait_ready(f"http://127.0.0.1:{PROXY_PORT}/")
+                        for workload in workloads:
+                            stats, errors = asyncio.run(
+                                run_workload(
+                                    f"http://127.0.0.1:{PROXY_PORT}",
+                                    workload,
+                                    args.requests,
+                                    args.concurrency,
+                                )
+                            )
+                            result = Result(
+                                scenario=scenario,
+                                workload=workload,
+                                requests=args.requests,
+                                errors=errors,
+                                rss_mib=peak_rss_mib(proxy.pid),
+                                **stats,
+                            )
+                            if (
+                                result.ttft_p50_ms is not None
+                                and direct_ttft.get(workload) is not None
+                            ):
+                                result.ttft_overhead_ms = (
+                                    result.ttft_p50_ms - direct_ttft[workload]
+                                )
+                            results.append(result)
+                            print(
+                                f"{scenario} {workload}: {result.rps:.1f} req/s, p99 {result.p99_ms:.1f} ms"
+                            )
+                    finally:
+                        stop_process(proxy)
+            finally:
+                upstream.stop()
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    report = {
+        "meta": {
+            "version": app_version(),
+            "git": git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "args": vars(args),
+        },
+        "results": [asdict(r) for r in results],
+    }
+    output = Path(
+        args.output
+        or BENCH_DIR
+        / "results"
+        / f"{report['meta']['version']}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+
+    baseline = None
+    if args.compare:
+        old = json.loads(Path(args.compare).read_text())
+        baseline = {(r["scenario"], r["workload"]): r for r in old["results"]}
+        print(f"\nCompared with {old['meta']['version']} ({old['meta']['git']})")
+    print()
+    print_report(results, baseline)
+    print(f"\nReport saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
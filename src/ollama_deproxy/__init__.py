@@ -25,6 +25,7 @@ def run():
     import uvicorn
     from dotenv import load_dotenv
 
+    from .server_backends import select_event_loop, select_http_parser
     from .utils import decode_error, print_header
 
     parser = argparse.ArgumentParser(description="Run the Ollama DeProxy application.")
@@ -52,6 +53,21 @@ def run():
         type=str,
         help="Override HASH_ALGORITHM environment variable, default: auto",
     )
+    parser.add_argument(
+        "--event-loop",
+        type=str,
+        help="Override EVENT_LOOP environment variable (auto, uvloop, asyncio), default: auto",
+    )
+    parser.add_argument(
+        "--http-parser",
+        type=str,
+        help="Override HTTP_PARSER environment variable (auto, httptools, h11), default: auto",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Override WORKERS environment variable, number of worker processes, default: 1",
+    )
     parser.add_argument("--env_path", type=str, help="Override path to .env file")
     parser.add_argument(
         "--version", "-v", action="store_true", help="Version of the application"
@@ -91,10 +107,33 @@ def run():
     if args.local_port:
         os.environ["LOCAL_PORT"] = str(args.local_port)
 
-    port = int(os.getenv("local_port") or 11434)
+    if args.event_loop:
+        os.environ["EVENT_LOOP"] = args.event_loop
+
+    if args.http_parser:
+        os.environ["HTTP_PARSER"] = args.http_parser
+
+    if args.workers:
+        os.environ["WORKERS"] = str(args.workers)
+
+    port = int(os.getenv("LOCAL_PORT") or 11434)
+    workers = int(os.getenv("WORKERS") or 1)
 
     print_header()
 
+    loop = select_event_loop(os.getenv("EVENT_LOOP", "auto").lower())
+    http = select_http_parser(os.getenv("HTTP_PARSER", "auto").lower())
+    print(f"Event loop: {loop}, HTTP parser: {http}")
+
+    shared_cache_dir = None
+    if workers > 1:
+        try:
+            shared_cache_dir = prepare_workers(workers)
+        except ValidationError as e:
+            # Offload calibration imports modules which load the settings
+            decode_error(e)
+            return
+
     while True:
         try:
             uvicorn.run(
@@ -103,6 +142,9 @@ def run():
                 port=port,
                 reload=False,
                 log_config=None,
+                workers=workers,
+                loop=loop,
+                http=http,
             )
         except ValidationError as e:
             decode_error(e)
@@ -115,4 +157,65 @@ def run():
             print("Restarting server...")
         except KeyboardInterrupt:
             break
+    if shared_cache_dir is not None:
+        import shutil
+
+        shutil.rmtree(shared_cache_dir, ignore_errors=True)
     print("Exiting...")
+
+
+def prepare_workers(workers: int) -> str | None:
+    """
+    Prepare the environment inherited by worker processes.
+
+    Startup benchmarks run once here and their results are passed to workers,
+    scheduler limits are split between workers and the response cache is shared
+    through the on-disk tier. Returns a temporary cache directory to remove on exit,
+    if one was created.
+    """
+    import math
+    import os
+    import tempfile
+
+    from .best_hash import BestHash
+    from .json_codec import JsonCodec
+    from .offload import Offload
+    from .settings_base import Settings
+
+    print(f"Starting {workers} worker processes")
+    # Each worker schedules its own requests: split the limits, so all workers
+    # together keep them. A limit under the worker count is 1 per worker.
+    for name in (
+        "limit_concurrency",
+        "limit_concurrency_per_model",
+        "limit_concurrency_per_client",
+        "queue_max_size",
+    ):
+        value = str(os.getenv(name.upper(), Settings.model_fields[name].default))
+        if value.isdigit() and int(value) > 0:
+            os.environ[name.upper()] = str(math.ceil(int(value) / workers))
+            print(f"{name.upper()} per worker: {os.environ[name.upper()]}")
+    if os.getenv("HASH_ALGORITHM", "auto") == "auto":
+        os.environ["HASH_ALGORITHM"] = BestHash.select_best_hash("auto")
+        print(f"Cache key hash algorithm selected: {os.environ['HASH_ALGORITHM']}")
+    if os.getenv("JSON_BACKEND", "auto") == "auto":
+        os.environ["JSON_BACKEND"] = JsonCodec.select_best_json("auto")
+        print(f"JSON backend selected: {os.environ['JSON_BACKEND']}")
+    if os.getenv("OFFLOAD_THRESHOLD", "auto") == "auto":
+        os.environ["OFFLOAD_THRESHOLD"] = Offload.format_thresholds(Offload.calibrate())
+        Offload.shutdown()
+        print(f"Offload thresholds calibrated: {os.environ['OFFLOAD_THRESHOLD']}")
+
+    cache_enabled = os.getenv("CACHE_ENABLED", "true").lower() not in (
+        "0",
+        "false",
+        "no",
+        "off",
+    )
+    if cache_enabled and not os.getenv("CACHE_DIR"):
+        # Workers do not share memory, share cached responses through the disk tier
+        cache_dir = tempfile.mkdtemp(prefix="ollama-deproxy-cache-")
+        os.environ["CACHE_DIR"] = cache_dir
+        print(f"Shared cache directory for workers: {cache_dir}")
+        return cache_dir
+    return None
@@ -1,26 +1,147 @@
 import hashlib
 import logging
 import threading
+import time
 
-from cachetools import TTLCache
+from cachetools import TLRUCache
 from starlette.concurrency import run_in_threadpool
 
 from .best_hash import BestHash
+from .compression import Compression
 from .config import settings
+from .disk_cache import DiskCache
+from .metrics import metrics
+from .offload import Offload
 
 logger = logging.getLogger(__name__)
 
 
+class CacheEntry:
+    """
+    Cached response in a compact form. The body may be stored compressed
+    (`encoding`), headers are an interned tuple shared by entries with the same
+    headers and `variants` holds bodies compressed for clients, per encoding.
+    """
+
+    __slots__ = (
+        "content",
+        "encoding",
+        "length",
+        "status_code",
+        "headers",
+        "created_at",
+        "chunk_sizes",
+        "variants",
+    )
+
+    # Approximate memory of the entry object, key and cache links besides the bodies
+    OVERHEAD = 400
+
+    def __init__(
+        self,
+        content: bytes,
+        status_code: int,
+        headers: tuple,
+        created_at: float,
+        chunk_sizes: list[int] | None = None,
+        encoding: str | None = None,
+        length: int | None = None,
+    ):
+        self.content = content
+        self.encoding = encoding
+        self.length = len(content) if length is None else length
+        self.status_code = status_code
+        self.headers = headers
+        self.created_at = created_at
+        self.chunk_sizes = chunk_sizes
+        self.variants: dict[str, bytes] | None = None
+
+    def body(self) -> bytes:
+        """The uncompressed body."""
+        if self.encoding is None:
+            return self.content
+        return Compression.decompress(self.content, self.encoding)
+
+    def header_dict(self) -> dict:
+        return dict(self.headers)
+
+    def size(self) -> int:
+        """Bytes weight of the entry in the memory bounded cache."""
+        size = self.OVERHEAD + len(self.content)
+        if self.variants:
+            size += sum(len(body) for body in self.variants.values())
+        if self.chunk_sizes:
+            size += 8 * len(self.chunk_sizes)
+        return size
+
+
+class _TTLCache(TLRUCache):
+    """
+    TTL cache bounded by entry bytes and by the number of entries, counting evictions.
+
+    Entries expire `ttl` seconds after they were created, not after they were stored:
+    re-inserting an entry to weigh it again or promoting one from the disk tier keeps
+    its expiry.
+    """
+
+    def __init__(self, maxsize: int, ttl: int, max_entries: int):
+        super().__init__(maxsize=maxsize, ttu=self._expires, getsizeof=CacheEntry.size)
+        self.ttl = ttl
+        self.max_entries = max_entries
+
+    def _expires(self, key, value: CacheEntry, now: float) -> float:
+        # Both use time.monotonic
+        return value.created_at + self.ttl
+
+    def __setitem__(self, key, value):
+        if value.created_at + self.ttl <= self.timer():
+            # Already expired, TLRUCache would fail to remove a missing key
+            self.pop(key, None)
+            return
+        if key not in self:
+            self.expire()
+            while len(self) >= self.max_entries:
+                self.popitem()
+        super().__setitem__(key, value)
+
+    def popitem(self):
+        item = super().popitem()
+        metrics.cache_evictions.inc("memory")
+        return item
+
+
 class CacheBase:
-    """Thread-safe response cache with TTL support."""
+    """Thread-safe response cache with soft (stale-while-revalidate) and hard TTL support."""
 
     def __init__(self, maxsize: int = None, ttl: int = None):
         if not settings.cache_enabled:
             return
         maxsize = maxsize or settings.cache_maxsize
         ttl = ttl or settings.cache_ttl
-        self._cache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._cache = _TTLCache(
+            maxsize=settings.cache_memory_maxsize * 1024 * 1024,
+            ttl=ttl,
+            max_entries=maxsize,
+        )
+        # Bodies stored compressed with the preferred available encoding
+        self.store_encoding = (
+            Compression.AVAILABLE[0] if settings.cache_compress else None
+        )
+        self._headers_pool: dict[tuple, tuple] = {}
+        self.hits = 0
+        self.misses = 0
+        # After soft TTL entry is still served, but is due for a background refresh
+        self.soft_ttl = min(settings.cache_soft_ttl or ttl, ttl)
         self._lock = threading.Lock()
+        self._disk = (
+            DiskCache(
+                settings.cache_dir,
+                max_bytes=settings.cache_disk_maxsize * 1024 * 1024,
+                ttl=ttl,
+            )
+            if settings.cache_dir
+            else None
+        )
         self.selected_algo = BestHash.select_best_hash(settings.hash_algorithm)
         if settings.hash_algorithm == "auto":
             logger.info(
@@ -32,6 +153,95 @@ class CacheBase:
     def is_cached(self, path):
         return settings.cache_enabled
 
+    def is_stale(self, cached: CacheEntry) -> bool:
+        """Check whether a cached entry is older than the soft TTL."""
+        return time.monotonic() - cached.created_at >= self.soft_ttl
+
+    # Distinct header sets kept for sharing, the pool is reset when it grows over it
+    HEADERS_POOL_SIZE = 1024
+
+    def _intern_headers(self, headers: dict) -> tuple:
+        """
+        Return headers as a tuple shared by entries with the same headers. The
+        content length is left out, responses set it from the body.
+        """
+        key = tuple(
+            (k.lower(), v) for k, v in headers.items() if k.lower() != "content-length"
+        )
+        interned = self._headers_pool.get(key)
+        if interned is None:
+            if len(self._headers_pool) >= self.HEADERS_POOL_SIZE:
+                self._headers_pool.clear()
+            interned = self._headers_pool[key] = key
+        return interned
+
+    def build_entry(
+        self,
+        content: bytes,
+        status_code: int,
+        headers: dict,
+        chunk_sizes: list[int] = None,
+        age: float = 0.0,
+    ) -> CacheEntry:
+        """Build an entry, compressing the body when configured (CPU bound)."""
+        encoding = None
+        length = len(content)
+        if self.store_encoding is not None and length >= Compression.MIN_SIZE:
+            encoding = self.store_encoding
+            content = Compression.compress(content, encoding)
+        with self._lock:
+            headers = self._intern_headers(headers)
+        return CacheEntry(
+            content,
+            status_code,
+            headers,
+            created_at=time.monotonic() - age,
+            chunk_sizes=chunk_sizes,
+            encoding=encoding,
+            length=length,
+        )
+
+    async def async_build_entry(self, *args, **kwargs) -> CacheEntry:
+        if self.store_encoding is None:
+            return self.build_entry(*args, **kwargs)
+        content = kwargs["content"] if "content" in kwargs else args[0]
+        return await Offload.run(
+            "compress", len(content), self.build_entry, *args, **kwargs
+        )
+
+    def _store(self, cache_key: str, entry: CacheEntry) -> bool:
+        try:
+            self._cache[cache_key] = entry
+        except ValueError:
+            # Larger than the whole memory budget
+            logger.debug(f"Cache entry too large: {cache_key[:25]}...")
+            return False
+        return True
+
+    def add_variant(
+        self, cache_key: str | None, entry: CacheEntry, encoding: str, body: bytes
+    ):
+        """Keep a body compressed for clients in the entry, accounting its size."""
+        with self._lock:
+            if entry.variants is None:
+                entry.variants = {}
+            entry.variants[encoding] = body
+            if cache_key is not None and self._cache.get(cache_key) is entry:
+                # Re-inserted, so the cache weighs the entry with the new body, its
+                # expiry is kept
+                self._store(cache_key, entry)
+
+    def get_many(self, cache_keys: list[str]) -> list[CacheEntry | None]:
+        """Look up entries of the in-memory tier only, without hit counting."""
+        with self._lock:
+            return [self._cache.get(cache_key) for cache_key in cache_keys]
+
+    def set_many(self, entries: dict[str, CacheEntry]):
+        """Store entries in the in-memory tier only."""
+        with self._lock:
+            for cache_key, entry in entries.items():
+                self._store(cache_key, entry)
+
     def body_hash_hex_digest(self, body: bytes) -> str:
         h = hashlib.new(self.selected_algo)
         h.update(body)
@@ -47,7 +257,9 @@ class CacheBase:
     async def async_build_cache_key(
         self, path: str, method: str, body: bytes = None
     ) -> str:
-        return await run_in_threadpool(self.build_cache_key, path, method, body)
+        return await Offload.run(
+            "hash", len(body) if body else 0, self.build_cache_key, path, method, body
+        )
 
     async def set_cache(
         self,
@@ -58,23 +270,38 @@ class CacheBase:
         body: bytes = None,
         headers: dict = None,
         status_code: int = None,
-    ):
+        replace: bool = False,
+        chunk_sizes: list[int] = None,
+    ) -> CacheEntry | None:
+        """Store a response, return its entry (also when an existing one is kept)."""
         if cache_key is not None or self.is_cached(path):
             cache_key = cache_key or await self.async_build_cache_key(
                 path, method, body
             )
+            entry = await self.async_build_entry(
+                content, status_code or 200, headers or {}, chunk_sizes
+            )
             with self._lock:
-                if cache_key not in self._cache:
-                    self._cache[cache_key] = {
-                        "content": content,
-                        "status_code": status_code or 200,
-                        "headers": headers or {},
-                    }
-                    logger.debug(f"Cache set for key: {cache_key[:25]}...")
+                kept = None if replace else self._cache.get(cache_key)
+                if kept is not None:
+                    return kept
+                self._store(cache_key, entry)
+                logger.debug(f"Cache set for key: {cache_key[:25]}...")
+            if self._disk is not None:
+                await run_in_threadpool(
+                    self._disk.set,
+                    cache_key,
+                    content,
+                    status_code or 200,
+                    headers or {},
+                    chunk_sizes,
+                )
+            return entry
+        return None
 
     async def get_cache(
         self, path: str, cache_key: str = None, method: str = None, body: bytes = None
-    ) -> dict | None:
+    ) -> CacheEntry | None:
         if cache_key is not None or self.is_cached(path):
             cache_key = cache_key or await self.async_build_cache_key(
                 path, method, body
@@ -83,12 +310,70 @@ class CacheBase:
                 cached = self._cache.get(cache_key)
                 if cached is not None:
                     logger.debug(f"Cache hit for key: {cache_key[:25]}...")
-                return cached
+                    metrics.cache_hits.inc("memory")
+                    self.hits += 1
+                    return cached
+            if self._disk is not None:
+                cached = await self._get_disk_cache(cache_key)
+                if cached is not None:
+                    metrics.cache_hits.inc("disk")
+                    self.hits += 1
+                    return cached
+            metrics.cache_misses.inc()
+            self.misses += 1
         return None
 
+    async def _get_disk_cache(self, cache_key: str) -> CacheEntry | None:
+        """Look up the disk tier and lazily warm the in-memory cache on hit."""
+        stored = await run_in_threadpool(self._disk.get, cache_key)
+        if stored is None:
+            return None
+        cached = await self.async_build_entry(
+            stored["content"],
+            stored["status_code"],
+            stored["headers"],
+            stored["chunk_sizes"],
+            # Keep the original age, so soft TTL still triggers a refresh of old entries
+            age=stored["age"],
+        )
+        with self._lock:
+            existing = self._cache.get(cache_key)
+            if existing is not None:
+                cached = existing
+            else:
+                self._store(cache_key, cached)
+        logger.debug(f"Disk cache hit for key: {cache_key[:25]}...")
+        return cached
+
+    def memory_stats(self) -> dict:
+        """Return hit rate and memory usage of the in-memory tier."""
+        if getattr(self, "_lock", None) is None:
+            return {}
+        lookups = self.hits + self.misses
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+                "entries": len(self._cache),
+                "bytes": self._cache.currsize,
+            }
+
+    def collect_metrics(self):
+        stats = self.memory_stats()
+        if stats:
+            metrics.cache_entries.set(stats["entries"])
+            metrics.cache_memory_bytes.set(stats["bytes"])
+
     def clear(self):
-        """Clear the cache."""
+        """Clear the in-memory cache. The disk tier is kept to survive restarts."""
         if getattr(self, "_lock", None) is None:
             return
         with self._lock:
             self._cache.clear()
+
+    def close(self):
+        """Clear the in-memory cache and close the disk tier."""
+        self.clear()
+        if getattr(self, "_disk", None) is not None:
+            self._disk.close()
@@ -0,0 +1,99 @@
+import logging
+import math
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitOpen(Exception):
+    """Raised by the upstream transport for a request the open circuit rejects."""
+
+    def __init__(self, name: str, retry_after: int):
+        super().__init__(f"Circuit of upstream '{name}' is open")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker of one upstream.
+
+    After `failure_threshold` consecutive failures (connection errors, timeouts,
+    gateway statuses) the circuit opens and requests fail fast for `reset_timeout`
+    seconds. Then it is half-open: one probe request is let through, its success
+    closes the circuit and its failure opens it again. A threshold of 0 disables it.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, name: str, failure_threshold: int, reset_timeout: float):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_until = 0.0
+        self.probe_started = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.failure_threshold > 0
+
+    @property
+    def rejecting(self) -> bool:
+        """Requests are failed fast now."""
+        return self.state == self.OPEN and time.monotonic() < self.opened_until
+
+    @property
+    def blocked(self) -> bool:
+        """
+        Requests would be rejected now: the circuit is open, or its probe is in flight.
+        Unlike `allow()`, the probe is not claimed.
+        """
+        if self.state == self.OPEN:
+            return time.monotonic() < self.opened_until
+        if self.state == self.HALF_OPEN:
+            return time.monotonic() - self.probe_started < self.reset_timeout
+        return False
+
+    def allow(self) -> bool:
+        """
+        Check whether a request may be sent, claiming the probe when half-open.
+        Called right before the send, so the probe result is always recorded.
+        """
+        if self.state == self.CLOSED:
+            return True
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            if now < self.opened_until:
+                return False
+            self.state = self.HALF_OPEN
+        elif now - self.probe_started < self.reset_timeout:
+            # A probe is in flight. One that never reported back is replaced.
+            return False
+        self.probe_started = now
+        return True
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.opened_until - time.monotonic()))
+
+    def record_success(self):
+        self.failures = 0
+        if self.state != self.CLOSED:
+            self.state = self.CLOSED
+            logger.info(f"Circuit of upstream '{self.name}' closed")
+
+    def record_failure(self, reason: str):
+        if not self.enabled:
+            return
+        self.failures += 1
+        if self.state == self.HALF_OPEN or (
+            self.state == self.CLOSED and self.failures >= self.failure_threshold
+        ):
+            self.state = self.OPEN
+            self.opened_until = time.monotonic() + self.reset_timeout
+            logger.warning(
+                f"Circuit of upstream '{self.name}' opened for {self.reset_timeout}s "
+                f"after {self.failures} failures: {reason}"
+            )
@@ -0,0 +1,198 @@
+import logging
+import zlib
+from typing import AsyncIterator
+
+from .config import settings
+
+try:
+    import brotli
+except ImportError:
+    try:
+        import brotlicffi as brotli
+    except ImportError:
+        brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+
+class _GzipCompressor:
+    def __init__(self, level: int):
+        # wbits 31: gzip container
+        self._compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+
+class _BrotliCompressor:
+    def __init__(self, quality: int):
+        self._compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data: bytes) -> bytes:
+        # brotlicffi names it `compress`, brotli `process`
+        process = (
+            getattr(self._compressor, "process", None) or self._compressor.compress
+        )
+        return process(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.finish()
+
+
+class _ZstdCompressor:
+    def __init__(self, level: int):
+        self._compressor = zstandard.ZstdCompressor(level=level).compressobj()
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compressor.compress(data)
+
+    def flush(self) -> bytes:
+        return self._compressor.flush()
+
+
+class Compression:
+    """
+    Content-Encoding negotiation with local clients by their Accept-Encoding.
+
+    Supported encodings are gzip and, when installed (httpx extras), zstd and brotli.
+    Bodies smaller than MIN_SIZE and not textual content types are sent uncompressed.
+    """
+
+    # Preferred first, when accepted with the same quality
+    COMPRESSORS = {
+        "zstd": (_ZstdCompressor, 3) if zstandard is not None else None,
+        "br": (_BrotliCompressor, 4) if brotli is not None else None,
+        "gzip": (_GzipCompressor, 6),
+    }
+    AVAILABLE = tuple(name for name, codec in COMPRESSORS.items() if codec)
+    MIN_SIZE = 1024
+    COMPRESSIBLE_TYPES = ("application/json", "text/", "application/x-ndjson")
+    # Token streams: compression would hold tokens back until a flush
+    STREAM_TYPES = ("application/x-ndjson", "text/event-stream")
+
+    @staticmethod
+    def accepted(accept_encoding: str | None) -> dict[str, float]:
+        """Parse Accept-Encoding into encoding qualities."""
+        qualities = {}
+        for item in (accept_encoding or "").split(","):
+            name, _, params = item.partition(";")
+            name = name.strip().lower()
+            if not name:
+                continue
+            quality = 1.0
+            for param in params.split(";"):
+                key, _, value = param.partition("=")
+                if key.strip() == "q":
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0.0
+            qualities[name] = quality
+        return qualities
+
+    @classmethod
+    def accepts(cls, accept_encoding: str | None, encoding: str | None) -> bool:
+        """Check whether a client accepts a body of the encoding."""
+        if not encoding or encoding == "identity":
+            return True
+        qualities = cls.accepted(accept_encoding)
+        return qualities.get(encoding, qualities.get("*", 0.0)) > 0
+
+    @classmethod
+    def negotiate(cls, accept_encoding: str | None) -> str | None:
+        """Return the best available encoding accepted by the client, or None."""
+        qualities = cls.accepted(accept_encoding)
+        best, best_quality = None, 0.0
+        for name in cls.AVAILABLE:
+            quality = qualities.get(name, qualities.get("*", 0.0))
+            if quality > best_quality:
+                best, best_quality = name, quality
+        return best
+
+    @classmethod
+    def is_compressible(cls, content_type: str | None) -> bool:
+        content_type = (content_type or "").lower()
+        return content_type.startswith(cls.COMPRESSIBLE_TYPES)
+
+    @classmethod
+    def is_stream(cls, content_type: str | None) -> bool:
+        return (content_type or "").lower().startswith(cls.STREAM_TYPES)
+
+    @classmethod
+    def compressor(cls, encoding: str):
+        factory, level = cls.COMPRESSORS[encoding]
+        return factory(level)
+
+    @classmethod
+    def compress(cls, data: bytes, encoding: str) -> bytes:
+        compressor = cls.compressor(encoding)
+        return compressor.compress(data) + compressor.flush()
+
+    @staticmethod
+    def decompress(data: bytes, encoding: str) -> bytes:
+        if encoding == "gzip":
+            return zlib.decompress(data, 31)
+        if encoding == "br":
+            return brotli.decompress(data)
+        if encoding == "zstd":
+            return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+        raise ValueError(f"Unsupported encoding: {encoding}")
+
+    @classmethod
+    async def compress_stream(
+        cls, chunks: AsyncIterator[bytes], encoding: str
+    ) -> AsyncIterator[bytes]:
+        """Compress a body stream, without flushing before its end."""
+        compressor = cls.compressor(encoding)
+        async for chunk in chunks:
+            compressed = compressor.compress(chunk)
+            if compressed:
+                yield compressed
+        yield compressor.flush()
+
+    @classmethod
+    def choose(
+        cls, accept_encoding: str | None, headers: dict, size: int | None = None
+    ) -> str | None:
+        """
+        Return the encoding to compress an identity body with for the client, or
+        None when it should be sent as is.
+        """
+        if not settings.response_compression:
+            return None
+        if size is not None and size < cls.MIN_SIZE:
+            return None
+        headers = {k.lower(): v for k, v in headers.items()}
+        if headers.get("content-encoding", "identity") != "identity":
+            return None
+        content_type = headers.get("content-type")
+        if not cls.is_compressible(content_type) or cls.is_stream(content_type):
+            return None
+        return cls.negotiate(accept_encoding)
+
+    @staticmethod
+    def encoded_headers(headers: dict, encoding: str, size: int = None) -> dict:
+        """Headers of a body compressed by the proxy."""
+        encoded = {}
+        vary = []
+        for k, v in headers.items():
+            key = k.lower()
+            if key == "vary":
+                vary.append(v)
+            elif key not in ("content-encoding", "content-length"):
+                encoded[k] = v
+        if not any("accept-encoding" in v.lower() for v in vary):
+            vary.append("accept-encoding")
+        encoded["vary"] = ", ".join(vary)
+        encoded["content-encoding"] = encoding
+        if size is not None:
+            encoded["content-length"] = str(size)
+        return encoded
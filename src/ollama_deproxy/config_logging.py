@@ -23,3 +23,6 @@ def setup_logging():
     for pkg in system_packages:
         logging.getLogger(pkg).setLevel(logging.WARNING)
     logging.getLogger("uvicorn.error").name = "system"
+    logging.getLogger("ollama_deproxy.access").setLevel(
+        logging.INFO if settings.access_log else logging.WARNING
+    )
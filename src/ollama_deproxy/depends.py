@@ -16,6 +16,11 @@ def get_response_cache(request: Request):
     return app.state.response_cache
 
 
-def get_semaphore(request: Request):
+def get_embeddings_batcher(request: Request):
     app = request.app
-    return app.state.semaphore
+    return app.state.embeddings_batcher
+
+
+def get_scheduler(request: Request):
+    app = request.app
+    return app.state.scheduler
@@ -0,0 +1,153 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class DiskCache:
+    """
+    Persistent SQLite-backed cache tier that survives server restarts.
+
+    Entries are keyed by the same cache key as the in-memory cache and store
+    the response content, status code, headers and (for recorded streams)
+    the original chunk boundaries. Total stored content size
+    is bounded: least recently accessed entries are evicted first.
+
+    The database can be shared by several worker processes: writes are
+    upserts and the total size is re-read from the database before eviction.
+    """
+
+    # Seconds to wait for a write lock held by another worker process
+    BUSY_TIMEOUT = 30
+
+    DB_FILE_NAME = "response_cache.sqlite3"
+
+    def __init__(self, cache_dir: str | Path, max_bytes: int, ttl: int):
+        self.path = Path(cache_dir) / self.DB_FILE_NAME
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            self.path,
+            check_same_thread=False,
+            isolation_level=None,
+            timeout=self.BUSY_TIMEOUT,
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache (
+                key TEXT PRIMARY KEY,
+                content BLOB NOT NULL,
+                status_code INTEGER NOT NULL,
+                headers TEXT NOT NULL,
+                chunk_sizes TEXT,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+            """)
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS cache_accessed_at ON cache (accessed_at)"
+        )
+        self._total_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM cache"
+        ).fetchone()[0]
+        logger.info(
+            f"Disk cache opened at '{self.path}' ({self._total_bytes / 1024 / 1024:.1f} MiB used)"
+        )
+
+    def get(self, key: str) -> dict | None:
+        """Return a stored entry, or None if it is missing or expired by TTL."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT content, status_code, headers, chunk_sizes, created_at FROM cache WHERE key = ?",
+                (key,),
+            ).fetchone()
+            if row is None:
+                return None
+            content, status_code, headers, chunk_sizes, created_at = row
+            if now - created_at >= self.ttl:
+                self._delete_unlocked(key)
+                return None
+            self._conn.execute(
+                "UPDATE cache SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+        return {
+            "content": content,
+            "status_code": status_code,
+            "headers": json.loads(headers),
+            "chunk_sizes": json.loads(chunk_sizes) if chunk_sizes else None,
+            "age": now - created_at,
+        }
+
+    def set(
+        self,
+        key: str,
+        content: bytes,
+        status_code: int,
+        headers: dict,
+        chunk_sizes: list[int] = None,
+    ):
+        size = len(content)
+        if size > self.max_bytes:
+            logger.debug(f"Disk cache skip oversize entry for key: {key[:25]}...")
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO cache (key, content, status_code, headers, chunk_sizes, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    key,
+                    content,
+                    status_code,
+                    json.dumps(headers),
+                    json.dumps(chunk_sizes) if chunk_sizes else None,
+                    size,
+                    now,
+                    now,
+                ),
+            )
+            # Other worker processes may have changed the total
+            self._total_bytes = self._conn.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM cache"
+            ).fetchone()[0]
+            self._evict_unlocked()
+
+    def _delete_unlocked(self, key: str):
+        row = self._conn.execute(
+            "DELETE FROM cache WHERE key = ? RETURNING size", (key,)
+        ).fetchone()
+        if row is not None:
+            self._total_bytes -= row[0]
+
+    def _evict_unlocked(self):
+        while self._total_bytes > self.max_bytes:
+            row = self._conn.execute(
+                "DELETE FROM cache WHERE key = "
+                "(SELECT key FROM cache ORDER BY accessed_at LIMIT 1) RETURNING key, size"
+            ).fetchone()
+            if row is None:
+                self._total_bytes = 0
+                break
+            self._total_bytes -= row[1]
+            metrics.cache_evictions.inc("disk")
+            logger.debug(f"Disk cache evicted key: {row[0][:25]}...")
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM cache")
+            self._total_bytes = 0
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
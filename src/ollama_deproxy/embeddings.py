@@ -0,0 +1,327 @@
+import asyncio
+import logging
+import time
+
+from starlette.requests import Request
+from starlette.responses import Response
+
+from .cache_base import CacheBase, CacheEntry
+from .compression import Compression
+from .config import settings
+from .json_codec import JsonCodec
+from .metrics import metrics
+from .offload import Offload
+
+logger = logging.getLogger(__name__)
+
+
+class _BatchFailed(Exception):
+    """The merged upstream request failed, callers are proxied one by one."""
+
+
+class _Batch:
+    """Unique inputs of concurrent embedding requests with the same parameters."""
+
+    __slots__ = ("key", "client", "path", "params", "futures", "timer")
+
+    def __init__(self, key: tuple, client, path: str, params: dict):
+        self.key = key
+        self.client = client
+        self.path = path
+        self.params = params
+        # Input text -> future of its (vector JSON, estimated prompt tokens)
+        self.futures: dict[str, asyncio.Future] = {}
+        self.timer: asyncio.TimerHandle | None = None
+
+
+class EmbeddingsBatcher:
+    """
+    Batching and de-duplication of embedding requests (`/api/embed`, `v1/embeddings`).
+
+    Inputs of concurrent requests for the same model and parameters are collected for
+    EMBED_BATCH_WINDOW milliseconds, or until EMBED_BATCH_MAX_SIZE inputs, and sent to
+    the remote side as one request. Identical inputs are embedded once and, with the
+    response cache enabled, vectors are cached per input. Each caller gets a response
+    of its own inputs; prompt token counts are split by input length.
+
+    Requests with other inputs (token arrays, base64 encoding) are proxied as is, as
+    are callers of a failed batch, so they get the remote side error of their own.
+    """
+
+    PATHS = {
+        settings.path_proxy_ollama + "api/embed": "ollama",
+        settings.path_proxy_ollama + "v1/embeddings": "openai",
+    }
+    # Fields which do not change the vectors, left out of the cache key
+    VOLATILE_FIELDS = ("keep_alive", "user")
+
+    def __init__(self, cache: CacheBase = None):
+        self.cache = cache if settings.cache_enabled else None
+        self.window = settings.embed_batch_window / 1000
+        self.max_size = max(1, settings.embed_batch_max_size)
+        self._batches: dict[tuple, _Batch] = {}
+        # Futures of inputs in open and in flight batches, by batch key and input
+        self._inflight: dict[tuple, asyncio.Future] = {}
+        # Batch sends, referenced until done so they are not garbage collected
+        self._tasks: set[asyncio.Task] = set()
+        self.requests = 0
+        self.batches = 0
+        self.inputs = 0
+        self.duplicates = 0
+        self.cache_hits = 0
+
+    def is_batched(self, path: str, method: str) -> bool:
+        return settings.embed_batching and method == "POST" and path in self.PATHS
+
+    @staticmethod
+    def _inputs(data: dict, api: str) -> list[str] | None:
+        """Text inputs of a request, or None when it cannot be batched."""
+        if api == "openai" and data.get("encoding_format", "float") != "float":
+            return None
+        inputs = data.get("input")
+        if isinstance(inputs, str):
+            return [inputs]
+        if (
+            isinstance(inputs, list)
+            and inputs
+            and all(isinstance(text, str) for text in inputs)
+        ):
+            return inputs
+        return None
+
+    def _cache_keys(self, path: str, params: dict, inputs: list[str]) -> list[str]:
+        """Per input cache keys, hashed with the response cache algorithm (CPU bound)."""
+        namespace = JsonCodec.dumps(
+            {k: v for k, v in params.items() if k not in self.VOLATILE_FIELDS},
+            sort_keys=True,
+        )
+        return [
+            self.cache.build_cache_key(path, "embed", namespace + text.encode())
+            for text in inputs
+        ]
+
+    async def embed(
+        self,
+        request: Request,
+        path: str,
+        client,
+        ollama_helper=None,
+        rewrite_model: bool = False,
+    ) -> Response | None:
+        """
+        Serve an embedding request from the cache and a shared upstream batch. Return
+        None when the request must be proxied as is. With `rewrite_model`, a numeric
+        model is replaced by its name before merging, as on the proxied path.
+        """
+        api = self.PATHS[path]
+        body = await request.body()
+        try:
+            data = await Offload.run("json", len(body), JsonCodec.loads, body)
+        except ValueError:
+            return None
+        if not isinstance(data, dict) or not isinstance(data.get("model"), str):
+            return None
+        inputs = self._inputs(data, api)
+        if inputs is None:
+            return None
+        if rewrite_model and ollama_helper is not None and data["model"].isdigit():
+            model_name = await ollama_helper.get_model_name(int(data["model"]))
+            if model_name is not None:
+                data["model"] = model_name
+        params = {k: v for k, v in data.items() if k != "input"}
+        self.requests += 1
+
+        results: dict[str, tuple[bytes, int]] = {}
+        cache_keys = None
+        if self.cache is not None:
+            cache_keys = await Offload.run(
+                "hash",
+                sum(len(text) for text in inputs),
+                self._cache_keys,
+                path,
+                params,
+                inputs,
+            )
+            for text, entry in zip(inputs, self.cache.get_many(cache_keys)):
+                if entry is not None:
+                    results[text] = (entry.content, 0)
+            if results:
+                self.cache_hits += len(results)
+                metrics.embed_inputs.inc("cache", amount=len(results))
+
+        unique = dict.fromkeys(inputs)
+        if len(unique) < len(inputs):
+            self.duplicates += len(inputs) - len(unique)
+            metrics.embed_inputs.inc("duplicate", amount=len(inputs) - len(unique))
+        missing = [text for text in unique if text not in results]
+        if missing:
+            futures = self._submit(client, path, params, missing)
+            try:
+                done = await asyncio.gather(*(asyncio.shield(f) for f in futures))
+            except _BatchFailed:
+                return None
+            results.update(zip(missing, done))
+            if cache_keys is not None:
+                keys = dict(zip(inputs, cache_keys))
+                self.cache.set_many(
+                    {
+                        keys[text]: CacheEntry(vector, 200, (), time.monotonic())
+                        for text, (vector, _) in zip(missing, done)
+                    }
+                )
+
+        vectors = [results[text][0] for text in inputs]
+        tokens = sum(results[text][1] for text in unique)
+        if api == "ollama":
+            content = self._ollama_body(data["model"], vectors, tokens)
+        else:
+            content = self._openai_body(data["model"], vectors, tokens)
+        return await self._response(request, content)
+
+    def _submit(
+        self, client, path: str, params: dict, inputs: list[str]
+    ) -> list[asyncio.Future]:
+        """Add inputs to the open batch of the parameters, return their futures."""
+        key = (id(client), path, JsonCodec.dumps(params, sort_keys=True))
+        loop = asyncio.get_running_loop()
+        futures = []
+        for text in inputs:
+            future = self._inflight.get((key, text))
+            if future is not None:
+                self.duplicates += 1
+                metrics.embed_inputs.inc("duplicate")
+                futures.append(future)
+                continue
+            batch = self._batches.get(key)
+            if batch is None:
+                batch = self._batches[key] = _Batch(key, client, path, params)
+                batch.timer = loop.call_later(self.window, self._flush, batch)
+            future = batch.futures[text] = loop.create_future()
+            self._inflight[(key, text)] = future
+            self.inputs += 1
+            futures.append(future)
+            if len(batch.futures) >= self.max_size:
+                batch.timer.cancel()
+                self._flush(batch)
+        return futures
+
+    def _flush(self, batch: _Batch):
+        if self._batches.get(batch.key) is batch:
+            del self._batches[batch.key]
+        task = asyncio.create_task(self._send(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch: _Batch):
+        texts = list(batch.futures)
+        self.batches += 1
+        metrics.embed_batches.inc()
+        metrics.embed_inputs.inc("upstream", amount=len(texts))
+        try:
+            vectors, tokens = await self._fetch(batch, texts)
+        except Exception as e:
+            logger.warning(
+                f"Embeddings batch of {len(texts)} inputs failed, proxying each request: {e}"
+            )
+            for future in batch.futures.values():
+                if not future.done():
+                    future.set_exception(_BatchFailed(str(e)))
+                    # Callers may be gone, the exception is not an unhandled one
+                    future.exception()
+            return
+        finally:
+            # Later requests start a new batch, or hit the cache
+            for text in texts:
+                self._inflight.pop((batch.key, text), None)
+        # Prompt tokens are reported for the whole batch, split them by input length
+        total_length = sum(len(text) for text in texts) or 1
+        for text, vector in zip(texts, vectors):
+            future = batch.futures[text]
+            if not future.done():
+                future.set_result((vector, round(tokens * len(text) / total_length)))
+
+    async def _fetch(self, batch: _Batch, texts: list[str]) -> tuple[list[bytes], int]:
+        """Send one request for the batch, return vectors as JSON and prompt tokens."""
+        body = JsonCodec.dumps({**batch.params, "input": texts})
+        target_url = (
+            f"{str(batch.client.base_url).rstrip('/')}/{batch.path.lstrip('/')}"
+        )
+        response = await batch.client.post(
+            target_url, content=body, headers={"content-type": "application/json"}
+        )
+        if response.status_code != 200:
+            raise _BatchFailed(f"remote side status {response.status_code}")
+        # Parsing and serializing vectors is CPU bound
+        return await Offload.run(
+            "json",
+            len(response.content),
+            self._parse,
+            self.PATHS[batch.path],
+            response.content,
+            len(texts),
+        )
+
+    @staticmethod
+    def _parse(api: str, content: bytes, count: int) -> tuple[list[bytes], int]:
+        data = JsonCodec.loads(content)
+        if api == "ollama":
+            vectors = data.get("embeddings")
+            tokens = data.get("prompt_eval_count") or 0
+        else:
+            items = sorted(data.get("data") or [], key=lambda item: item["index"])
+            vectors = [item["embedding"] for item in items]
+            tokens = (data.get("usage") or {}).get("prompt_tokens") or 0
+        if not isinstance(vectors, list) or len(vectors) != count:
+            raise _BatchFailed(f"expected {count} embeddings")
+        return [JsonCodec.dumps(vector) for vector in vectors], tokens
+
+    @staticmethod
+    def _ollama_body(model: str, vectors: list[bytes], tokens: int) -> bytes:
+        # Vectors are spliced in as JSON, not decoded and encoded again
+        return (
+            b'{"model":'
+            + JsonCodec.dumps(model)
+            + b',"embeddings":['
+            + b",".join(vectors)
+            + b'],"prompt_eval_count":'
+            + str(tokens).encode()
+            + b"}"
+        )
+
+    @staticmethod
+    def _openai_body(model: str, vectors: list[bytes], tokens: int) -> bytes:
+        items = b",".join(
+            b'{"object":"embedding","index":%d,"embedding":%b}' % (i, vector)
+            for i, vector in enumerate(vectors)
+        )
+        return (
+            b'{"object":"list","data":['
+            + items
+            + b'],"model":'
+            + JsonCodec.dumps(model)
+            + b',"usage":{"prompt_tokens":%d,"total_tokens":%d}}' % (tokens, tokens)
+        )
+
+    @staticmethod
+    async def _response(request: Request, content: bytes) -> Response:
+        headers = {"content-type": "application/json"}
+        encoding = Compression.choose(
+            request.headers.get("accept-encoding"), headers, len(content)
+        )
+        if encoding is not None:
+            content = await Offload.run(
+                "compress", len(content), Compression.compress, content, encoding
+            )
+            headers = Compression.encoded_headers(headers, encoding, len(content))
+        return Response(content=content, status_code=200, headers=headers)
+
+    def stats(self) -> dict:
+        """Return batching and de-duplication counters."""
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "inputs": self.inputs,
+            "duplicates": self.duplicates,
+            "cache_hits": self.cache_hits,
+            "batch_size_avg": self.inputs / self.batches if self.batches else 0.0,
+        }
@@ -1,22 +1,30 @@
 import logging
 import time
+from typing import AsyncIterator, Awaitable, Callable
 
-from starlette.background import BackgroundTask
+from httpx import PoolTimeout, TransportError
 from starlette.requests import Request
 from starlette.responses import Response, StreamingResponse
 
+from .circuit_breaker import CircuitOpen
+from .compression import Compression
 from .config import settings
+from .metrics import metrics
+from .offload import Offload
 from .ollama_helper import OllamaHelper
-from .utils import filter_headers, debug_requests_data
+from .stream_stats import StreamStats, observe_stream
+from .utils import (
+    close_after,
+    debug_requests_data,
+    filter_headers,
+    filter_request_headers,
+)
 
 logger = logging.getLogger(__name__)
 
 
-def build_proxy_headers(request: Request):
-    proxy_headers = dict(request.headers)
-    proxy_headers.pop("host", None)
-    proxy_headers.pop("authorization", None)
-    return proxy_headers
+def build_proxy_headers(request: Request) -> list[tuple[bytes, bytes]]:
+    return filter_request_headers(request.scope["headers"])
 
 
 def get_duration_str(start_time: float):
@@ -27,53 +35,176 @@ def get_duration_str(start_time: float):
     return duration_str
 
 
+async def request_body_stream(request: Request) -> AsyncIterator[bytes]:
+    """Stream the request body to the remote side without buffering it in memory."""
+    async for chunk in request.stream():
+        if chunk:
+            yield chunk
+
+
+def has_request_body(request: Request) -> bool:
+    """
+    Check the request framing headers for a body. Requests without one (GET) must
+    not be sent as an empty stream: HTTP/2 servers may reset the connection.
+    """
+    if "transfer-encoding" in request.headers:
+        return True
+    return request.headers.get("content-length", "0") != "0"
+
+
+async def build_request_content(
+    request: Request,
+    ollama_helper: OllamaHelper,
+    proxy_headers: list[tuple[bytes, bytes]],
+    rewrite_model: bool,
+    method: str = "",
+    target_url: str = "",
+) -> bytes | AsyncIterator[bytes]:
+    """
+    Build request content for the remote side.
+
+    The body is buffered only when it must be inspected: for numbered model names
+    correction or request debugging. Otherwise, it is streamed as is.
+    """
+    if request is None or not has_request_body(request):
+        return b""
+    if not rewrite_model and not settings.debug_request:
+        return request_body_stream(request)
+
+    body_bytes = await request.body()
+
+    debug_requests_data(body_bytes, method, target_url)
+
+    if rewrite_model:
+        body_bytes = await ollama_helper.replace_numbered_model(body_bytes)
+    # A buffered body is sent with a length, also when the client sent it chunked
+    proxy_headers[:] = [
+        item
+        for item in proxy_headers
+        if item[0] not in (b"content-length", b"transfer-encoding")
+    ]
+    proxy_headers.append((b"content-length", str(len(body_bytes)).encode()))
+    return body_bytes
+
+
+def body_for_log(content: bytes | AsyncIterator[bytes]) -> str:
+    if isinstance(content, bytes):
+        return content.decode(errors="ignore")
+    return "<streamed body>"
+
+
 async def handler_root_response(
     path: str,
     request: Request,
     client,
     ollama_helper: OllamaHelper,
     decode_response: bool = None,
+    recorder=None,
+    compress: bool = True,
+    stream_oversized: bool = True,
+    target_url: str = None,
+    rewrite_model: bool = None,
+    on_transport_error: Callable[[], Awaitable] = None,
 ):
+    """
+    Proxy a request with a buffered response. With `compress`, an identity body is
+    compressed for the client Accept-Encoding, cached responses are stored uncompressed.
+    With `stream_oversized`, a body larger than MAX_BUFFERED_RESPONSE is streamed.
+    `target_url` and `rewrite_model` come from the route, else they are derived here.
+    `on_transport_error` is awaited when the remote side fails, e.g. to reconnect.
+    """
     # logger.debug(f"Handling root request for path: {path}")
-    target_url = f"{str(settings.remote_url).rstrip('/')}/{path.lstrip('/')}"
+    if target_url is None:
+        target_url = f"{str(client.base_url).rstrip('/')}/{path.lstrip('/')}"
+    if rewrite_model is None:
+        rewrite_model = settings.correct_numbered_model_names and not path.startswith(
+            ollama_helper.MODEL_PATH
+        )
 
     method = request.method
     query_params = request.query_params
-    decode_response = decode_response or settings.decode_response
+    # Recorded completions are replayed to any client, they are cached decoded
+    decode_response = (
+        decode_response or settings.decode_response or recorder is not None
+    )
+    accept_encoding = request.headers.get("accept-encoding")
 
     proxy_headers = build_proxy_headers(request)
 
-    body_bytes = await request.body() if request else b""
-
-    debug_requests_data(body_bytes, method, target_url)
-
-    if settings.correct_numbered_model_names and not path.startswith(
-        ollama_helper.MODEL_PATH
-    ):
-        body_bytes = await ollama_helper.replace_numbered_model(body_bytes)
-        proxy_headers["content-length"] = str(len(body_bytes))
+    body_content = await build_request_content(
+        request,
+        ollama_helper,
+        proxy_headers,
+        rewrite_model=rewrite_model,
+        method=method,
+        target_url=target_url,
+    )
+    # Bytes of a body read into memory at most, 0 for no limit
+    max_buffered = (
+        settings.max_buffered_response * 1024 * 1024 if stream_oversized else 0
+    )
     start_time = time.perf_counter()
     try:
-        async with client.stream(
+        stream_ctx = client.stream(
             method=method,
             url=target_url,
             headers=proxy_headers,
-            content=body_bytes,
+            content=body_content,
             params=query_params,
             follow_redirects=False,
-        ) as response:
-            if decode_response:
-                await response.aread()
-                response_content = response.content
-                # logger.debug(f"Response session.headers: {session.headers}")
-            else:
-                response_content = b"".join(
-                    [chunk async for chunk in response.aiter_raw()]
-                )
+        )
+        response = await stream_ctx.__aenter__()
+        try:
+            metrics.upstream_ttfb.observe(
+                time.perf_counter() - start_time, route_of(request)
+            )
+            if not Compression.accepts(
+                accept_encoding, response.headers.get("content-encoding")
+            ):
+                # The client cannot decode what the remote side sent
+                decode_response = True
+            body_iter = (
+                response.aiter_bytes() if decode_response else response.aiter_raw()
+            )
+            response_content, complete = await read_buffered(
+                body_iter, response.headers.get("content-length"), max_buffered
+            )
+        except BaseException:
+            await stream_ctx.__aexit__(None, None, None)
+            raise
+        if not complete:
+            logger.debug(
+                f"Response for /{path} exceeds {settings.max_buffered_response} MiB, streaming it"
+            )
+            return stream_to_client(
+                path,
+                request,
+                response,
+                stream_ctx,
+                prepend(response_content, body_iter),
+                decode_response,
+                start_time,
+                recorder,
+            )
+        await stream_ctx.__aexit__(None, None, None)
+    except PoolTimeout as e:
+        logger.error(f"handler_root_response: {e}")
+        return Response(
+            content="Remote side busy",
+            status_code=503,
+            headers={"retry-after": "1"},
+        )
+    except CircuitOpen as e:
+        logger.warning(f"handler_root_response: {e}")
+        return Response(
+            content="Remote side unavailable",
+            status_code=503,
+            headers={"retry-after": str(e.retry_after)},
+        )
     except Exception as e:
         logger.error(f"handler_root_response: {e}")
-        if str(e).startswith("Max outbound streams"):
-            raise
+        if on_transport_error is not None and isinstance(e, TransportError):
+            await on_transport_error()
         return Response(
             content="Error remote side",
             status_code=500,
@@ -84,54 +215,172 @@ async def handler_root_response(
 
     if response.status_code >= 400:
         logger.error(
-            f"Error [{response.status_code}] on '{target_url}' with data: {body_bytes.decode()} : {response_content.decode()}"
+            f"Error [{response.status_code}] on '{target_url}' with data: {body_for_log(body_content)} : {response_content.decode(errors='ignore')}"
+        )
+
+    stats = build_stream_stats(path, response.headers, start_time, decode_response)
+    if stats is not None:
+        stats.feed(response_content)
+        finish_stream_stats(request, stats, response.status_code)
+
+    headers = filter_headers(response.headers, decode_response=decode_response)
+    if recorder is not None:
+        recorder.record(response_content)
+        recorder.complete()
+        await recorder.save(response.status_code, headers)
+
+    encoding = (
+        Compression.choose(accept_encoding, headers, len(response_content))
+        if compress
+        else None
+    )
+    if encoding is not None:
+        response_content = await Offload.run(
+            "compress",
+            len(response_content),
+            Compression.compress,
+            response_content,
+            encoding,
         )
+        headers = Compression.encoded_headers(headers, encoding, len(response_content))
 
+    if isinstance(response_content, bytearray):
+        # Starlette sends a memoryview as is, without copying the buffer into bytes
+        response_content = memoryview(response_content)
     return Response(
         content=response_content,
         status_code=response.status_code,
-        headers=filter_headers(response.headers, decode_response=decode_response),
+        headers=headers,
     )
 
 
+async def read_buffered(
+    body_iter: AsyncIterator[bytes], content_length: str | None, max_size: int
+) -> tuple[bytes | bytearray, bool]:
+    """
+    Read a response body into a single buffer. Return the body read and whether it
+    is complete: reading stops once it exceeds `max_size` (0 for no limit).
+    """
+    if max_size and content_length and content_length.isdigit():
+        if int(content_length) > max_size:
+            return b"", False
+    first = b""
+    buffer = None
+    async for chunk in body_iter:
+        if buffer is not None:
+            buffer += chunk
+        elif not first:
+            # A body of a single chunk is used as is
+            first = chunk
+        else:
+            buffer = bytearray(first)
+            buffer += chunk
+            first = b""
+        if max_size and len(buffer if buffer is not None else first) > max_size:
+            return buffer if buffer is not None else first, False
+    return buffer if buffer is not None else first, True
+
+
+async def prepend(head: bytes | bytearray, aiter: AsyncIterator[bytes]):
+    """Yield the already read head of a body, then the rest of it."""
+    if head:
+        # Once, within the buffer limit: stream consumers expect bytes chunks
+        yield bytes(head)
+    async for chunk in aiter:
+        yield chunk
+
+
+def route_of(request: Request) -> str:
+    return getattr(request.state, "route", "")
+
+
+def build_stream_stats(
+    path: str, headers, start_time: float, decoded: bool
+) -> StreamStats | None:
+    if not settings.metrics_enabled and not settings.access_log:
+        return None
+    return StreamStats.for_response(path, headers, start_time, decoded=decoded)
+
+
+def finish_stream_stats(request: Request, stats: StreamStats, status_code: int):
+    model = getattr(request.state, "model", None)
+    stats.finish(status_code, route_of(request), model=model)
+    if model is None and stats.model:
+        # Label request metrics by the model reported in the response
+        request.state.model = stats.model
+
+
+async def record_stream(aiter, recorder):
+    """Pass stream chunks through unchanged while recording them."""
+    async for chunk in aiter:
+        recorder.record(chunk)
+        yield chunk
+    recorder.complete()
+
+
 async def handler_root_stream_response(
-    path: str, request: Request, client, ollama_helper: OllamaHelper
+    path: str,
+    request: Request,
+    client,
+    ollama_helper: OllamaHelper,
+    recorder=None,
+    target_url: str = None,
+    rewrite_model: bool = None,
+    on_transport_error: Callable[[], Awaitable] = None,
 ):
     # logger.debug(f"Handling root stream request for path: {path}")
 
-    target_url = f"{str(settings.remote_url).rstrip('/')}/{path.lstrip('/')}"
+    if target_url is None:
+        target_url = f"{str(client.base_url).rstrip('/')}/{path.lstrip('/')}"
+    if rewrite_model is None:
+        rewrite_model = settings.correct_numbered_model_names
 
     method = request.method
     query_params = request.query_params
 
     proxy_headers = build_proxy_headers(request)
 
-    # async def request_body():
-    #     async for chunk in request.stream():
-    #         yield chunk
     start_time = time.perf_counter()
     try:
-        body_bytes = await request.body() if request else b""
-
-        debug_requests_data(body_bytes, method, target_url)
-
-        if settings.correct_numbered_model_names:
-            body_bytes = await ollama_helper.replace_numbered_model(body_bytes)
-            proxy_headers["content-length"] = str(len(body_bytes))
+        body_content = await build_request_content(
+            request,
+            ollama_helper,
+            proxy_headers,
+            rewrite_model=rewrite_model,
+            method=method,
+            target_url=target_url,
+        )
 
         stream_ctx = client.stream(
             method=method,
             url=target_url,
             headers=proxy_headers,
-            content=body_bytes,
+            content=body_content,
             params=query_params,
             follow_redirects=False,
         )
         response = await stream_ctx.__aenter__()
+        metrics.upstream_ttfb.observe(
+            time.perf_counter() - start_time, route_of(request)
+        )
+    except PoolTimeout as e:
+        logger.error(f"handler_root_stream_response: {e}")
+        return Response(
+            content="Remote side busy",
+            status_code=503,
+            headers={"retry-after": "1"},
+        )
+    except CircuitOpen as e:
+        logger.warning(f"handler_root_stream_response: {e}")
+        return Response(
+            content="Remote side unavailable",
+            status_code=503,
+            headers={"retry-after": str(e.retry_after)},
+        )
     except Exception as e:
         logger.error(f"handler_root_stream_response: {e}")
-        if str(e).startswith("Max outbound streams"):
-            raise
+        if on_transport_error is not None and isinstance(e, TransportError):
+            await on_transport_error()
         return Response(
             content="Error remote side",
             status_code=500,
@@ -143,7 +392,7 @@ async def handler_root_stream_response(
 
         # 2. Log it safely
         logger.error(
-            f"Remote Error [{response.status_code}] on {target_url}. Body {body_bytes.decode()}: {error_content.decode(errors='ignore')}"
+            f"Remote Error [{response.status_code}] on {target_url}. Body {body_for_log(body_content)}: {error_content.decode(errors='ignore')}"
         )
 
         # 3. Clean up the stream context since we won't be streaming anymore
@@ -153,22 +402,81 @@ async def handler_root_stream_response(
         return Response(
             content=error_content,
             status_code=response.status_code,
-            headers=filter_headers(response.headers),
+            # aread() decoded the body
+            headers=filter_headers(response.headers, decode_response=True),
         )
 
     # --- SUCCESS PATH ---
-    response_aiter_method = (
-        response.aiter_bytes() if settings.decode_response else response.aiter_raw()
+    accept_encoding = request.headers.get("accept-encoding")
+    # Recorded completions are replayed to any client, they are cached decoded
+    decoded = (
+        settings.decode_response
+        or recorder is not None
+        or not Compression.accepts(
+            accept_encoding, response.headers.get("content-encoding")
+        )
+    )
+    response_aiter_method = response.aiter_bytes() if decoded else response.aiter_raw()
+    return stream_to_client(
+        path,
+        request,
+        response,
+        stream_ctx,
+        response_aiter_method,
+        decoded,
+        start_time,
+        recorder,
     )
 
+
+def stream_to_client(
+    path: str,
+    request: Request,
+    response,
+    stream_ctx,
+    response_aiter_method: AsyncIterator[bytes],
+    decoded: bool,
+    start_time: float,
+    recorder=None,
+) -> StreamingResponse:
+    """Stream a remote response body to the client, the stream is closed at its end."""
+    accept_encoding = request.headers.get("accept-encoding")
+    headers = filter_headers(response.headers, decode_response=decoded)
+    if recorder is not None:
+        response_aiter_method = record_stream(response_aiter_method, recorder)
+    stats = build_stream_stats(path, response.headers, start_time, decoded)
+    if stats is not None:
+        response_aiter_method = observe_stream(response_aiter_method, stats)
+
+    # Buffered bodies (not token streams) are compressed for the client, when sent as is
+    content_length = response.headers.get("content-length")
+    encoding = Compression.choose(
+        accept_encoding,
+        headers,
+        int(content_length) if content_length and content_length.isdigit() else None,
+    )
+    client_headers = headers
+    if encoding is not None:
+        response_aiter_method = Compression.compress_stream(
+            response_aiter_method, encoding
+        )
+        client_headers = Compression.encoded_headers(headers, encoding)
+
+    route = route_of(request)
+
     async def cleanup_and_log():
         await stream_ctx.__aexit__(None, None, None)
+        if recorder is not None:
+            await recorder.save(response.status_code, headers)
+        metrics.stream_duration.observe(time.perf_counter() - start_time, route)
+        if stats is not None:
+            finish_stream_stats(request, stats, response.status_code)
         duration_str = get_duration_str(start_time)
         logger.debug(f"*** Finished up stream for /{path} in {duration_str}")
 
+    # Not a background task: it would be skipped when the remote side fails mid-stream
     return StreamingResponse(
-        response_aiter_method,
+        close_after(response_aiter_method, cleanup_and_log),
         status_code=response.status_code,
-        headers=filter_headers(response.headers),
-        background=BackgroundTask(cleanup_and_log),
+        headers=client_headers,
     )
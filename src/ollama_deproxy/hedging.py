@@ -0,0 +1,113 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable
+
+from httpx import Request, Response
+
+logger = logging.getLogger(__name__)
+
+
+class Hedger:
+    """
+    Hedged requests for idempotent calls without a body.
+
+    When a request takes longer than the 95th percentile of recent response times,
+    a second attempt is sent and the first response wins, the other is cancelled.
+    Hedging starts once enough response times are observed.
+    """
+
+    WINDOW = 200
+    MIN_SAMPLES = 20
+    PERCENTILE = 0.95
+    # Never hedge sooner, fast calls are not worth a duplicate
+    MIN_DELAY = 0.05
+
+    def __init__(self):
+        self._samples: deque[float] = deque(maxlen=self.WINDOW)
+        self._delay: float | None = None
+        self._observed = 0
+
+    @staticmethod
+    def is_hedgeable(request: Request) -> bool:
+        if request.method not in ("GET", "HEAD"):
+            return False
+        headers = request.headers
+        return (
+            "transfer-encoding" not in headers
+            and headers.get("content-length", "0") == "0"
+        )
+
+    def observe(self, seconds: float):
+        self._samples.append(seconds)
+        self._observed += 1
+        # Percentile is recomputed only every few samples
+        if len(self._samples) >= self.MIN_SAMPLES and self._observed % 10 == 0:
+            ordered = sorted(self._samples)
+            p95 = ordered[min(len(ordered) - 1, int(len(ordered) * self.PERCENTILE))]
+            self._delay = max(p95, self.MIN_DELAY)
+
+    @property
+    def delay(self) -> float | None:
+        return self._delay
+
+    async def send(
+        self, request: Request, send: Callable[[Request], Awaitable[Response]]
+    ) -> tuple[Response, bool]:
+        """Send the request, hedged after the delay. Return the response and if it was hedged."""
+        start_time = time.perf_counter()
+        first = asyncio.ensure_future(send(request))
+        delay = self._delay
+        if delay is not None:
+            done, _ = await asyncio.wait({first}, timeout=delay)
+            if not done:
+                # Separate request object: the transport annotates request extensions
+                retry = Request(
+                    request.method,
+                    request.url,
+                    headers=request.headers,
+                    extensions=dict(request.extensions),
+                )
+                second = asyncio.ensure_future(send(retry))
+                response, winner = await self._race([first, second])
+                self.observe(time.perf_counter() - start_time)
+                return response, winner is second
+        response = await first
+        self.observe(time.perf_counter() - start_time)
+        return response, False
+
+    @classmethod
+    async def _race(
+        cls, tasks: list[asyncio.Future]
+    ) -> tuple[Response, asyncio.Future]:
+        """Return the first successful response, or raise the last error."""
+        pending = set(tasks)
+        error = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                winner = None
+                for task in done:
+                    if task.exception() is not None:
+                        error = task.exception()
+                    elif winner is None:
+                        winner = task
+                    else:
+                        cls._discard(task)
+                if winner is not None:
+                    return winner.result(), winner
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+                task.add_done_callback(cls._discard)
+
+    @staticmethod
+    def _discard(task: asyncio.Future):
+        """Close the response of a losing attempt."""
+        if task.cancelled() or task.exception() is not None:
+            return
+        asyncio.ensure_future(task.result().aclose())
@@ -1,9 +1,30 @@
+import asyncio
+import itertools
 import logging
+import time
 from asyncio import Lock
 
-from httpx import AsyncClient, __version__, Limits, Timeout, AsyncHTTPTransport
+from httpx import (
+    AsyncBaseTransport,
+    AsyncByteStream,
+    AsyncClient,
+    __version__,
+    ConnectError,
+    ConnectTimeout,
+    Limits,
+    PoolTimeout,
+    Request,
+    Response,
+    Timeout,
+    TransportError,
+)
 
+from ollama_deproxy.circuit_breaker import CircuitBreaker, CircuitOpen
 from ollama_deproxy.config import settings
+from ollama_deproxy.hedging import Hedger
+from ollama_deproxy.json_codec import JsonCodec
+from ollama_deproxy.metrics import metrics
+from ollama_deproxy.upstream_pool import AdaptivePool
 
 from dataclasses import dataclass
 
@@ -13,16 +34,146 @@ logger = logging.getLogger(__name__)
 @dataclass(frozen=True, slots=True)
 class HttpConnectionOptions:
     base_url = str(settings.remote_url)
-    retries: int = 10
+    retries: int = settings.remote_connect_retries
     timeout: int = settings.remote_timeout
     http2: bool = settings.remote_url_http2
     follow_redirects: bool = True
     user_agent: str = f"Ollama-DeProxy/{settings.app_version};httpx/{__version__}"
 
 
+class Upstream:
+    """One remote backend with its own client, connection pool and health state."""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        # Remote paths are appended to it, as the client base URL
+        self.url_prefix = base_url.rstrip("/") + "/"
+        self.client: AsyncClient | None = None
+        self.transport: AdaptivePool | None = None
+        self.outstanding = 0
+        self.ejected_until = 0.0
+        self.models: frozenset[str] | None = None
+        self.models_updated_at = 0.0
+        self.breaker = CircuitBreaker(
+            base_url,
+            failure_threshold=settings.circuit_breaker_threshold,
+            reset_timeout=settings.circuit_breaker_reset_time,
+        )
+        self.hedger = Hedger() if settings.hedge_requests else None
+
+    @property
+    def healthy(self) -> bool:
+        return self.ejected_until <= time.monotonic() and not self.breaker.rejecting
+
+    def eject(self, reason: str):
+        if self.healthy:
+            logger.warning(
+                f"Upstream '{self.base_url}' ejected for {settings.upstream_eject_time}s: {reason}"
+            )
+        self.ejected_until = time.monotonic() + settings.upstream_eject_time
+
+    def restore(self):
+        if not self.healthy:
+            logger.info(f"Upstream '{self.base_url}' is healthy again")
+        self.ejected_until = 0.0
+
+    def has_model(self, model: str) -> bool:
+        return self.models is not None and model in self.models
+
+    def pool_usage(self) -> tuple[int, int, int]:
+        """Return (idle, active, waiting) counts of the connection pool."""
+        if self.transport is None:
+            return 0, 0, 0
+        return self.transport.pool_usage()
+
+
+class _ReleasingStream(AsyncByteStream):
+    """Response stream that releases the upstream outstanding slot once closed."""
+
+    def __init__(self, stream: AsyncByteStream, upstream: Upstream):
+        self._stream = stream
+        self._upstream = upstream
+        self._released = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            if not self._released:
+                self._released = True
+                self._upstream.outstanding -= 1
+
+
+class UpstreamTransport(AsyncBaseTransport):
+    """
+    Transport wrapper that counts outstanding requests of an upstream, including
+    streamed responses until they are closed, ejects it on connection failures,
+    is gated by and feeds its circuit breaker and hedges idempotent calls when enabled.
+    """
+
+    # Statuses of a proxy in front of an unavailable remote side
+    FAILURE_STATUSES = frozenset((502, 503, 504))
+
+    def __init__(self, transport: AsyncBaseTransport, upstream: Upstream):
+        self._transport = transport
+        self._upstream = upstream
+
+    async def _send(self, request: Request) -> Response:
+        hedger = self._upstream.hedger
+        if hedger is None or not hedger.is_hedgeable(request):
+            return await self._transport.handle_async_request(request)
+        response, hedged = await hedger.send(
+            request, self._transport.handle_async_request
+        )
+        if hedged:
+            metrics.hedged_requests.inc(self._upstream.base_url)
+        return response
+
+    async def handle_async_request(self, request: Request) -> Response:
+        upstream = self._upstream
+        if not upstream.breaker.allow():
+            metrics.circuit_rejected.inc(upstream.base_url)
+            raise CircuitOpen(upstream.base_url, upstream.breaker.retry_after())
+        upstream.outstanding += 1
+        try:
+            response = await self._send(request)
+        except (ConnectError, ConnectTimeout) as e:
+            upstream.outstanding -= 1
+            upstream.eject(f"{type(e).__name__}: {e}")
+            upstream.breaker.record_failure(f"{type(e).__name__}: {e}")
+            raise
+        except PoolTimeout:
+            # Local pool saturation, not a failure of the remote side
+            upstream.outstanding -= 1
+            raise
+        except TransportError as e:
+            upstream.outstanding -= 1
+            upstream.breaker.record_failure(f"{type(e).__name__}: {e}")
+            raise
+        except BaseException:
+            upstream.outstanding -= 1
+            raise
+        if response.status_code in self.FAILURE_STATUSES:
+            upstream.breaker.record_failure(f"status {response.status_code}")
+        else:
+            upstream.breaker.record_success()
+        response.stream = _ReleasingStream(response.stream, upstream)
+        return response
+
+    async def aclose(self):
+        await self._transport.aclose()
+
+
 class HttpConnection:
+    HEALTH_PATH = settings.path_proxy_ollama + "api/version"
+    MODELS_PATH = settings.path_proxy_ollama + "api/tags"
+    HEALTH_PROBE_TIMEOUT = 5.0
+
     def __init__(self) -> None:
-        self.client: AsyncClient | None = None
         self._lock = Lock()
         self.options = HttpConnectionOptions()
         self.headers = {"user-agent": self.options.user_agent}
@@ -31,41 +182,216 @@ class HttpConnection:
                 settings.remote_auth_token.get_secret_value()
             )
         self.limits = Limits(
-            max_connections=1000,  # Total allowed connections
-            max_keepalive_connections=100,  # Allow more idle connections to stay open
-            keepalive_expiry=5.0,
+            max_connections=settings.pool_max_connections,
+            max_keepalive_connections=settings.pool_max_keepalive_connections,
+            keepalive_expiry=settings.pool_keepalive_expiry,
         )
-        self.transport = AsyncHTTPTransport(retries=self.options.retries)
         self.timeout = (
-            Timeout(self.options.timeout) if self.options.timeout is not None else None
+            Timeout(self.options.timeout, pool=settings.pool_timeout)
+            if self.options.timeout is not None
+            else None
         )
+        self.upstreams = [Upstream(str(url)) for url in settings.remote_urls] or [
+            Upstream(self.options.base_url)
+        ]
+        self.policy = settings.upstream_policy
+        self._round_robin = itertools.count()
+        self._health_task: asyncio.Task | None = None
+        self._keepalive_task: asyncio.Task | None = None
 
-    async def get_client(self) -> AsyncClient:
-        async with self._lock:
-            if self.client is None:
-                self.client = AsyncClient(
-                    base_url=self.options.base_url,
-                    http2=self.options.http2,
-                    headers=self.headers,
-                    follow_redirects=self.options.follow_redirects,
-                    limits=self.limits,
-                    timeout=self.timeout,
-                    transport=self.transport,
+    @property
+    def client(self) -> AsyncClient | None:
+        return self.upstreams[0].client
+
+    @property
+    def balanced(self) -> bool:
+        return len(self.upstreams) > 1
+
+    def _build_client(self, upstream: Upstream) -> AsyncClient:
+        transport = AdaptivePool(
+            http2=self.options.http2,
+            limits=self.limits,
+            retries=self.options.retries,
+            pool_timeout=settings.pool_timeout,
+            name=upstream.base_url,
+        )
+        upstream.transport = transport
+        return AsyncClient(
+            base_url=upstream.base_url,
+            http2=self.options.http2,
+            headers=self.headers,
+            follow_redirects=self.options.follow_redirects,
+            limits=self.limits,
+            timeout=self.timeout,
+            transport=UpstreamTransport(transport, upstream),
+        )
+
+    def select_upstream(self, model: str | None = None) -> Upstream:
+        """
+        Pick an upstream by the configured policy.
+
+        Ejected upstreams are skipped while any healthy one is left. When a model is
+        given, only upstreams whose `api/tags` lists it are considered, if any does.
+        """
+        if not self.balanced:
+            return self.upstreams[0]
+        candidates = [u for u in self.upstreams if u.healthy] or self.upstreams
+        if model:
+            if ":" not in model:
+                model = f"{model}:latest"
+            candidates = [u for u in candidates if u.has_model(model)] or candidates
+        # Rotate the start, so ties of least outstanding are spread too
+        start = next(self._round_robin) % len(candidates)
+        if self.policy == "round_robin":
+            return candidates[start]
+        candidates = candidates[start:] + candidates[:start]
+        return min(candidates, key=lambda u: u.outstanding)
+
+    async def get_client(self, model: str | None = None) -> AsyncClient:
+        return await self.client_of(self.select_upstream(model))
+
+    async def client_of(self, upstream: Upstream) -> AsyncClient:
+        if upstream.client is None:
+            async with self._lock:
+                if upstream.client is None:
+                    upstream.client = self._build_client(upstream)
+        return upstream.client
+
+    async def warm_up(self):
+        """Open `POOL_WARM_CONNECTIONS` connections to each upstream ahead of requests."""
+        count = settings.pool_warm_connections
+        if count <= 0:
+            return
+        start_time = time.perf_counter()
+        results = await asyncio.gather(
+            *(self._warm(upstream, count) for upstream in self.upstreams),
+            return_exceptions=True,
+        )
+        opened = sum(r for r in results if isinstance(r, int))
+        logger.info(
+            f"Upstream connections warm up: {opened} in {time.perf_counter() - start_time:.3f}s"
+        )
+
+    async def _warm(self, upstream: Upstream, count: int) -> int:
+        client = await self.client_of(upstream)
+        return await asyncio.wait_for(
+            upstream.transport.warm(
+                lambda: client.build_request("GET", self.HEALTH_PATH), count
+            ),
+            timeout=self.HEALTH_PROBE_TIMEOUT,
+        )
+
+    def start_keepalive(self):
+        """Ping idle warm connections, so they are not closed by keep-alive expiry."""
+        interval = settings.pool_ping_interval
+        if interval > 0 and settings.pool_warm_connections > 0:
+            if self._keepalive_task is None:
+                self._keepalive_task = asyncio.create_task(
+                    self._keepalive_loop(interval)
                 )
-            return self.client
 
-    async def re_connect(self) -> AsyncClient:
-        logger.info("Reconnecting to Ollama server...")
+    async def _keepalive_loop(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            for upstream in self.upstreams:
+                if (
+                    upstream.transport is not None
+                    and upstream.transport.idle_time() >= interval
+                ):
+                    try:
+                        await self._warm(upstream, settings.pool_warm_connections)
+                    except Exception as e:
+                        logger.debug(
+                            f"Upstream '{upstream.base_url}' ping failed: {type(e).__name__}: {e}"
+                        )
+
+    def collect_metrics(self):
+        for upstream in self.upstreams:
+            idle, active, waiting = upstream.pool_usage()
+            metrics.upstream_outstanding.set(upstream.outstanding, upstream.base_url)
+            metrics.upstream_healthy.set(int(upstream.healthy), upstream.base_url)
+            metrics.circuit_open.set(int(upstream.breaker.rejecting), upstream.base_url)
+            metrics.upstream_connections.set(idle, upstream.base_url, "idle")
+            metrics.upstream_connections.set(active, upstream.base_url, "active")
+            metrics.upstream_pool_waiting.set(waiting, upstream.base_url)
+
+    def start_health_checks(self):
+        """Start background health probes, only useful with multiple upstreams."""
+        if self.balanced and self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.gather(
+                *(self._probe(upstream) for upstream in self.upstreams)
+            )
+            await asyncio.sleep(settings.upstream_health_interval)
+
+    async def _probe(self, upstream: Upstream):
+        await self.client_of(upstream)
+        try:
+            # Bound the whole probe, transport level connect retries included
+            response = await asyncio.wait_for(
+                upstream.client.get(self.HEALTH_PATH),
+                timeout=self.HEALTH_PROBE_TIMEOUT,
+            )
+            if response.status_code >= 500:
+                upstream.eject(f"health probe status {response.status_code}")
+                return
+            upstream.restore()
+            if (
+                upstream.models is None
+                or time.monotonic() - upstream.models_updated_at
+                >= (settings.models_refresh_interval or 300)
+            ):
+                await self._update_models(upstream)
+        except CircuitOpen:
+            # Not sent, the circuit probe will tell when the remote side is back
+            return
+        except Exception as e:
+            upstream.eject(f"health probe failed: {type(e).__name__}: {e}")
+
+    async def _update_models(self, upstream: Upstream):
+        response = await asyncio.wait_for(
+            upstream.client.get(self.MODELS_PATH),
+            timeout=self.HEALTH_PROBE_TIMEOUT,
+        )
+        if response.status_code >= 400:
+            return
+        try:
+            data = JsonCodec.loads(response.content)
+            models = frozenset(m.get("name") for m in data.get("models") or [])
+        except (ValueError, AttributeError):
+            return
+        upstream.models = models
+        upstream.models_updated_at = time.monotonic()
+        logger.debug(f"Upstream '{upstream.base_url}' serves {len(models)} models")
+
+    async def re_connect(self, upstream: Upstream = None) -> AsyncClient:
+        """
+        Replace the connections of an upstream, or of all when not given. Streams in
+        flight on the old connections are finished before those are closed, so
+        healthy requests are not affected.
+        """
+        upstreams = [upstream] if upstream is not None else self.upstreams
         async with self._lock:
-            await self._close_unlocked()
-            return await self.get_client()
+            for item in upstreams:
+                logger.info(f"Reconnecting to Ollama server '{item.base_url}'...")
+                if item.transport is not None:
+                    await item.transport.retire()
+        return await self.client_of(upstreams[0])
 
     async def _close_unlocked(self):
-        if self.client is not None:
-            await self.client.aclose()
-            self._client = None
+        for upstream in self.upstreams:
+            if upstream.client is not None:
+                await upstream.client.aclose()
+                upstream.client = None
 
     async def aclose(self):
+        for task in (self._health_task, self._keepalive_task):
+            if task is not None:
+                task.cancel()
+        self._health_task = self._keepalive_task = None
         async with self._lock:
             await self._close_unlocked()
 
@@ -0,0 +1,157 @@
+import importlib
+import json
+import logging
+import threading
+import timeit
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+
+def _stdlib_loads(data: bytes | str) -> Any:
+    return json.loads(data)
+
+
+def _stdlib_dumps(obj: Any, sort_keys: bool = False) -> bytes:
+    return json.dumps(
+        obj, ensure_ascii=False, separators=(",", ":"), sort_keys=sort_keys
+    ).encode()
+
+
+def _orjson_codec() -> tuple[Callable, Callable]:
+    orjson = importlib.import_module("orjson")
+
+    def dumps(obj: Any, sort_keys: bool = False) -> bytes:
+        return orjson.dumps(obj, option=orjson.OPT_SORT_KEYS if sort_keys else 0)
+
+    return orjson.loads, dumps
+
+
+def _msgspec_codec() -> tuple[Callable, Callable]:
+    msgspec_json = importlib.import_module("msgspec.json")
+    decoder = msgspec_json.Decoder()
+    encoder = msgspec_json.Encoder()
+    sorted_encoder = msgspec_json.Encoder(order="sorted")
+
+    def dumps(obj: Any, sort_keys: bool = False) -> bytes:
+        return (sorted_encoder if sort_keys else encoder).encode(obj)
+
+    return decoder.decode, dumps
+
+
+class JsonCodec:
+    """
+    JSON codec for the request path with a pluggable backend.
+
+    Uses orjson or msgspec when installed and falls back to stdlib json.
+    All backends raise ValueError subclasses on invalid input and `dumps` returns
+    compact UTF-8 bytes (no ASCII escaping).
+    """
+
+    _BACKENDS: dict[str, Callable[[], tuple[Callable, Callable]]] = {
+        "orjson": _orjson_codec,
+        "msgspec": _msgspec_codec,
+        "json": lambda: (_stdlib_loads, _stdlib_dumps),
+    }
+    _SELECTED_BACKEND_NAME: str | None = None
+    _BACKEND_SELECT_LOCK = threading.Lock()
+    _loads: Callable[[bytes | str], Any] = staticmethod(_stdlib_loads)
+    _dumps: Callable[..., bytes] = staticmethod(_stdlib_dumps)
+
+    @classmethod
+    def loads(cls, data: bytes | str) -> Any:
+        return cls._loads(data)
+
+    @classmethod
+    def dumps(cls, obj: Any, sort_keys: bool = False) -> bytes:
+        return cls._dumps(obj, sort_keys=sort_keys)
+
+    @classmethod
+    def available_backends(cls) -> dict[str, tuple[Callable, Callable]]:
+        backends = {}
+        for name, factory in cls._BACKENDS.items():
+            try:
+                backends[name] = factory()
+            except ImportError:
+                continue
+        return backends
+
+    @classmethod
+    def measure_json_speed(
+        cls, *, number_iterations: int = 200, repeat: int = 5
+    ) -> dict[str, float]:
+        """
+        Benchmark available JSON backends on a typical `api/tags`-like payload using timeit.
+
+        Returns: {backend_name: round_trips_per_sec}
+        """
+        sample = {
+            "models": [
+                {
+                    "name": f"model-{i}:latest",
+                    "modified_at": "2026-03-12T10:00:00.000000000Z",
+                    "size": 4_661_224_676 + i,
+                    "digest": f"{i:064x}",
+                    "details": {
+                        "format": "gguf",
+                        "family": "llama",
+                        "parameter_size": "8.0B",
+                        "quantization_level": "Q4_K_M",
+                    },
+                }
+                for i in range(64)
+            ]
+        }
+        data = _stdlib_dumps(sample)
+        results: dict[str, float] = {}
+
+        for name, (loads, dumps) in cls.available_backends().items():
+            logger.debug(f"Measuring {name} JSON speed...")
+
+            def one() -> None:
+                dumps(loads(data))
+
+            one()
+            best_seconds = min(
+                timeit.repeat(one, number=number_iterations, repeat=repeat)
+            )
+            results[name] = (
+                number_iterations / best_seconds if best_seconds > 0 else 0.0
+            )
+            logger.debug(
+                f"Measured {name} JSON speed: {results[name]:.0f} round trips/s"
+            )
+
+        return results
+
+    @classmethod
+    def select_best_json(cls, backend: str = "auto") -> str:
+        """Select (and cache) the JSON backend, benchmarking the available ones for 'auto'."""
+        if cls._SELECTED_BACKEND_NAME is not None and backend in (
+            "auto",
+            cls._SELECTED_BACKEND_NAME,
+        ):
+            return cls._SELECTED_BACKEND_NAME
+
+        with cls._BACKEND_SELECT_LOCK:
+            backends = cls.available_backends()
+            if backend == "auto":
+                logger.info("JSON backend auto-selection...")
+                speeds = cls.measure_json_speed()
+                backend = max(speeds, key=speeds.get)
+                logger.info(
+                    f"JSON backend auto-selection complete: {backend} ("
+                    + ", ".join(f"{k}: {v:.0f}/s" for k, v in speeds.items())
+                    + f"). Can store it on .env file 'JSON_BACKEND={backend}' for skip autodetection next time."
+                )
+            elif backend not in backends:
+                logger.warning(
+                    f"JSON backend '{backend}' is not installed, using 'json'"
+                )
+                backend = "json"
+            else:
+                logger.info("JSON backend selected: %s", backend)
+
+            cls._loads, cls._dumps = backends[backend]
+            cls._SELECTED_BACKEND_NAME = backend
+            return backend
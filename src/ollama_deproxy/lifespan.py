@@ -3,20 +3,41 @@ from contextlib import asynccontextmanager
 
 from fastapi import FastAPI
 
+from .config import settings
+from .embeddings import EmbeddingsBatcher
+from .json_codec import JsonCodec
+from .metrics import metrics
+from .offload import Offload
 from .response_cache import ResponseCache
 from .ollama_helper import OllamaHelper
-from .services import build_semaphore, build_http_connection
+from .services import build_scheduler, build_http_connection
 
 logger = logging.getLogger(__name__)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    JsonCodec.select_best_json(settings.json_backend)
     app.state.response_cache = ResponseCache()
+    # Calibrated with the selected JSON backend and cache key hash algorithm
+    Offload.configure(settings.offload_threshold, settings.offload_workers)
     app.state.http_connection = build_http_connection()
     client = await app.state.http_connection.get_client()
+    await app.state.http_connection.warm_up()
+    app.state.http_connection.start_health_checks()
+    app.state.http_connection.start_keepalive()
     app.state.ollama_helper = OllamaHelper(client, app.state.response_cache)
-    app.state.semaphore = build_semaphore()
+    app.state.scheduler = build_scheduler()
+    app.state.embeddings_batcher = EmbeddingsBatcher(app.state.response_cache)
+    metrics.set_collector("http_connection", app.state.http_connection.collect_metrics)
+    metrics.set_collector("scheduler", app.state.scheduler.collect_metrics)
+    metrics.set_collector("response_cache", app.state.response_cache.collect_metrics)
     yield
     await app.state.http_connection.aclose()
-    app.state.response_cache.clear()
+    logger.info(f"Response cache stats: {app.state.response_cache.stats()}")
+    logger.info(f"Scheduler stats: {app.state.scheduler.stats()}")
+    if settings.embed_batching:
+        logger.info(f"Embeddings stats: {app.state.embeddings_batcher.stats()}")
+    app.state.response_cache.close()
+    logger.info(f"Offload stats: {Offload.stats()}")
+    Offload.shutdown()
@@ -1,19 +1,27 @@
 import logging
+from functools import partial
 
 from fastapi import FastAPI, Depends
 from starlette.requests import Request
 from starlette.responses import Response
 
+from .circuit_breaker import CircuitOpen
 from .config import settings
 from .config_logging import setup_logging
 from .depends import (
-    get_semaphore,
+    get_embeddings_batcher,
+    get_scheduler,
     get_ollama_helper,
     get_response_cache,
     get_http_connection,
 )
 from .handlers import handler_root_response, handler_root_stream_response
 from .lifespan import lifespan
+from .metrics import MetricsMiddleware, metrics
+from .ollama_helper import OllamaHelper
+from .response_cache import ResponseCache
+from .routes import RouteTable
+from .scheduler import SchedulerRejected
 
 setup_logging()
 
@@ -31,31 +39,23 @@ app = FastAPI(
     redirect_slashes=False,
 )
 
-ollama_compatible_prefixes = {"api", "v1"}
-anthropic_compatibility_prefixes = ("v1/messages",)
-
-
-def gen_path(path: str):
-    path_split = path.split("/", maxsplit=1)[0]
-    if path_split == "":
-        return path, path_split
-
-    for prefix in anthropic_compatibility_prefixes:
-        if path.startswith(prefix):
-            path = settings.path_api + path
-            logger.debug(
-                f"Proxying request corrected to '{path}' for Anthropic compatibility"
-            )
-            return path, path_split
+route_table = RouteTable(
+    cached_paths=ResponseCache.CACHED_PATHS,
+    completion_paths=ResponseCache.COMPLETION_PATHS,
+    model_path=OllamaHelper.MODEL_PATH,
+)
 
-    if path_split in ollama_compatible_prefixes:
-        path = settings.path_proxy_ollama + path
-        return path, path_split
 
-    path = settings.path_proxy_ollama + "v1/" + path
-    logger.debug(f"Proxying request corrected to '{path}' for OpenAI compatibility")
+if settings.metrics_enabled:
+    metrics_path = "/" + settings.metrics_path.strip("/")
+    app.add_middleware(
+        MetricsMiddleware, route_label=route_table.label, exclude_path=metrics_path
+    )
 
-    return path, path_split
+    # Registered before the catch-all route, so the path is never proxied
+    @app.get(metrics_path, include_in_schema=False)
+    async def metrics_endpoint():
+        return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
 
 
 @app.api_route(
@@ -67,30 +67,83 @@ async def root(
     http_connection=Depends(get_http_connection),
     ollama_helper=Depends(get_ollama_helper),
     response_cache=Depends(get_response_cache),
-    semaphore=Depends(get_semaphore),
+    scheduler=Depends(get_scheduler),
+    embeddings_batcher=Depends(get_embeddings_batcher),
 ):
-    path, path_split = gen_path(path)
-    if path_split == "":
+    route = route_table.resolve(path)
+    if route.family == "root":
         return Response("Ollama is running")
-
-    client = await http_connection.get_client()
-
-    cached_response = await response_cache.get_or_fetch(
-        request, path, client, ollama_helper
-    )
+    path = route.path
+
+    # Model-aware routing and per-model limits need the body, read it only then
+    model = None
+    if (http_connection.balanced or scheduler.needs_model) and request.method == "POST":
+        model, request = await ollama_helper.peek_body_model(request)
+        request.state.model = model
+    upstream = http_connection.select_upstream(model)
+    client = await http_connection.client_of(upstream)
+
+    async def unavailable(retry_after: int) -> Response:
+        # Fail fast while the remote side is down, metadata is served from the cache
+        stale_response = await response_cache.get_stale(request, path, route=route)
+        if stale_response is not None:
+            return stale_response
+        return Response(
+            "Remote side unavailable",
+            status_code=503,
+            headers={"retry-after": str(retry_after)},
+        )
+
+    # The half-open probe is claimed by the transport, by the request actually sent
+    if upstream.breaker.blocked:
+        metrics.circuit_rejected.inc(upstream.base_url)
+        return await unavailable(upstream.breaker.retry_after())
+
+    try:
+        cached_response = await response_cache.get_or_fetch(
+            request, path, client, ollama_helper, route=route
+        )
+    except CircuitOpen as e:
+        return await unavailable(e.retry_after)
     if cached_response is not None:
         return cached_response
 
-    async with semaphore:
-        try:
-            logger.debug(f"*** Handling request for path: /{path}")
-            if settings.stream_response:
-                return await handler_root_stream_response(
-                    path, request, client, ollama_helper
-                )
-            else:
-                return await handler_root_response(path, request, client, ollama_helper)
-        except Exception as e:
-            logger.error(f"root: {e} {type(e)}, try reconnection")
-            await http_connection.re_connect()
-            raise
+    # Set by the response cache on a miss for a cacheable deterministic completion
+    recorder = getattr(request.state, "completion_recorder", None)
+
+    try:
+        ticket = await scheduler.acquire(scheduler.client_key(request), model)
+    except SchedulerRejected as e:
+        logger.warning(f"Request for /{path} rejected: {e.reason}")
+        return Response(
+            e.reason, status_code=e.status_code, headers={"retry-after": "1"}
+        )
+
+    try:
+        logger.debug(f"*** Handling request for path: /{path}")
+        response = None
+        if embeddings_batcher.is_batched(path, request.method):
+            # None when the request cannot be batched, it is proxied as is
+            response = await embeddings_batcher.embed(
+                request, path, client, ollama_helper, route.rewrite_model
+            )
+        if response is None:
+            handler = (
+                handler_root_stream_response if route.stream else handler_root_response
+            )
+            response = await handler(
+                path,
+                request,
+                client,
+                ollama_helper,
+                recorder=recorder,
+                target_url=upstream.url_prefix + path,
+                rewrite_model=route.rewrite_model,
+                # Only the connections of the upstream that failed are replaced
+                on_transport_error=partial(http_connection.re_connect, upstream),
+            )
+    except BaseException:
+        ticket.release()
+        raise
+    # Streamed responses hold the slot until the stream is finished
+    return scheduler.release_on_close(response, ticket)
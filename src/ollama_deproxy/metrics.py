@@ -0,0 +1,373 @@
+import bisect
+import logging
+import time
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+# Seconds, up to long LLM generations
+LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+    300.0,
+)
+
+# Output tokens per second
+TOKEN_RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500, 1000)
+
+
+def _format_labels(labelnames: tuple[str, ...], labels: tuple) -> str:
+    if not labelnames:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape(value)}"' for name, value in zip(labelnames, labels)
+    )
+    return "{" + pairs + "}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter. Labels are passed positionally in `labelnames` order."""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def get(self, *labels) -> float:
+        return self._values.get(labels, 0)
+
+    def render(self) -> list[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}"
+            for labels, value in self._values.items()
+        ]
+
+
+class Gauge(Counter):
+    """Value that is set, usually by a collector right before a scrape."""
+
+    type = "gauge"
+
+    def set(self, value: float, *labels):
+        self._values[labels] = value
+
+    def clear(self):
+        self._values.clear()
+
+
+class Histogram:
+    """Cumulative histogram with fixed buckets, rendered in the Prometheus text format."""
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple = (),
+        buckets: tuple = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Per labels: counts of each bucket (non-cumulative), +Inf bucket, then the sum
+        self._values: dict[tuple, list] = {}
+
+    def observe(self, value: float, *labels):
+        data = self._values.get(labels)
+        if data is None:
+            data = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        data[bisect.bisect_left(self.buckets, value)] += 1
+        data[-1] += value
+
+    def render(self) -> list[str]:
+        lines = []
+        labelnames = self.labelnames + ("le",)
+        for labels, data in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), data):
+                cumulative += count
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(labelnames, labels + (_format_value(bound),))} {cumulative}"
+                )
+            label_str = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{label_str} {data[-1]!r}")
+            lines.append(f"{self.name}_count{label_str} {cumulative}")
+        return lines
+
+
+class Metrics:
+    """
+    In-process metrics registry exposed in the Prometheus text format.
+
+    Updates are plain dict operations on the event loop, cheap enough for the hot path.
+    Point-in-time values (pool usage, queue depth) are filled by collectors on scrape.
+    """
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+    # Model names come from clients, bound the number of label values
+    MAX_MODEL_LABELS = 100
+
+    def __init__(self):
+        self._families: list[Counter | Histogram] = []
+        self._collectors: dict[str, Callable[[], None]] = {}
+        self._model_labels: set[str] = set()
+
+        self.requests = self.counter(
+            "deproxy_requests_total",
+            "Proxied requests by route, model and status code",
+            ("route", "model", "status"),
+        )
+        self.request_duration = self.histogram(
+            "deproxy_request_duration_seconds",
+            "Request duration until the response is fully sent",
+            ("route", "model", "status"),
+        )
+        self.bytes_received = self.counter(
+            "deproxy_received_bytes_total",
+            "Request body bytes received from clients",
+            ("route",),
+        )
+        self.bytes_sent = self.counter(
+            "deproxy_sent_bytes_total",
+            "Response body bytes sent to clients",
+            ("route",),
+        )
+        self.upstream_ttfb = self.histogram(
+            "deproxy_upstream_ttfb_seconds",
+            "Time until the remote side response headers are received",
+            ("route",),
+        )
+        self.stream_duration = self.histogram(
+            "deproxy_stream_duration_seconds",
+            "Total duration of streamed responses",
+            ("route",),
+        )
+        self.cache_hits = self.counter(
+            "deproxy_cache_hits_total", "Response cache hits", ("tier",)
+        )
+        self.cache_misses = self.counter(
+            "deproxy_cache_misses_total", "Response cache misses"
+        )
+        self.cache_evictions = self.counter(
+            "deproxy_cache_evictions_total",
+            "Response cache entries evicted by size",
+            ("tier",),
+        )
+        self.cache_entries = self.gauge(
+            "deproxy_cache_entries", "Entries in the in-memory response cache"
+        )
+        self.cache_memory_bytes = self.gauge(
+            "deproxy_cache_memory_bytes",
+            "Bytes used by entries of the in-memory response cache",
+        )
+        self.embed_batches = self.counter(
+            "deproxy_embed_batches_total",
+            "Merged embedding requests sent to the remote side",
+        )
+        self.embed_inputs = self.counter(
+            "deproxy_embed_inputs_total",
+            "Embedding inputs by how they were served: upstream, duplicate, cache",
+            ("source",),
+        )
+        self.queue_wait = self.histogram(
+            "deproxy_queue_wait_seconds",
+            "Time requests waited for a concurrency slot",
+        )
+        self.queue_rejected = self.counter(
+            "deproxy_queue_rejected_total",
+            "Requests rejected by the scheduler",
+            ("reason",),
+        )
+        self.scheduler_active = self.gauge(
+            "deproxy_scheduler_active_requests", "Requests holding a concurrency slot"
+        )
+        self.scheduler_queued = self.gauge(
+            "deproxy_scheduler_queued_requests", "Requests waiting for a slot"
+        )
+        self.upstream_outstanding = self.gauge(
+            "deproxy_upstream_outstanding_requests",
+            "Requests in flight to each upstream",
+            ("upstream",),
+        )
+        self.upstream_healthy = self.gauge(
+            "deproxy_upstream_healthy",
+            "Upstream health state (1 healthy, 0 ejected)",
+            ("upstream",),
+        )
+        self.circuit_open = self.gauge(
+            "deproxy_circuit_open",
+            "Upstream circuit breaker state (1 open, failing fast, 0 closed)",
+            ("upstream",),
+        )
+        self.circuit_rejected = self.counter(
+            "deproxy_circuit_rejected_total",
+            "Requests failed fast or served stale by an open circuit",
+            ("upstream",),
+        )
+        self.hedged_requests = self.counter(
+            "deproxy_hedged_requests_total",
+            "Idempotent calls won by a hedged second attempt",
+            ("upstream",),
+        )
+        self.upstream_connections = self.gauge(
+            "deproxy_upstream_connections",
+            "Connections in the pool of each upstream",
+            ("upstream", "state"),
+        )
+        self.upstream_handshake = self.histogram(
+            "deproxy_upstream_handshake_seconds",
+            "TCP connect and TLS handshake time of new upstream connections",
+            ("upstream",),
+        )
+        self.upstream_handshake_saved = self.counter(
+            "deproxy_upstream_handshake_saved_seconds_total",
+            "Handshake time saved by pre-warmed and kept alive upstream connections",
+            ("upstream",),
+        )
+        self.upstream_pool_waiting = self.gauge(
+            "deproxy_upstream_pool_waiting_requests",
+            "Requests waiting for a free connection or HTTP/2 stream of each upstream",
+            ("upstream",),
+        )
+        self.ttft = self.histogram(
+            "deproxy_time_to_first_token_seconds",
+            "Time until the first content token of streamed completions",
+            ("model",),
+        )
+        self.tokens_per_second = self.histogram(
+            "deproxy_tokens_per_second",
+            "Completion generation speed in output tokens per second",
+            ("model",),
+            buckets=TOKEN_RATE_BUCKETS,
+        )
+        self.input_tokens = self.counter(
+            "deproxy_input_tokens_total", "Prompt tokens of completions", ("model",)
+        )
+        self.output_tokens = self.counter(
+            "deproxy_output_tokens_total", "Generated tokens of completions", ("model",)
+        )
+
+    def model_label(self, model: str | None) -> str:
+        if not model:
+            return ""
+        if model not in self._model_labels:
+            if len(self._model_labels) >= self.MAX_MODEL_LABELS:
+                return "other"
+            self._model_labels.add(model)
+        return model
+
+    def counter(self, name: str, documentation: str, labelnames: tuple = ()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: tuple = ()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: tuple = (), **kw):
+        return self._register(Histogram(name, documentation, labelnames, **kw))
+
+    def _register(self, family):
+        self._families.append(family)
+        return family
+
+    def set_collector(self, name: str, collector: Callable[[], None]):
+        """Register (or replace) a callback that updates gauges right before a scrape."""
+        self._collectors[name] = collector
+
+    def render(self) -> str:
+        for name, collector in self._collectors.items():
+            try:
+                collector()
+            except Exception as e:
+                logger.warning(f"Metrics collector '{name}' failed: {e}")
+        lines = []
+        for family in self._families:
+            lines.append(f"# HELP {family.name} {family.documentation}")
+            lines.append(f"# TYPE {family.name} {family.type}")
+            lines.extend(family.render())
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording request counts, durations and body bytes.
+
+    Handlers can set `request.state.model` to label requests by model.
+    """
+
+    def __init__(
+        self, app, route_label: Callable[[str], str], exclude_path: str = None
+    ):
+        self.app = app
+        self.route_label = route_label
+        self.exclude_path = exclude_path
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] == self.exclude_path:
+            await self.app(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        route = self.route_label(scope["path"].lstrip("/"))
+        state = scope.setdefault("state", {})
+        state["route"] = route
+        status = [500]
+
+        async def receive_wrapper():
+            message = await receive()
+            if message["type"] == "http.request":
+                size = len(message.get("body", b""))
+                if size:
+                    metrics.bytes_received.inc(route, amount=size)
+            return message
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status[0] = message["status"]
+            elif message["type"] == "http.response.body":
+                size = len(message.get("body", b""))
+                if size:
+                    metrics.bytes_sent.inc(route, amount=size)
+            await send(message)
+
+        try:
+            await self.app(scope, receive_wrapper, send_wrapper)
+        finally:
+            model = metrics.model_label(state.get("model"))
+            status_str = str(status[0])
+            metrics.requests.inc(route, model, status_str)
+            metrics.request_duration.observe(
+                time.perf_counter() - start_time, route, model, status_str
+            )
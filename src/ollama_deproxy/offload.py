@@ -0,0 +1,225 @@
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import statistics
+import threading
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable
+
+logger = logging.getLogger(__name__)
+
+
+class Offload:
+    """
+    Size-aware offloading of CPU bound work from the event loop.
+
+    Each kind of work has a size threshold: smaller inputs are handled inline, as the
+    hop to a thread costs more than the work, and larger ones run on a bounded
+    executor of their own, so they neither block the event loop nor take threads of
+    the shared Starlette pool used for blocking I/O.
+
+    With OFFLOAD_THRESHOLD=auto the thresholds are calibrated on startup with timeit:
+    the size a kind of work processes in the time of one executor round trip.
+    """
+
+    KINDS: tuple[str, ...] = ("hash", "json", "scan", "compress", "decompress")
+    # Used until calibrated, e.g. by benchmarks importing the modules directly
+    DEFAULT_THRESHOLD = 64 * 1024
+    # Calibrated thresholds are clamped: a slow executor hop on a busy host must
+    # not keep multi-MB work on the event loop
+    MIN_THRESHOLD = 1024
+    MAX_THRESHOLD = 1024 * 1024
+    MAX_WORKERS = 4
+
+    _THRESHOLDS: dict[str, int] = dict.fromkeys(KINDS, DEFAULT_THRESHOLD)
+    _EXECUTOR: ThreadPoolExecutor | None = None
+    _WORKERS: int = 0
+    _EXECUTOR_LOCK = threading.Lock()
+    inline = 0
+    offloaded = 0
+
+    @classmethod
+    def workers(cls) -> int:
+        return cls._WORKERS or min(cls.MAX_WORKERS, os.cpu_count() or 1)
+
+    @classmethod
+    def executor(cls) -> ThreadPoolExecutor:
+        if cls._EXECUTOR is None:
+            with cls._EXECUTOR_LOCK:
+                if cls._EXECUTOR is None:
+                    cls._EXECUTOR = ThreadPoolExecutor(
+                        max_workers=cls.workers(), thread_name_prefix="offload"
+                    )
+        return cls._EXECUTOR
+
+    @classmethod
+    def threshold(cls, kind: str) -> int:
+        return cls._THRESHOLDS[kind]
+
+    @classmethod
+    async def run(cls, kind: str, size: int, func: Callable, *args, **kwargs) -> Any:
+        """Run `func` inline for inputs under the `kind` threshold, else on the executor."""
+        if size < cls._THRESHOLDS[kind]:
+            cls.inline += 1
+            return func(*args, **kwargs)
+        cls.offloaded += 1
+        if kwargs:
+            func = partial(func, **kwargs)
+        return await asyncio.get_running_loop().run_in_executor(
+            cls.executor(), func, *args
+        )
+
+    @classmethod
+    def measure_offload_cost(cls, *, number_iterations: int = 200, repeat: int = 5):
+        """
+        Measure a round trip of a no-op through the executor using timeit.
+
+        Returns: seconds per round trip
+        """
+        executor = cls.executor()
+
+        def one() -> None:
+            executor.submit(int).result()
+
+        one()
+        timings = timeit.repeat(one, number=number_iterations, repeat=repeat)
+        return statistics.median(timings) / number_iterations
+
+    @classmethod
+    def _samples(cls, data_size_bytes: int) -> tuple[dict[str, Callable], int]:
+        """
+        Work of each kind on a chat request-like body of about `data_size_bytes`.
+
+        Returns: ({kind: work}, body_size)
+        """
+        from .best_hash import BestHash
+        from .compression import Compression
+        from .json_codec import JsonCodec
+        from .ollama_helper import OllamaHelper
+
+        # Varied text, so compression is not unrealistically fast, and the "model"
+        # key last, so the model scan walks all strings of the body
+        words = (
+            b"the model answers a question about code tests and data in json".split()
+        )
+        rng = random.Random(0)
+        messages = []
+        size = 0
+        while size < data_size_bytes:
+            content = b" ".join(rng.choices(words, k=64)).decode()
+            messages.append({"role": "user", "content": content})
+            size += len(content) + 32
+        data = JsonCodec.dumps({"messages": messages, "model": "1"})
+        compressed = Compression.compress(data, "gzip")
+        algorithm = BestHash._SELECTED_HASH_NAME or "sha256"
+        # Sizes are of the uncompressed body, as callers know it up front
+        return {
+            "hash": lambda: hashlib.new(algorithm, data).digest(),
+            "json": lambda: JsonCodec.loads(data),
+            "scan": lambda: OllamaHelper.find_numbered_model(data),
+            "compress": lambda: Compression.compress(data, "gzip"),
+            "decompress": lambda: Compression.decompress(compressed, "gzip"),
+        }, len(data)
+
+    @classmethod
+    def measure_throughput(
+        cls,
+        *,
+        data_size_bytes: int = 256 * 1024,
+        number_iterations: int = 4,
+        repeat: int = 3,
+    ) -> dict[str, float]:
+        """
+        Benchmark each kind of work on this platform using timeit.
+
+        Returns: {kind: bytes_per_sec}
+        """
+        results: dict[str, float] = {}
+        samples, size = cls._samples(data_size_bytes)
+        for kind, one in samples.items():
+            one()
+            best_seconds = min(
+                timeit.repeat(one, number=number_iterations, repeat=repeat)
+            )
+            results[kind] = (
+                size * number_iterations / best_seconds if best_seconds > 0 else 0.0
+            )
+            logger.debug(
+                f"Measured {kind} speed: {results[kind] / (1024 * 1024):.2f} MiB/s"
+            )
+        return results
+
+    @classmethod
+    def calibrate(cls) -> dict[str, int]:
+        """Thresholds of the size each kind of work processes in one executor round trip."""
+        offload_seconds = cls.measure_offload_cost()
+        speeds = cls.measure_throughput()
+        thresholds = {}
+        for kind, bytes_per_sec in speeds.items():
+            thresholds[kind] = min(
+                cls.MAX_THRESHOLD,
+                max(cls.MIN_THRESHOLD, int(offload_seconds * bytes_per_sec)),
+            )
+        logger.debug(f"Measured executor round trip: {offload_seconds * 1e6:.1f}us")
+        return thresholds
+
+    @classmethod
+    def parse_thresholds(cls, value: str) -> dict[str, int]:
+        """
+        Parse OFFLOAD_THRESHOLD: bytes for every kind, or comma separated
+        `kind=bytes` items, kinds left out keep the default.
+        """
+        value = value.strip()
+        if value.isdigit():
+            return dict.fromkeys(cls.KINDS, int(value))
+        thresholds = dict.fromkeys(cls.KINDS, cls.DEFAULT_THRESHOLD)
+        for item in value.split(","):
+            kind, _, size = item.partition("=")
+            kind = kind.strip()
+            if kind not in thresholds or not size.strip().isdigit():
+                raise ValueError(f"Invalid offload threshold item: '{item}'")
+            thresholds[kind] = int(size)
+        return thresholds
+
+    @classmethod
+    def format_thresholds(cls, thresholds: dict[str, int]) -> str:
+        return ",".join(f"{kind}={size}" for kind, size in thresholds.items())
+
+    @classmethod
+    def configure(cls, threshold: str = "auto", workers: int = 0) -> dict[str, int]:
+        """Set the executor size and the thresholds, calibrating them for 'auto'."""
+        if workers and workers != cls._WORKERS:
+            cls.shutdown()
+            cls._WORKERS = workers
+        if threshold == "auto":
+            logger.info("Offload thresholds auto-calibration...")
+            cls._THRESHOLDS = cls.calibrate()
+            logger.info(
+                f"Offload thresholds auto-calibration complete: "
+                f"{cls.format_thresholds(cls._THRESHOLDS)}. Can store it on .env file "
+                f"'OFFLOAD_THRESHOLD={cls.format_thresholds(cls._THRESHOLDS)}' "
+                "for skip calibration next time."
+            )
+        else:
+            cls._THRESHOLDS = cls.parse_thresholds(threshold)
+            logger.info(f"Offload thresholds: {cls.format_thresholds(cls._THRESHOLDS)}")
+        return cls._THRESHOLDS
+
+    @classmethod
+    def stats(cls) -> dict:
+        return {
+            "inline": cls.inline,
+            "offloaded": cls.offloaded,
+            "workers": cls.workers(),
+        }
+
+    @classmethod
+    def shutdown(cls):
+        with cls._EXECUTOR_LOCK:
+            if cls._EXECUTOR is not None:
+                cls._EXECUTOR.shutdown(wait=False, cancel_futures=True)
+                cls._EXECUTOR = None
@@ -1,13 +1,110 @@
-import json
+import asyncio
 import logging
+import re
+import time
+from dataclasses import dataclass, field
 
 from starlette.requests import Request
 
 from ollama_deproxy.services import build_http_connection
 from .config import settings
+from .json_codec import JsonCodec
+from .offload import Offload
+from .utils import filter_headers
 
 logger = logging.getLogger(__name__)
 
+# Cheap pre-check: any "model" key with a numeric string value, at any depth
+_NUMBERED_MODEL_RE = re.compile(rb'"model"\s*:\s*"\d+"')
+_JSON_WHITESPACE = b" \t\r\n"
+
+
+def _string_end(data: bytes, start: int) -> int:
+    """Return offset of the closing quote of a JSON string literal opened at `start`."""
+    end = data.find(b'"', start + 1)
+    while end != -1:
+        # Quote is escaped if preceded by an odd number of backslashes
+        backslash = end - 1
+        while data[backslash] == 0x5C:
+            backslash -= 1
+        if (end - backslash) % 2:
+            return end
+        end = data.find(b'"', end + 1)
+    return -1
+
+
+def find_top_level_string(data: bytes, key: bytes) -> tuple[int, int] | None:
+    """
+    Locate the string value of a top-level key in a JSON object without decoding it.
+
+    Strings are skipped with `bytes.find`, so large literals (e.g. base64 images)
+    cost a memchr, and brackets are counted only between strings.
+    Returns (start, end) offsets of the value literal, including quotes, or None
+    if the key is absent at the top level or its value is not a string.
+    """
+    quoted_key = b'"' + key + b'"'
+    key_size = len(quoted_key)
+    size = len(data)
+    depth = 0
+    pos = 0
+    while True:
+        quote = data.find(b'"', pos)
+        if quote == -1:
+            return None
+        depth += (
+            data.count(b"{", pos, quote)
+            + data.count(b"[", pos, quote)
+            - data.count(b"}", pos, quote)
+            - data.count(b"]", pos, quote)
+        )
+        if depth <= 0:
+            return None
+        end = _string_end(data, quote)
+        if end == -1:
+            return None
+        pos = end + 1
+        if depth != 1 or pos - quote != key_size or data[quote:pos] != quoted_key:
+            continue
+        while pos < size and data[pos] in _JSON_WHITESPACE:
+            pos += 1
+        if pos >= size or data[pos] != 0x3A:  # not followed by ':' - a value, not a key
+            continue
+        pos += 1
+        while pos < size and data[pos] in _JSON_WHITESPACE:
+            pos += 1
+        if pos >= size or data[pos] != 0x22:
+            return None
+        end = _string_end(data, pos)
+        return (pos, end + 1) if end != -1 else None
+
+
+@dataclass(frozen=True, slots=True)
+class ModelRegistry:
+    """Immutable snapshot of the remote model list with O(1) lookups by id and name."""
+
+    models: tuple[dict, ...] = ()
+    index: dict[str, int] = field(default_factory=dict)
+    created_at: float = field(default_factory=time.monotonic)
+
+    @classmethod
+    def from_tags(cls, data: dict) -> "ModelRegistry":
+        """Build a registry from an `api/tags` response, newest models first."""
+        models = data.get("models") or []
+        models = sorted(
+            (m for m in models if isinstance(m, dict)),
+            key=lambda x: x.get("modified_at") or "",
+            reverse=True,
+        )
+        index = {}
+        for i, m in enumerate(models):
+            name = m.get("name")
+            index.setdefault(name, i)
+            logger.debug(f"{i}:{name}")
+        return cls(models=tuple(models), index=index)
+
+    def age(self) -> float:
+        return time.monotonic() - self.created_at
+
 
 class OllamaHelper:
     """
@@ -18,28 +115,40 @@ class OllamaHelper:
     identifiers with their respective names, retrieve models by ID or name, and execute
     API requests. Its primary use case is for systems requiring dynamic model management
     based on external data sources.
+
+    Models are kept in a `ModelRegistry` snapshot, replaced atomically on refresh: after
+    `MODELS_REFRESH_INTERVAL` or whenever `api/tags` is re-fetched through the proxy.
     """
 
-    MODEL_PATH = "api/tags"
+    MODEL_PATH = settings.path_proxy_ollama + "api/tags"
+    # Request body bytes read ahead to find the model, the rest stays streamed
+    MODEL_PEEK_SIZE = 64 * 1024
 
     def __init__(self, client=None, response_cache=None):
-        self.models: list[dict] | None = None
+        self.registry: ModelRegistry | None = None
         self.client = client
         self.response_cache = response_cache
+        self.refresh_interval = settings.models_refresh_interval
+        self._refresh_task: asyncio.Task | None = None
+
+    @property
+    def models(self) -> tuple[dict, ...] | None:
+        return self.registry.models if self.registry is not None else None
 
     def set_client(self, client):
         self.client = client
 
     async def get_request(
         self, path, method: str = "GET", body_bytes: bytes = None, query_params=None
-    ) -> bytes:
+    ) -> tuple[bytes, int, dict]:
         """
         Asynchronous function to execute an HTTP request to the provided path using the specified method.
 
-        This function interacts with a remote server and returns the HTTP response content for the
-        requested resource. It uses an HTTP session to facilitate communication. If the session is
-        not initialized, it will log an error and return an empty byte string. Any HTTP status codes
-        in the 400-599 range will also log an error with the appropriate details.
+        This function interacts with a remote server and returns the HTTP response content, status
+        code and headers for the requested resource. It uses an HTTP session to facilitate
+        communication. If the session is not initialized, it will log an error and return an empty
+        byte string. Any HTTP status codes in the 400-599 range will also log an error with the
+        appropriate details.
 
         Parameters:
         path: str
@@ -52,28 +161,45 @@ class OllamaHelper:
             Optional dictionary containing query parameters for the request.
 
         Returns:
-        bytes
-            The response content from the HTTP request.
+        tuple[bytes, int, dict]
+            The response content, status code and filtered headers from the HTTP request.
         """
         if self.client is None:
             logger.error("Client not initialized")
-            return b""
-        target_url = f"{str(settings.remote_url).rstrip('/')}/{path.lstrip('/')}"
+            return b"", 503, {}
+        target_url = f"{str(self.client.base_url).rstrip('/')}/{path.lstrip('/')}"
         proxy_headers = {}
         response = await self.client.request(
             method=method,
             url=target_url,
             headers=proxy_headers,
+            content=body_bytes,
             params=query_params,
             follow_redirects=False,
         )
         if response.status_code >= 400:
             logger.error(
-                f"Error [{response.status_code}] on '{target_url}' with data: {body_bytes.decode()} : {response.text}"
+                f"Error [{response.status_code}] on '{target_url}' with data: {(body_bytes or b'').decode()} : {response.text}"
             )
-        return response.content
-
-    async def get_models(self, request: Request = None):
+        headers = filter_headers(response.headers, decode_response=True)
+        headers["content-length"] = str(len(response.content))
+        return response.content, response.status_code, headers
+
+    def update_models(self, body_bytes: bytes) -> bool:
+        """Rebuild the registry from an `api/tags` response body and swap it in atomically."""
+        if not body_bytes:
+            return False
+        try:
+            data = JsonCodec.loads(body_bytes)
+        except ValueError:
+            return False
+        if not isinstance(data, dict) or not isinstance(data.get("models"), list):
+            return False
+        self.registry = ModelRegistry.from_tags(data)
+        logger.debug(f"Models registry updated: {len(self.registry.models)} models")
+        return True
+
+    async def get_models(self, request: Request = None, refresh: bool = False):
         """
         Fetches and processes a list of models asynchronously.
 
@@ -82,52 +208,61 @@ class OllamaHelper:
         modification timestamp in descending order. If the models are successfully
         retrieved and processed, they are stored for future use.
 
+        Concurrent callers share a single in-flight fetch.
+
         Parameters:
             request (Request, optional): An optional request object for the function. Defaults to None.
+            refresh (bool, optional): Bypass the response cache and fetch from the remote side.
         """
-        if self.models is None:
-            path = self.MODEL_PATH
-            method = "GET"
-
-            # if request is None:
-            #     logger.error(f"request is None for path: {path}")
-            #     return
+        if self._refresh_task is None:
+            self._refresh_task = asyncio.create_task(self._load_models(refresh))
+            self._refresh_task.add_done_callback(self._on_refresh_done)
+        await asyncio.shield(self._refresh_task)
+
+    def _on_refresh_done(self, task: asyncio.Task):
+        self._refresh_task = None
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Models registry refresh failed: {task.exception()}")
+
+    async def _load_models(self, refresh: bool = False):
+        path = self.MODEL_PATH
+        method = "GET"
+
+        cached = None
+        if self.response_cache is not None and not refresh:
+            cached = await self.response_cache.get_cache(path, method=method)
+        if cached:
+            await Offload.run(
+                "json", cached.length, lambda: self.update_models(cached.body())
+            )
+            return
 
-            cached = None
+        body_bytes, status_code, headers = await self.get_request(path, method=method)
+        if status_code < 400 and await Offload.run(
+            "json", len(body_bytes), self.update_models, body_bytes
+        ):
             if self.response_cache is not None:
-                cached = await self.response_cache.get_cache(path, method=method)
-            if cached:
-                body_bytes = cached.get("content")
-                status_code = cached.get("status_code", 200)
-                headers = cached.get("headers", {})
-            else:
-                body_bytes, status_code, headers = await self.get_request(
-                    path, method=method
-                )
-            if body_bytes:
-                try:
-                    data = json.loads(body_bytes.decode())
-                except (json.JSONDecodeError, UnicodeDecodeError):
-                    data = {}
-            else:
-                data = {}
-            if data:
-                if self.response_cache is not None:
-                    await self.response_cache.set_cache(
-                        path,
-                        content=body_bytes,
-                        status_code=status_code,
-                        headers=headers,
-                        method=method,
-                    )
-                self.models = data.get("models")
-                self.models = sorted(
-                    self.models, key=lambda x: x.get("modified_at"), reverse=True
+                await self.response_cache.set_cache(
+                    path,
+                    content=body_bytes,
+                    status_code=status_code,
+                    headers=headers,
+                    method=method,
+                    replace=True,
                 )
-                for i, m in enumerate(self.models):
-                    name = m.get("name")
-                    logger.debug(f"{i}:{name}")
-            logger.debug(f"Models: {self.models}")
+
+    async def get_registry(self) -> ModelRegistry | None:
+        """Return the current registry, loading it on first use and refreshing it in background when due."""
+        if self.registry is None:
+            await self.get_models()
+        elif (
+            self.refresh_interval
+            and self.registry.age() >= self.refresh_interval
+            and self._refresh_task is None
+        ):
+            self._refresh_task = asyncio.create_task(self._load_models(refresh=True))
+            self._refresh_task.add_done_callback(self._on_refresh_done)
+        return self.registry
 
     async def get_model_name(self, model_id: int):
         """
@@ -146,27 +281,21 @@ class OllamaHelper:
             Optional[str]: The name of the model retrieved by the given ID, or None if
             the model does not exist or validation fails.
         """
-        if self.models is None:
-            await self.get_models()
-        if not self.models:
+        registry = await self.get_registry()
+        if not registry or not registry.models:
             return None
-        if model_id > len(self.models):
+        if not 0 <= model_id < len(registry.models):
             logger.debug(f"Model ID '{model_id}' is not exist")
             return None
-        model = self.models[model_id]
-        if not isinstance(model, dict):
-            logger.debug(f"Model ID '{model_id}' is not correct")
-            return None
-        return model.get("name")
+        return registry.models[model_id].get("name")
 
     async def get_model_id(self, model_name: str):
         """
         Retrieves the model ID for the given model name.
 
-        This asynchronous method searches the models list for a model with a name
-        that matches the specified model name. If found, it returns the corresponding
-        model's ID. If not found or if the models list is empty or uninitialized, it
-        returns None.
+        This asynchronous method looks up the model name in the registry index. If
+        found, it returns the corresponding model's ID. If not found or if the models
+        list is empty or uninitialized, it returns None.
 
         Args:
             model_name (str): The name of the model to find the ID for.
@@ -178,25 +307,77 @@ class OllamaHelper:
         Raises:
             None
         """
-        if self.models is None:
-            await self.get_models()
-        if not self.models:
+        registry = await self.get_registry()
+        if not registry:
+            return None
+        return registry.index.get(model_name)
+
+    @staticmethod
+    def get_body_model(data: bytes) -> str | None:
+        """Return the top-level "model" value of a JSON request body, without decoding the whole body."""
+        span = find_top_level_string(data, b"model") if data else None
+        if span is None:
+            return None
+        try:
+            return JsonCodec.loads(data[span[0] : span[1]])
+        except ValueError:
+            return None
+
+    @staticmethod
+    def find_numbered_model(data: bytes) -> tuple[int, int] | None:
+        """Return offsets of a numeric top-level "model" value literal, or None."""
+        if _NUMBERED_MODEL_RE.search(data) is None:
             return None
-        for model_id, model in enumerate(self.models):
-            if model.get("name") == model_name:
-                return model_id
-        return None
+        span = find_top_level_string(data, b"model")
+        if span is None:
+            return None
+        start, end = span
+        # Numeric ids are short: check the raw literal before decoding it
+        if end - start > 32 or not data[start + 1 : end - 1].isdigit():
+            return None
+        return span
+
+    @classmethod
+    async def peek_body_model(cls, request: Request) -> tuple[str | None, Request]:
+        """
+        Return the top-level "model" of a JSON request body read ahead up to
+        MODEL_PEEK_SIZE bytes, and a request which replays what was read before the
+        rest of the body. Large bodies are not buffered; a model after the first
+        MODEL_PEEK_SIZE bytes is not found.
+        """
+        messages = []
+        prefix = b""
+        model = None
+        more_body = True
+        while more_body and len(prefix) < cls.MODEL_PEEK_SIZE:
+            message = await request.receive()
+            messages.append(message)
+            if message["type"] != "http.request":
+                break
+            more_body = message.get("more_body", False)
+            prefix += message.get("body", b"")
+            model = await Offload.run("scan", len(prefix), cls.get_body_model, prefix)
+            if model is not None:
+                break
+
+        receive = request.receive
+        replay = iter(messages)
+
+        async def replay_receive():
+            return next(replay, None) or await receive()
+
+        return model, Request(request.scope, replay_receive)
 
     async def replace_numbered_model(self, data: bytes) -> bytes:
         """
         Replaces a numeric model identifier in the input JSON data with its corresponding
         model name.
 
-        This method decodes the input byte data as JSON, checks if the "model" field
-        contains a numeric identifier, and replaces it with the result of the
-        `get_model_name` method, which maps numeric identifiers to model names. If the
-        input is not valid JSON or the "model" field is missing or non-numeric, the
-        original data is returned unchanged.
+        This method locates the top-level "model" string value in the raw JSON bytes
+        without decoding the whole document. If the value is a numeric identifier, the
+        result of the `get_model_name` method, which maps numeric identifiers to model
+        names, is spliced in its place. If the "model" field is missing, non-numeric or
+        cannot be resolved, the original data is returned untouched.
 
         Parameters:
             data (bytes): The input data in byte format, expected to be a JSON-encoded
@@ -205,34 +386,30 @@ class OllamaHelper:
         Returns:
             bytes: The modified data with a numeric model identifier replaced by its
             corresponding name, or the original data if no replacement is performed.
-
-        Raises:
-            json.JSONDecodeError: If decoding JSON from the input data fails during
-            the modification process.
         """
         if not data:
             return data
-        try:
-            data_dict = json.loads(data.decode())
-        except json.JSONDecodeError:
-            logger.debug("Error of decoding JSON")
+        # Scanning a multi-MB body is CPU bound
+        span = await Offload.run("scan", len(data), self.find_numbered_model, data)
+        if span is None:
+            return data
+        start, end = span
+        model_name = data[start + 1 : end - 1].decode()
+        model_name_str = await self.get_model_name(int(model_name))
+        logger.debug(f"replacement model_name: {model_name_str} for {model_name}")
+        if model_name_str is None:
             return data
-        model_name: str = data_dict.get("model", "")
-        if model_name and model_name.isdigit():
-            model_name_str = await self.get_model_name(int(model_name))
-            logger.debug(f"replacement model_name: {model_name_str} for {model_name}")
-            data_dict["model"] = model_name_str
-            try:
-                data = json.dumps(data_dict, ensure_ascii=False).encode()
-                # logger.debug(data.decode())
-                return data
-            except json.JSONDecodeError:
-                ...
-        return data
+        view = memoryview(data)
+        return b"".join(
+            (
+                view[:start],
+                JsonCodec.dumps(model_name_str),
+                view[end:],
+            )
+        )
 
 
 if __name__ == "__main__":
-    import asyncio
     from ollama_deproxy.config_logging import setup_logging
 
     setup_logging()
@@ -241,7 +418,7 @@ if __name__ == "__main__":
 
     async def test():
         http_connection = build_http_connection()
-        client = http_connection.get_client()
+        client = await http_connection.get_client()
         ollama_helper.set_client(client)
         # await ollama_helper.get_models()
         model_name = await ollama_helper.get_model_name(12)
@@ -1,32 +1,141 @@
+import asyncio
 import logging
 
 from .config import settings
 from starlette.requests import Request
-from starlette.responses import Response
+from starlette.responses import Response, StreamingResponse
 
-from .cache_base import CacheBase
+from .cache_base import CacheBase, CacheEntry
+from .compression import Compression
 from .handlers import handler_root_response
+from .json_codec import JsonCodec
+from .offload import Offload
+from .routes import Route
 
 logger = logging.getLogger(__name__)
 
 
+class _FetchFailed(Exception):
+    """A fetch got a server error: it is not cached nor shared with coalesced callers."""
+
+    def __init__(self, response: Response):
+        super().__init__(f"remote side status {response.status_code}")
+        self.response = response
+
+
+class CompletionRecorder:
+    """Records streamed completion chunks and stores them in the cache once the stream is complete."""
+
+    MAX_BYTES = 4 * 1024 * 1024
+
+    def __init__(self, cache: "ResponseCache", path: str, cache_key: str):
+        self.cache = cache
+        self.path = path
+        self.cache_key = cache_key
+        self.chunks: list[bytes] = []
+        self.size = 0
+        self.completed = False
+        self.overflow = False
+
+    def record(self, chunk: bytes):
+        if self.overflow:
+            return
+        self.size += len(chunk)
+        if self.size > self.MAX_BYTES:
+            self.overflow = True
+            self.chunks.clear()
+            return
+        self.chunks.append(chunk)
+
+    def complete(self):
+        self.completed = True
+
+    async def save(self, status_code: int, headers: dict):
+        if not self.completed or self.overflow or status_code != 200 or not self.chunks:
+            return
+        await self.cache.set_cache(
+            self.path,
+            cache_key=self.cache_key,
+            content=b"".join(self.chunks),
+            status_code=status_code,
+            headers=headers,
+            chunk_sizes=[len(chunk) for chunk in self.chunks],
+        )
+
+
 class ResponseCache(CacheBase):
     CACHED_PATHS = (
         settings.path_proxy_ollama + "api/tags",
         settings.path_proxy_ollama + "api/models",
         settings.path_proxy_ollama + "api/show",
     )
+    # Cached only when CACHE_COMPLETIONS is enabled and the request is deterministic
+    COMPLETION_PATHS = (
+        settings.path_proxy_ollama + "api/generate",
+        settings.path_proxy_ollama + "api/chat",
+        settings.path_proxy_ollama + "v1/chat/completions",
+        settings.path_proxy_ollama + "v1/completions",
+    )
+    # Body fields that do not affect the generated output
+    VOLATILE_FIELDS = ("keep_alive",)
+
+    def __init__(self, maxsize: int = None, ttl: int = None):
+        # In-flight upstream fetches keyed by cache key (single-flight)
+        self._inflight: dict[str, asyncio.Task] = {}
+        self.fetch_count = 0
+        self.coalesced_count = 0
+        self.refresh_count = 0
+        super().__init__(maxsize=maxsize, ttl=ttl)
 
     def is_cached(self, path: str) -> bool:
         return super().is_cached(path) and any(
             path.lower().startswith(cached) for cached in self.CACHED_PATHS
         )
 
+    def is_completion_cached(self, path: str) -> bool:
+        return (
+            settings.cache_completions
+            and super().is_cached(path)
+            and path.lower().startswith(self.COMPLETION_PATHS)
+        )
+
+    @staticmethod
+    def is_deterministic(data: dict) -> bool:
+        """Check if a completion request has temperature 0 or a fixed seed."""
+        options = data.get("options")
+        if not isinstance(options, dict):
+            options = {}
+        temperature = options.get("temperature", data.get("temperature"))
+        seed = options.get("seed", data.get("seed"))
+        return temperature == 0 or seed is not None
+
+    def canonical_body(self, data: dict) -> bytes:
+        """Serialize request JSON with sorted keys and without volatile fields."""
+        data = {k: v for k, v in data.items() if k not in self.VOLATILE_FIELDS}
+        return JsonCodec.dumps(data, sort_keys=True)
+
     async def get_or_fetch(
-        self, request: Request, path: str, session, ollama_helper, body: bytes = None
+        self,
+        request: Request,
+        path: str,
+        session,
+        ollama_helper,
+        body: bytes = None,
+        route: Route = None,
     ) -> Response | None:
-        """Get a cached response or fetch and cache a new one."""
-        if not self.is_cached(path):
+        """
+        Get a cached response or fetch and cache a new one. With a `route`, its
+        precomputed cache eligibility is used instead of matching the path.
+        """
+        if route is None:
+            completion_cached = self.is_completion_cached(path)
+            cached = self.is_cached(path)
+        else:
+            completion_cached, cached = route.completion_cached, route.cached
+        if completion_cached:
+            return await self.get_completion(request, path, body)
+
+        if not cached:
             return None
 
         if request is None:
@@ -40,29 +149,199 @@ class ResponseCache(CacheBase):
         # Try to get from the cache
         cached = await self.get_cache(path, cache_key=cache_key)
         if cached is not None:
+            if self.is_stale(cached):
+                # Stale-while-revalidate: serve cached body, refresh it in background
+                task = self._start_fetch(
+                    request, path, session, ollama_helper, cache_key
+                )
+                if task is not None:
+                    self.refresh_count += 1
+                    logger.debug(f"Background refresh for key: {cache_key[:25]}...")
+                    task.add_done_callback(self._log_refresh_error)
+            return await self.cached_response(request, cached, cache_key)
+
+        # Join an in-flight fetch for the same key or start a new one
+        task = self._start_fetch(request, path, session, ollama_helper, cache_key)
+        leader = task is not None
+        if not leader:
+            task = self._inflight[cache_key]
+            self.coalesced_count += 1
+            logger.debug(
+                f"Coalesced request for key: {cache_key[:25]}... (total coalesced: {self.coalesced_count})"
+            )
+
+        # Shield the shared fetch so one disconnected client does not cancel it for the others
+        try:
+            cached = await asyncio.shield(task)
+        except _FetchFailed as e:
+            # The error is the fetching request's own, others are proxied on their own
+            return e.response if leader else None
+        return await self.cached_response(request, cached, cache_key)
+
+    async def cached_response(
+        self, request: Request, cached: CacheEntry, cache_key: str = None
+    ) -> Response:
+        """
+        Build a response of a cached entry, compressed for the client Accept-Encoding.
+        Compressed bodies are kept in the entry, so each encoding is compressed once.
+        """
+        headers = cached.header_dict()
+        encoding = Compression.choose(
+            request.headers.get("accept-encoding"), headers, cached.length
+        )
+        if encoding is None:
+            if cached.encoding is None:
+                content = cached.content
+            else:
+                content = await Offload.run("decompress", cached.length, cached.body)
             return Response(
-                content=cached.get("content"),
-                status_code=cached.get("status_code", 200),
-                headers=cached.get("headers", {}),
+                content=content, status_code=cached.status_code, headers=headers
             )
+        if encoding == cached.encoding:
+            body = cached.content
+        else:
+            body = cached.variants.get(encoding) if cached.variants else None
+            if body is None:
+                body = await Offload.run(
+                    "compress",
+                    cached.length,
+                    lambda: Compression.compress(cached.body(), encoding),
+                )
+                self.add_variant(cache_key, cached, encoding, body)
+        return Response(
+            content=body,
+            status_code=cached.status_code,
+            headers=Compression.encoded_headers(headers, encoding, len(body)),
+        )
 
+    async def get_stale(
+        self, request: Request, path: str, route: Route = None
+    ) -> Response | None:
+        """
+        Get a cached response however old, without a refresh. Used while the remote
+        side is unavailable.
+        """
+        if not (route.cached if route is not None else self.is_cached(path)):
+            return None
+        body = await request.body()
+        cache_key = await self.async_build_cache_key(path, request.method, body)
+        cached = await self.get_cache(path, cache_key=cache_key)
+        if cached is None:
+            return None
+        return await self.cached_response(request, cached, cache_key)
+
+    def _start_fetch(
+        self, request: Request, path: str, session, ollama_helper, cache_key: str
+    ) -> asyncio.Task | None:
+        """Start an upstream fetch for the key, or return None if one is already in flight."""
+        if cache_key in self._inflight:
+            return None
+        self.fetch_count += 1
+        task = asyncio.create_task(
+            self._fetch(request, path, session, ollama_helper, cache_key)
+        )
+        self._inflight[cache_key] = task
+        task.add_done_callback(
+            lambda t: (
+                self._inflight.pop(cache_key, None)
+                if self._inflight.get(cache_key) is t
+                else None
+            )
+        )
+        return task
+
+    @staticmethod
+    def _log_refresh_error(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Background cache refresh failed: {task.exception()}")
+
+    async def _fetch(
+        self, request: Request, path: str, session, ollama_helper, cache_key: str
+    ) -> CacheEntry:
         # Fetch not streaming response if not cached
         response = await handler_root_response(
-            path, request, session, ollama_helper, decode_response=True
+            path,
+            request,
+            session,
+            ollama_helper,
+            decode_response=True,
+            compress=False,
+            stream_oversized=False,
         )
+        # The handler hands a multi-chunk body over as a memoryview of its buffer
+        body = bytes(response.body)
         headers = dict(response.headers)
         headers.pop("content-encoding", None)
-        headers["content-length"] = str(len(response.body))
+        headers["content-length"] = str(len(body))
         # logger.debug(f"headers: {headers}")
 
+        # Keep the models registry in sync with the freshly fetched model list
+        if path.startswith(ollama_helper.MODEL_PATH) and response.status_code < 400:
+            await Offload.run("json", len(body), ollama_helper.update_models, body)
+
+        if response.status_code >= 500:
+            # Remote side failures (and "Error remote side") are not cached
+            raise _FetchFailed(response)
+
         # Cache the response if valid
-        if isinstance(response, Response):
-            await self.set_cache(
-                path,
-                cache_key=cache_key,
-                content=response.body,
-                status_code=response.status_code,
-                headers=headers,
+        return await self.set_cache(
+            path,
+            cache_key=cache_key,
+            content=body,
+            status_code=response.status_code,
+            headers=headers,
+            # Never let a failed refresh overwrite a good stale entry
+            replace=response.status_code < 400,
+        )
+
+    async def get_completion(
+        self, request: Request, path: str, body: bytes = None
+    ) -> Response | None:
+        """
+        Replay a cached deterministic completion with its original chunk boundaries.
+
+        On a cache miss returns None and attaches a CompletionRecorder to
+        `request.state.completion_recorder`, so the proxy handler can record the stream.
+        """
+        body = body or await request.body()
+        try:
+            data = await Offload.run("json", len(body), JsonCodec.loads, body)
+        except ValueError:
+            return None
+        if not isinstance(data, dict) or not self.is_deterministic(data):
+            return None
+
+        canonical_body = await Offload.run("json", len(body), self.canonical_body, data)
+        cache_key = await self.async_build_cache_key(
+            path, request.method, canonical_body
+        )
+        cached = await self.get_cache(path, cache_key=cache_key)
+        if cached is None:
+            request.state.completion_recorder = CompletionRecorder(
+                self, path, cache_key
             )
+            return None
+
+        content = cached.body()
+        chunk_sizes = cached.chunk_sizes or [len(content)]
+
+        async def replay():
+            offset = 0
+            for size in chunk_sizes:
+                yield content[offset : offset + size]
+                offset += size
+
+        return StreamingResponse(
+            replay(),
+            status_code=cached.status_code,
+            headers=cached.header_dict(),
+        )
 
-        return response
+    def stats(self) -> dict:
+        """Return single-flight, background refresh and memory tier counters."""
+        return {
+            "fetches": self.fetch_count,
+            "coalesced": self.coalesced_count,
+            "refreshes": self.refresh_count,
+            **self.memory_stats(),
+        }
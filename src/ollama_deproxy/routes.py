@@ -0,0 +1,118 @@
+import logging
+
+from .config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class Route:
+    """How requests of one incoming path are proxied, resolved once per path."""
+
+    __slots__ = (
+        "path",
+        "prefix",
+        "family",
+        "cached",
+        "completion_cached",
+        "rewrite_model",
+        "stream",
+    )
+
+    def __init__(
+        self,
+        path: str,
+        prefix: str,
+        family: str,
+        cached: bool = False,
+        completion_cached: bool = False,
+        rewrite_model: bool = False,
+        stream: bool = True,
+    ):
+        # Path on the remote side, relative to the upstream URL
+        self.path = path
+        # First segment of the incoming path, "" for the root
+        self.prefix = prefix
+        # API the path belongs to: root, ollama, openai, anthropic
+        self.family = family
+        self.cached = cached
+        self.completion_cached = completion_cached
+        self.rewrite_model = rewrite_model
+        self.stream = stream
+
+
+class RouteTable:
+    """
+    Routing of incoming paths to the remote side, built at startup.
+
+    Each path is classified once: the remote path with the Ollama, OpenAI or Anthropic
+    compatibility prefix, its API family for metrics, response cache eligibility,
+    streaming and numbered model names correction. Later requests of the path are a
+    single dict lookup. Paths come from clients, so the table is bounded.
+    """
+
+    OLLAMA_PREFIXES = frozenset(("api", "v1"))
+    ANTHROPIC_PREFIXES = ("v1/messages",)
+    # Distinct paths kept, the table is reset when it grows over it
+    MAX_ROUTES = 4096
+
+    def __init__(
+        self,
+        cached_paths: tuple[str, ...] = (),
+        completion_paths: tuple[str, ...] = (),
+        model_path: str = "",
+    ):
+        self.cached_paths = tuple(cached_paths) if settings.cache_enabled else ()
+        self.completion_paths = (
+            tuple(completion_paths)
+            if settings.cache_enabled and settings.cache_completions
+            else ()
+        )
+        self.model_path = model_path
+        self._routes: dict[str, Route] = {}
+
+    def resolve(self, path: str) -> Route:
+        """Route of an incoming path, without the leading slash."""
+        route = self._routes.get(path)
+        if route is None:
+            if len(self._routes) >= self.MAX_ROUTES:
+                self._routes.clear()
+            route = self._routes[path] = self._build(path)
+        return route
+
+    def _build(self, path: str) -> Route:
+        prefix = path.split("/", maxsplit=1)[0]
+        if prefix == "":
+            return Route(path, prefix, "root")
+
+        if path.startswith(self.ANTHROPIC_PREFIXES):
+            family = "anthropic"
+            remote_path = settings.path_api + path
+            logger.debug(
+                f"Proxying request corrected to '{remote_path}' for Anthropic compatibility"
+            )
+        elif prefix in self.OLLAMA_PREFIXES:
+            family = "ollama" if prefix == "api" else "openai"
+            remote_path = settings.path_proxy_ollama + path
+        else:
+            family = "openai"
+            remote_path = settings.path_proxy_ollama + "v1/" + path
+            logger.debug(
+                f"Proxying request corrected to '{remote_path}' for OpenAI compatibility"
+            )
+
+        lower_path = remote_path.lower()
+        return Route(
+            remote_path,
+            prefix,
+            family,
+            cached=lower_path.startswith(self.cached_paths),
+            completion_cached=lower_path.startswith(self.completion_paths),
+            # The model list is fetched with the remote names, never rewritten
+            rewrite_model=settings.correct_numbered_model_names
+            and not (self.model_path and remote_path.startswith(self.model_path)),
+            stream=settings.stream_response,
+        )
+
+    def label(self, path: str) -> str:
+        """API family of an incoming path, for metrics."""
+        return self.resolve(path).family
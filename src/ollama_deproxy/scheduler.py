@@ -0,0 +1,268 @@
+import asyncio
+import logging
+import time
+from collections import Counter, deque
+
+from starlette.requests import Request
+from starlette.responses import Response, StreamingResponse
+
+from .config import settings
+from .metrics import metrics
+from .utils import close_after
+
+logger = logging.getLogger(__name__)
+
+
+class SchedulerRejected(Exception):
+    """Raised when a request can not be scheduled: the wait queue is full or the wait is too long."""
+
+    def __init__(self, status_code: int, reason: str):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+
+
+class Ticket:
+    """A granted execution slot. Must be released exactly once; repeated calls are ignored."""
+
+    __slots__ = ("scheduler", "client_key", "model", "released")
+
+    def __init__(self, scheduler: "RequestScheduler", client_key: str, model: str):
+        self.scheduler = scheduler
+        self.client_key = client_key
+        self.model = model
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.scheduler._release(self)
+
+
+class _Waiter:
+    __slots__ = ("future", "model", "enqueued_at")
+
+    def __init__(self, model: str | None):
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.model = model
+        self.enqueued_at = time.perf_counter()
+
+
+class RequestScheduler:
+    """
+    Concurrency scheduler for proxied requests.
+
+    Enforces a global limit plus optional per-model and per-client limits. Requests
+    that can not start wait in per-client FIFO queues, served by weighted fair
+    queuing: the backlogged client with the smallest virtual time goes first, and
+    each started request advances its client's virtual time by 1/weight. The total
+    queue is bounded and a request waiting too long is rejected.
+    """
+
+    def __init__(
+        self,
+        limit: int = None,
+        limit_per_model: int = None,
+        limit_per_client: int = None,
+        max_queue: int = None,
+        max_queue_wait: float = None,
+        client_weights: dict[str, float] = None,
+    ):
+        self.limit = limit or settings.limit_concurrency
+        self.limit_per_model = (
+            settings.limit_concurrency_per_model
+            if limit_per_model is None
+            else limit_per_model
+        )
+        self.limit_per_client = (
+            settings.limit_concurrency_per_client
+            if limit_per_client is None
+            else limit_per_client
+        )
+        self.max_queue = settings.queue_max_size if max_queue is None else max_queue
+        self.max_queue_wait = (
+            settings.queue_max_wait if max_queue_wait is None else max_queue_wait
+        )
+        self.client_weights = (
+            settings.client_weights if client_weights is None else client_weights
+        )
+
+        self.active = 0
+        self.active_by_model: Counter[str] = Counter()
+        self.active_by_client: Counter[str] = Counter()
+        self.queues: dict[str, deque[_Waiter]] = {}
+        self.queued = 0
+        self.virtual_time: dict[str, float] = {}
+        self._virtual_time_floor = 0.0
+
+        # Metrics
+        self.granted_count = 0
+        self.queued_count = 0
+        self.rejected_full_count = 0
+        self.rejected_timeout_count = 0
+        self.max_queue_depth = 0
+        self.waited_count = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    @property
+    def needs_model(self) -> bool:
+        return bool(self.limit_per_model)
+
+    @staticmethod
+    def client_key(request: Request) -> str:
+        """Identify a client by the configured header, or by its address."""
+        if settings.client_key_header:
+            key = request.headers.get(settings.client_key_header)
+            if key:
+                return key
+        return request.client.host if request.client else "unknown"
+
+    def collect_metrics(self):
+        metrics.scheduler_active.set(self.active)
+        metrics.scheduler_queued.set(self.queued)
+
+    def _can_run(self, client_key: str, model: str | None) -> bool:
+        if self.active >= self.limit:
+            return False
+        if self.limit_per_client and (
+            self.active_by_client[client_key] >= self.limit_per_client
+        ):
+            return False
+        if self.limit_per_model and model:
+            return self.active_by_model[model] < self.limit_per_model
+        return True
+
+    def _start(self, client_key: str, model: str | None) -> Ticket:
+        self.active += 1
+        self.active_by_client[client_key] += 1
+        if model:
+            self.active_by_model[model] += 1
+        virtual_time = self.virtual_time.get(client_key, self._virtual_time_floor)
+        self._virtual_time_floor = max(self._virtual_time_floor, virtual_time)
+        self.virtual_time[client_key] = virtual_time + 1.0 / self.client_weights.get(
+            client_key, 1.0
+        )
+        self.granted_count += 1
+        return Ticket(self, client_key, model)
+
+    def _release(self, ticket: Ticket):
+        self.active -= 1
+        self.active_by_client[ticket.client_key] -= 1
+        if not self.active_by_client[ticket.client_key]:
+            del self.active_by_client[ticket.client_key]
+        if ticket.model:
+            self.active_by_model[ticket.model] -= 1
+            if not self.active_by_model[ticket.model]:
+                del self.active_by_model[ticket.model]
+        self._dispatch()
+
+    def _dispatch(self):
+        """Start queued requests, clients with the smallest virtual time first."""
+        while self.queued and self.active < self.limit:
+            for client_key in sorted(self.queues, key=self._client_virtual_time):
+                queue = self.queues[client_key]
+                waiter = next(
+                    (
+                        w
+                        for w in queue
+                        if w.future.done() or self._can_run(client_key, w.model)
+                    ),
+                    None,
+                )
+                if waiter is not None:
+                    self._dequeue(client_key, waiter)
+                    # Cancelled or timed out, but not yet dequeued by acquire()
+                    if not waiter.future.done():
+                        self._record_wait(waiter)
+                        waiter.future.set_result(self._start(client_key, waiter.model))
+                    break
+            else:
+                return
+
+    def _client_virtual_time(self, client_key: str) -> float:
+        return self.virtual_time.get(client_key, self._virtual_time_floor)
+
+    def _enqueue(self, client_key: str, waiter: _Waiter):
+        queue = self.queues.get(client_key)
+        if queue is None:
+            queue = self.queues[client_key] = deque()
+            # An idle client does not bank credit: it restarts from the current floor
+            self.virtual_time[client_key] = max(
+                self.virtual_time.get(client_key, 0.0), self._virtual_time_floor
+            )
+        queue.append(waiter)
+        self.queued += 1
+        self.queued_count += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queued)
+
+    def _dequeue(self, client_key: str, waiter: _Waiter):
+        queue = self.queues[client_key]
+        queue.remove(waiter)
+        self.queued -= 1
+        if not queue:
+            del self.queues[client_key]
+
+    def _record_wait(self, waiter: _Waiter):
+        wait_time = time.perf_counter() - waiter.enqueued_at
+        self.waited_count += 1
+        self.wait_time_total += wait_time
+        self.wait_time_max = max(self.wait_time_max, wait_time)
+        metrics.queue_wait.observe(wait_time)
+
+    async def acquire(self, client_key: str, model: str | None = None) -> Ticket:
+        """Wait for an execution slot, or raise SchedulerRejected."""
+        if self._can_run(client_key, model):
+            metrics.queue_wait.observe(0.0)
+            return self._start(client_key, model)
+
+        if self.queued >= self.max_queue:
+            self.rejected_full_count += 1
+            metrics.queue_rejected.inc("queue_full")
+            raise SchedulerRejected(429, "Too many queued requests")
+
+        waiter = _Waiter(model)
+        self._enqueue(client_key, waiter)
+        try:
+            return await asyncio.wait_for(
+                waiter.future, timeout=self.max_queue_wait or None
+            )
+        except BaseException as e:
+            if waiter in self.queues.get(client_key, ()):
+                self._dequeue(client_key, waiter)
+            elif waiter.future.done() and not waiter.future.cancelled():
+                # Granted right before cancellation: hand the slot over
+                waiter.future.result().release()
+            if isinstance(e, asyncio.TimeoutError):
+                self.rejected_timeout_count += 1
+                metrics.queue_rejected.inc("queue_timeout")
+                raise SchedulerRejected(503, "Queue wait timeout exceeded") from None
+            raise
+
+    @staticmethod
+    def release_on_close(response: Response, ticket: Ticket) -> Response:
+        """
+        Release the slot now for a buffered response, or when a streamed one ends,
+        failed or not.
+        """
+        if not isinstance(response, StreamingResponse):
+            ticket.release()
+            return response
+        response.body_iterator = close_after(response.body_iterator, ticket.release)
+        return response
+
+    def stats(self) -> dict:
+        """Return queue depth, wait time and rejection counters."""
+        return {
+            "active": self.active,
+            "queue_depth": self.queued,
+            "max_queue_depth": self.max_queue_depth,
+            "granted": self.granted_count,
+            "queued": self.queued_count,
+            "rejected_queue_full": self.rejected_full_count,
+            "rejected_queue_timeout": self.rejected_timeout_count,
+            "wait_time_avg": (
+                self.wait_time_total / self.waited_count if self.waited_count else 0.0
+            ),
+            "wait_time_max": self.wait_time_max,
+        }
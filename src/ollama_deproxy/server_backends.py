@@ -0,0 +1,29 @@
+import importlib.util
+import sys
+
+EVENT_LOOPS = ("auto", "uvloop", "asyncio")
+HTTP_PARSERS = ("auto", "httptools", "h11")
+
+
+def _module_available(name: str) -> bool:
+    return importlib.util.find_spec(name) is not None
+
+
+def select_event_loop(loop: str = "auto") -> str:
+    """Resolve the uvicorn event loop: uvloop when installed (not on Windows), else asyncio."""
+    if loop in ("auto", "uvloop"):
+        if sys.platform != "win32" and _module_available("uvloop"):
+            return "uvloop"
+        if loop == "uvloop":
+            print("Warning: event loop 'uvloop' is not available, using 'asyncio'")
+    return "asyncio"
+
+
+def select_http_parser(http: str = "auto") -> str:
+    """Resolve the uvicorn HTTP/1.1 parser: httptools when installed, else h11."""
+    if http in ("auto", "httptools"):
+        if _module_available("httptools"):
+            return "httptools"
+        if http == "httptools":
+            print("Warning: HTTP parser 'httptools' is not available, using 'h11'")
+    return "h11"
@@ -1,15 +1,10 @@
-import asyncio
-
-
-from .config import settings
 from .http_connection import HttpConnection
+from .scheduler import RequestScheduler
 
 
 def build_http_connection():
     return HttpConnection()
 
 
-def build_semaphore():
-    return asyncio.Semaphore(
-        settings.limit_concurrency
-    )  # Stay safely under the 100 limit
+def build_scheduler():
+    return RequestScheduler()
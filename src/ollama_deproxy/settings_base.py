@@ -4,6 +4,8 @@ from os import environ
 from pydantic import BaseModel, ConfigDict, HttpUrl, Field, SecretStr, field_validator
 
 from .get_version import app_version
+from .offload import Offload
+from .server_backends import EVENT_LOOPS, HTTP_PARSERS
 
 
 class Settings(BaseModel):
@@ -12,6 +14,34 @@ class Settings(BaseModel):
     remote_url: HttpUrl = Field(
         default=environ.get("REMOTE_URL"), description="Proxy server URL"
     )
+    remote_urls: list[HttpUrl] = Field(
+        default=environ.get("REMOTE_URL"),
+        description="Proxy server URLs, comma separated in REMOTE_URL for load balancing",
+    )
+    upstream_policy: str = Field(
+        default=environ.get("UPSTREAM_POLICY", "least_outstanding"),
+        description="Load balancing policy for multiple upstreams: least_outstanding, round_robin",
+    )
+    upstream_health_interval: int = Field(
+        default=environ.get("UPSTREAM_HEALTH_INTERVAL", 10)
+    )
+    upstream_eject_time: int = Field(default=environ.get("UPSTREAM_EJECT_TIME", 30))
+    remote_connect_retries: int = Field(
+        default=environ.get("REMOTE_CONNECT_RETRIES", 3),
+        description="Connection attempts retried with exponential backoff before a request fails",
+    )
+    circuit_breaker_threshold: int = Field(
+        default=environ.get("CIRCUIT_BREAKER_THRESHOLD", 5),
+        description="Consecutive upstream failures that open the circuit. 0 disables.",
+    )
+    circuit_breaker_reset_time: float = Field(
+        default=environ.get("CIRCUIT_BREAKER_RESET_TIME", 30),
+        description="Seconds the circuit stays open before a probe request",
+    )
+    hedge_requests: bool = Field(
+        default=environ.get("HEDGE_REQUESTS", False),
+        description="Send a second attempt of slow idempotent GET calls after the p95 latency",
+    )
     path_proxy_ollama: str = Field(default=environ.get("PATH_PROXY_OLLAMA", "ollama/"))
     path_api: str = Field(default=environ.get("PATH_API", "api/"))
     remote_url_http2: bool = Field(default=environ.get("REMOTE_URL_HTTP2", True))
@@ -22,25 +52,187 @@ class Settings(BaseModel):
         default=environ.get("REMOTE_AUTH_TOKEN")
     )
     remote_timeout: int | None = Field(default=environ.get("REMOTE_TIMEOUT", None))
+    pool_max_connections: int = Field(
+        default=environ.get("POOL_MAX_CONNECTIONS", 1000),
+        description="Maximum connections to each upstream",
+    )
+    pool_max_keepalive_connections: int = Field(
+        default=environ.get("POOL_MAX_KEEPALIVE_CONNECTIONS", 100),
+        description="Maximum idle connections kept open to each upstream",
+    )
+    pool_keepalive_expiry: float = Field(
+        default=environ.get("POOL_KEEPALIVE_EXPIRY", 5.0),
+        description="Seconds an idle upstream connection is kept open",
+    )
+    pool_warm_connections: int = Field(
+        default=environ.get("POOL_WARM_CONNECTIONS", 1),
+        description="Connections opened to each upstream on startup. 0 disables.",
+    )
+    pool_ping_interval: float = Field(
+        default=environ.get("POOL_PING_INTERVAL", 0),
+        description="Seconds of idle time after which warm upstream connections are pinged. 0 disables.",
+    )
+    pool_timeout: float = Field(
+        default=environ.get("POOL_TIMEOUT", 10.0),
+        description="Seconds a request waits for a free upstream connection or HTTP/2 stream",
+    )
     local_port: int = Field(default=environ.get("LOCAL_PORT", "11434"))
     log_level: str = Field(default=environ.get("LOG_LEVEL", "INFO"))
     app_version: str | None = Field(default=None)
     stream_response: bool = Field(default=environ.get("STREAM_RESPONSE", True))
     decode_response: bool = Field(default=environ.get("DECODE_RESPONSE", False))
+    max_buffered_response: int = Field(
+        default=environ.get("MAX_BUFFERED_RESPONSE", 32),
+        description="Size in MiB of a buffered response above which it is streamed, 0 for no limit",
+    )
+    response_compression: bool = Field(
+        default=environ.get("RESPONSE_COMPRESSION", True),
+        description="Compress buffered responses by the client Accept-Encoding",
+    )
     debug_request: bool = Field(default=environ.get("DEBUG_REQUEST", False))
     correct_numbered_model_names: bool = Field(
         default=environ.get("CORRECT_NUMBERED_MODEL_NAMES", False)
     )
 
+    models_refresh_interval: int = Field(
+        default=environ.get("MODELS_REFRESH_INTERVAL", 60 * 5),
+        description="Refresh interval in seconds of the model list used for numbered model names. 0 disables.",
+    )  # 5 minutes
+
     cache_enabled: bool = Field(default=environ.get("CACHE_ENABLED", True))
     cache_maxsize: int = Field(default=environ.get("CACHE_MAXSIZE", 512))  # 512 entries
+    cache_memory_maxsize: int = Field(
+        default=environ.get("CACHE_MEMORY_MAXSIZE", 64),
+        description="Memory budget in MiB of the in-memory response cache, by body size",
+    )
+    cache_compress: bool = Field(
+        default=environ.get("CACHE_COMPRESS", False),
+        description="Store bodies of the in-memory response cache compressed",
+    )
     cache_ttl: int = Field(default=environ.get("CACHE_TTL", 60 * 60 * 12))  # 12 hours
+    cache_soft_ttl: int = Field(
+        default=environ.get("CACHE_SOFT_TTL", 60 * 5),
+        description="Cache soft TTL in seconds. Stale entries are served while refreshed in background. 0 disables.",
+    )  # 5 minutes
+    cache_dir: str | None = Field(
+        default=environ.get("CACHE_DIR") or None,
+        description="Directory of the persistent on-disk cache tier. Empty disables it.",
+    )
+    cache_disk_maxsize: int = Field(
+        default=environ.get("CACHE_DISK_MAXSIZE", 256)
+    )  # 256 MiB
+    cache_completions: bool = Field(
+        default=environ.get("CACHE_COMPLETIONS", False),
+        description="Cache deterministic (temperature 0 or fixed seed) chat/generate completions.",
+    )
+    embed_batching: bool = Field(
+        default=environ.get("EMBED_BATCHING", False),
+        description="Merge concurrent embedding requests into batches and de-duplicate their inputs",
+    )
+    embed_batch_window: float = Field(
+        default=environ.get("EMBED_BATCH_WINDOW", 5),
+        description="Milliseconds embedding inputs are collected into a batch",
+    )
+    embed_batch_max_size: int = Field(
+        default=environ.get("EMBED_BATCH_MAX_SIZE", 256),
+        description="Inputs of a batch sent to the remote side at once",
+    )
     hash_algorithm: str = Field(
         default=environ.get("HASH_ALGORITHM", "auto"),
         description="Hash algorithm to use for caching. Set to 'auto' to use the default algorithm.",
     )
 
+    json_backend: str = Field(
+        default=environ.get("JSON_BACKEND", "auto"),
+        description="JSON backend: orjson, msgspec, json. Set to 'auto' to benchmark installed backends on startup.",
+    )
+
+    offload_threshold: str = Field(
+        default=environ.get("OFFLOAD_THRESHOLD", "auto"),
+        description="Input size in bytes from which CPU bound work leaves the event loop, for all kinds or as 'hash=N,json=N,...'. Set to 'auto' to calibrate on startup.",
+    )
+    offload_workers: int = Field(
+        default=environ.get("OFFLOAD_WORKERS", 0),
+        description="Threads of the CPU bound work executor, 0 - min(4, CPU count)",
+    )
+
+    event_loop: str = Field(
+        default=environ.get("EVENT_LOOP", "auto"),
+        description="Event loop: uvloop, asyncio. Set to 'auto' to use uvloop when installed.",
+    )
+    http_parser: str = Field(
+        default=environ.get("HTTP_PARSER", "auto"),
+        description="HTTP/1.1 parser: httptools, h11. Set to 'auto' to use httptools when installed.",
+    )
+
+    metrics_enabled: bool = Field(
+        default=environ.get("METRICS_ENABLED", True),
+        description="Serve Prometheus metrics on METRICS_PATH and record them.",
+    )
+    access_log: bool = Field(
+        default=environ.get("ACCESS_LOG", False),
+        description="Log one structured line per completion with TTFT and tokens per second.",
+    )
+    metrics_path: str = Field(
+        default=environ.get("METRICS_PATH", "metrics"),
+        description="Reserved path of the metrics endpoint, it is not proxied.",
+    )
+
     limit_concurrency: int = Field(default=environ.get("LIMIT_CONCURRENCY", 90))
+    limit_concurrency_per_model: int = Field(
+        default=environ.get("LIMIT_CONCURRENCY_PER_MODEL", 0)
+    )  # 0 - unlimited
+    limit_concurrency_per_client: int = Field(
+        default=environ.get("LIMIT_CONCURRENCY_PER_CLIENT", 0)
+    )  # 0 - unlimited
+    queue_max_size: int = Field(default=environ.get("QUEUE_MAX_SIZE", 256))
+    queue_max_wait: float = Field(
+        default=environ.get("QUEUE_MAX_WAIT", 60)
+    )  # seconds, 0 - unlimited
+    client_key_header: str | None = Field(
+        default=environ.get("CLIENT_KEY_HEADER") or None,
+        description="Request header identifying a client for fair scheduling. Empty uses the client address.",
+    )
+    client_weights: dict[str, float] = Field(
+        default=environ.get("CLIENT_WEIGHTS", ""),
+        description="Fair scheduling weights of clients, e.g. 'ci=1,ide=4'. Default weight is 1.",
+    )
+
+    @field_validator("remote_url", mode="before")
+    @classmethod
+    def first_remote_url(cls, v):
+        if isinstance(v, str) and "," in v:
+            v = v.split(",", maxsplit=1)[0].strip()
+        return v
+
+    @field_validator("remote_urls", mode="before")
+    @classmethod
+    def split_remote_urls(cls, v):
+        if isinstance(v, str):
+            v = [url.strip() for url in v.split(",") if url.strip()]
+        return v
+
+    @field_validator("client_weights", mode="before")
+    @classmethod
+    def split_client_weights(cls, v):
+        if isinstance(v, str):
+            weights = {}
+            for item in v.split(","):
+                if item.strip():
+                    key, _, weight = item.rpartition("=")
+                    weights[key.strip()] = weight.strip()
+            v = weights
+        return v
+
+    @field_validator("upstream_policy", mode="after")
+    @classmethod
+    def normalize_upstream_policy(cls, v):
+        v = v.lower()
+        if v not in ("least_outstanding", "round_robin"):
+            raise ValueError(
+                f"Upstream policy '{v}' is not supported. List of available policies: least_outstanding,round_robin"
+            )
+        return v
 
     @field_validator("hash_algorithm", mode="after")
     @classmethod
@@ -55,6 +247,44 @@ class Settings(BaseModel):
                 )
         return v
 
+    @field_validator("json_backend", mode="after")
+    @classmethod
+    def normalize_json_backend(cls, v):
+        v = v.lower()
+        if v not in ("auto", "orjson", "msgspec", "json"):
+            raise ValueError(
+                f"JSON backend '{v}' is not supported. List of available backends: auto,orjson,msgspec,json"
+            )
+        return v
+
+    @field_validator("offload_threshold", mode="after")
+    @classmethod
+    def normalize_offload_threshold(cls, v):
+        v = v.strip().lower()
+        if v != "auto":
+            Offload.parse_thresholds(v)
+        return v
+
+    @field_validator("event_loop", mode="after")
+    @classmethod
+    def normalize_event_loop(cls, v):
+        v = v.lower()
+        if v not in EVENT_LOOPS:
+            raise ValueError(
+                f"Event loop '{v}' is not supported. List of available loops: {','.join(EVENT_LOOPS)}"
+            )
+        return v
+
+    @field_validator("http_parser", mode="after")
+    @classmethod
+    def normalize_http_parser(cls, v):
+        v = v.lower()
+        if v not in HTTP_PARSERS:
+            raise ValueError(
+                f"HTTP parser '{v}' is not supported. List of available parsers: {','.join(HTTP_PARSERS)}"
+            )
+        return v
+
     @field_validator("remote_auth_token", mode="after")
     @classmethod
     def validate_remote_auth_token(cls, v):
@@ -0,0 +1,202 @@
+import logging
+import time
+from typing import AsyncIterator
+
+from .json_codec import JsonCodec
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+access_logger = logging.getLogger("ollama_deproxy.access")
+
+
+class StreamStats:
+    """
+    Observes completion responses as they pass through: time to the first content
+    token, token counts and generation speed.
+
+    Ollama NDJSON (`/api/chat`, `/api/generate`) and SSE (`v1/chat/completions`,
+    `v1/completions`, `v1/messages`) streams are split into lines without extra
+    buffering, only a partial last line is kept between chunks. Once the first token
+    and the model are known, only lines carrying final counters are decoded.
+    """
+
+    PATHS = (
+        "api/chat",
+        "api/generate",
+        "v1/chat/completions",
+        "v1/completions",
+        "v1/messages",
+    )
+    STREAM_CONTENT_TYPES = ("application/x-ndjson", "text/event-stream")
+    # Lines with final counters: Ollama `eval_count`, OpenAI and Anthropic `usage`
+    FINAL_MARKERS = (b'"eval_count"', b'"usage"')
+    # Give up on a stream without line breaks instead of growing the partial line
+    MAX_LINE_BYTES = 1024 * 1024
+
+    def __init__(self, path: str, start_time: float, sse: bool, streamed: bool):
+        self.path = path
+        self.start_time = start_time
+        self.sse = sse
+        self.streamed = streamed
+        self.model: str | None = None
+        self.first_token_at: float | None = None
+        self.input_tokens: int | None = None
+        self.output_tokens: int | None = None
+        self.eval_duration: float | None = None  # seconds, reported by Ollama
+        self.size = 0
+        self._tail = b""
+        self._disabled = False
+
+    @classmethod
+    def for_response(
+        cls, path: str, headers, start_time: float, decoded: bool = True
+    ) -> "StreamStats | None":
+        """Return an observer for completion responses, or None if there is nothing to observe."""
+        if not path.endswith(cls.PATHS):
+            return None
+        if not decoded and headers.get("content-encoding", "identity") != "identity":
+            # Raw compressed passthrough can not be parsed without decoding
+            return None
+        content_type = headers.get("content-type", "")
+        return cls(
+            path,
+            start_time,
+            sse=content_type.startswith("text/event-stream"),
+            streamed=content_type.startswith(cls.STREAM_CONTENT_TYPES),
+        )
+
+    def feed(self, chunk: bytes):
+        self.size += len(chunk)
+        if self._disabled:
+            return
+        if self._tail:
+            chunk = self._tail + chunk
+        lines = chunk.split(b"\n")
+        self._tail = lines.pop()
+        if len(self._tail) > self.MAX_LINE_BYTES:
+            self._disabled = True
+            self._tail = b""
+        for line in lines:
+            self._line(line)
+
+    def _line(self, line: bytes):
+        line = line.strip()
+        if self.sse:
+            if not line.startswith(b"data:"):
+                return
+            line = line[5:].lstrip()
+            if line == b"[DONE]":
+                return
+        if not line:
+            return
+        if (
+            self.first_token_at is not None
+            and self.model is not None
+            and not any(marker in line for marker in self.FINAL_MARKERS)
+        ):
+            return
+        try:
+            data = JsonCodec.loads(line)
+        except ValueError:
+            return
+        if isinstance(data, dict):
+            self._handle(data)
+
+    def _handle(self, data: dict):
+        message = data.get("message")
+        if not isinstance(message, dict):
+            message = {}
+        if self.model is None:
+            # Anthropic sends the model in `message_start.message`
+            self.model = data.get("model") or message.get("model")
+
+        if self.first_token_at is None and self._has_token(data, message):
+            self.first_token_at = time.perf_counter()
+
+        if "eval_count" in data:
+            self.output_tokens = data.get("eval_count")
+            self.input_tokens = data.get("prompt_eval_count", self.input_tokens)
+            if data.get("eval_duration"):
+                self.eval_duration = data["eval_duration"] / 1e9
+        usage = data.get("usage") or message.get("usage")
+        if isinstance(usage, dict):
+            self.input_tokens = usage.get(
+                "prompt_tokens", usage.get("input_tokens", self.input_tokens)
+            )
+            self.output_tokens = usage.get(
+                "completion_tokens", usage.get("output_tokens", self.output_tokens)
+            )
+
+    @staticmethod
+    def _has_token(data: dict, message: dict) -> bool:
+        # Ollama generate and chat
+        if data.get("response") or data.get("thinking"):
+            return True
+        if message.get("content") or message.get("thinking"):
+            return True
+        if message.get("tool_calls"):
+            return True
+        # OpenAI chat and completions
+        choices = data.get("choices")
+        if choices and isinstance(choices, list):
+            choice = choices[0]
+            delta = choice.get("delta") or choice.get("message") or {}
+            return bool(
+                choice.get("text")
+                or delta.get("content")
+                or delta.get("reasoning_content")
+                or delta.get("tool_calls")
+            )
+        # Anthropic stream events and whole messages
+        return data.get("type") == "content_block_delta" or bool(data.get("content"))
+
+    def tokens_per_second(self, end_time: float) -> float | None:
+        if not self.output_tokens:
+            return None
+        if self.eval_duration:
+            return self.output_tokens / self.eval_duration
+        if self.streamed and self.first_token_at is not None:
+            generation_time = end_time - self.first_token_at
+            if generation_time > 0:
+                return self.output_tokens / generation_time
+        return None
+
+    def finish(self, status_code: int, route: str = "", model: str | None = None):
+        """Record metrics and write the access log line of a finished response."""
+        if self._tail:
+            self._line(self._tail)
+            self._tail = b""
+        end_time = time.perf_counter()
+        model = self.model or model
+        model_label = metrics.model_label(model)
+        ttft = None
+        if self.streamed and self.first_token_at is not None:
+            ttft = self.first_token_at - self.start_time
+            metrics.ttft.observe(ttft, model_label)
+        tokens_per_second = self.tokens_per_second(end_time)
+        if tokens_per_second is not None:
+            metrics.tokens_per_second.observe(tokens_per_second, model_label)
+        if self.output_tokens:
+            metrics.output_tokens.inc(model_label, amount=self.output_tokens)
+        if self.input_tokens:
+            metrics.input_tokens.inc(model_label, amount=self.input_tokens)
+
+        if access_logger.isEnabledFor(logging.INFO):
+            access_logger.info(
+                f"route={route or '-'} path=/{self.path} model={model or '-'} "
+                f"status={status_code} stream={int(self.streamed)} "
+                f"ttft={_fmt(ttft)} duration={end_time - self.start_time:.3f} "
+                f"input_tokens={self.input_tokens or 0} output_tokens={self.output_tokens or 0} "
+                f"tokens_per_s={_fmt(tokens_per_second, 1)} bytes={self.size}"
+            )
+
+
+def _fmt(value: float | None, digits: int = 3) -> str:
+    return "-" if value is None else f"{value:.{digits}f}"
+
+
+async def observe_stream(aiter: AsyncIterator[bytes], stats: StreamStats):
+    """Pass stream chunks through unchanged while observing them."""
+    async for chunk in aiter:
+        stats.feed(chunk)
+        yield chunk
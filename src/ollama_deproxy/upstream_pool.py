@@ -0,0 +1,376 @@
+import asyncio
+import logging
+import time
+from typing import Callable
+
+from httpx import (
+    AsyncBaseTransport,
+    AsyncByteStream,
+    AsyncHTTPTransport,
+    Limits,
+    PoolTimeout,
+    ProtocolError,
+    Request,
+    Response,
+)
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class _Lane:
+    """One upstream connection (its own single-connection transport) and its stream usage."""
+
+    __slots__ = ("transport", "active", "http2", "limit", "settled", "retired")
+
+    def __init__(self, transport: AsyncHTTPTransport, http2: bool, limit: int):
+        self.transport = transport
+        self.active = 0
+        self.http2 = http2
+        self.limit = limit
+        # The first response was received, so the stream capacity is known
+        self.settled = not http2
+        self.retired = False
+
+    def _connection(self):
+        pool = getattr(self.transport, "_pool", None)
+        if pool is None or not pool.connections:
+            return None
+        return getattr(pool.connections[0], "_connection", None)
+
+    @property
+    def connected(self) -> bool:
+        return self._connection() is not None
+
+    @property
+    def capacity(self) -> int:
+        """Concurrent streams the connection allows now."""
+        if self.retired:
+            return 0
+        if not self.http2:
+            return self.limit
+        # SETTINGS_MAX_CONCURRENT_STREAMS as tracked by the HTTP/2 connection, which
+        # allows a single stream until the server settings are received. HTTP/1.1
+        # negotiated by ALPN allows a single request at a time.
+        max_streams = getattr(self._connection(), "_max_streams", 1)
+        return max(1, min(max_streams, self.limit))
+
+
+class _HandshakeTrace:
+    """httpcore trace hook timing the TCP connect and TLS handshake of new connections."""
+
+    __slots__ = ("_trace", "started", "duration")
+
+    def __init__(self, trace=None):
+        self._trace = trace
+        self.started: float | None = None
+        self.duration: float | None = None
+
+    async def __call__(self, event_name: str, info: dict):
+        if event_name == "connection.connect_tcp.started":
+            self.started = time.perf_counter()
+        elif self.started is not None and event_name in (
+            "connection.connect_tcp.complete",
+            "connection.start_tls.complete",
+        ):
+            self.duration = time.perf_counter() - self.started
+        if self._trace is not None:
+            await self._trace(event_name, info)
+
+
+class _LaneStream(AsyncByteStream):
+    """Response stream that returns its stream slot to the pool once closed."""
+
+    def __init__(self, stream: AsyncByteStream, pool: "AdaptivePool", lane: _Lane):
+        self._stream = stream
+        self._pool = pool
+        self._lane = lane
+        self._released = False
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self):
+        try:
+            await self._stream.aclose()
+        finally:
+            if not self._released:
+                self._released = True
+                await self._pool._release(self._lane)
+
+
+class AdaptivePool(AsyncBaseTransport):
+    """
+    Upstream connection pool aware of HTTP/2 concurrent stream limits.
+
+    The httpx pool multiplexes every request onto the first HTTP/2 connection, where
+    requests beyond the server SETTINGS_MAX_CONCURRENT_STREAMS wait for a stream of
+    that connection only. Here each HTTP/2 connection is a lane with its own
+    single-connection transport and a stream capacity following the server settings.
+    Requests go to the least loaded lane with a free stream. When all lanes are
+    saturated, a new connection is opened, up to `max_connections`; after that
+    requests wait for a free stream up to `pool_timeout` and then fail with PoolTimeout.
+
+    Without HTTP/2 a single transport with the configured limits is used.
+    `retire()` replaces connections without interrupting streams in flight.
+    `warm()` opens connections ahead of requests and keeps idle ones alive.
+    """
+
+    # Seconds between capacity checks while a new connection learns its settings
+    SETTLE_POLL_INTERVAL = 0.05
+
+    def __init__(
+        self,
+        http2: bool,
+        limits: Limits,
+        retries: int = 0,
+        pool_timeout: float | None = None,
+        name: str = "",
+    ):
+        self.name = name
+        self.http2 = http2
+        self.limits = limits
+        self.retries = retries
+        self.pool_timeout = pool_timeout
+        self.lanes: list[_Lane] = []
+        self.waiting = 0
+        self._condition = asyncio.Condition()
+        self._draining: set[_Lane] = set()
+        # Last measured connection handshake and last request activity
+        self.handshake_time: float | None = None
+        self.last_used: float | None = None
+
+    def _new_lane(self) -> _Lane:
+        max_connections = self.limits.max_connections or 1 << 30
+        if not self.http2:
+            transport = AsyncHTTPTransport(retries=self.retries, limits=self.limits)
+            lane = _Lane(transport, http2=False, limit=max_connections)
+        else:
+            transport = AsyncHTTPTransport(
+                retries=self.retries,
+                http2=True,
+                limits=Limits(
+                    max_connections=1,
+                    max_keepalive_connections=1,
+                    keepalive_expiry=self.limits.keepalive_expiry,
+                ),
+            )
+            lane = _Lane(transport, http2=True, limit=1 << 30)
+        self.lanes.append(lane)
+        if len(self.lanes) > 1:
+            logger.debug(f"Upstream pool opened connection #{len(self.lanes)}")
+        return lane
+
+    def _pick(self) -> _Lane | None:
+        """Least loaded lane with a free stream."""
+        best = None
+        for lane in self.lanes:
+            if lane.active < lane.capacity and (
+                best is None or lane.active < best.active
+            ):
+                best = lane
+        return best
+
+    def _can_open(self) -> bool:
+        if not self.lanes:
+            return True
+        if not self.http2:
+            return False
+        # Wait for the settings of a new connection before opening another one
+        if not all(lane.settled for lane in self.lanes):
+            return False
+        return len(self.lanes) < (self.limits.max_connections or 1 << 30)
+
+    async def _acquire(self) -> _Lane:
+        loop = asyncio.get_running_loop()
+        deadline = None
+        if self.pool_timeout is not None:
+            deadline = loop.time() + self.pool_timeout
+        async with self._condition:
+            while True:
+                lane = self._pick()
+                if lane is None and self._can_open():
+                    lane = self._new_lane()
+                if lane is not None:
+                    lane.active += 1
+                    return lane
+                timeout = None if deadline is None else deadline - loop.time()
+                if timeout is not None and timeout <= 0:
+                    raise PoolTimeout("No free upstream stream within the pool timeout")
+                if not all(lane.settled for lane in self.lanes):
+                    timeout = min(
+                        timeout or self.SETTLE_POLL_INTERVAL, self.SETTLE_POLL_INTERVAL
+                    )
+                self.waiting += 1
+                try:
+                    await asyncio.wait_for(self._condition.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+                finally:
+                    self.waiting -= 1
+
+    async def _release(self, lane: _Lane, settled: bool = False):
+        async with self._condition:
+            lane.active -= 1
+            if settled:
+                lane.settled = True
+            self._condition.notify_all()
+        if lane.retired:
+            if lane.active == 0:
+                await self._close_lane(lane)
+        else:
+            await self._close_surplus_idle()
+
+    async def _settle(self, lane: _Lane):
+        async with self._condition:
+            if lane.settled:
+                return
+            lane.settled = True
+            self._condition.notify_all()
+        logger.debug(f"Upstream connection allows {lane.capacity} concurrent streams")
+
+    async def _send(self, lane: _Lane, request: Request) -> tuple[Response, bool]:
+        """Send a request on a lane, return the response and if a connection was opened."""
+        trace = _HandshakeTrace(request.extensions.get("trace"))
+        request.extensions["trace"] = trace
+        try:
+            response = await lane.transport.handle_async_request(request)
+        finally:
+            request.extensions["trace"] = trace._trace
+        if trace.duration is not None:
+            self.handshake_time = trace.duration
+            metrics.upstream_handshake.observe(trace.duration, self.name)
+        return response, trace.duration is not None
+
+    def _kept_warm(self) -> bool:
+        """Without warming, idle connections would have expired by now."""
+        if self.last_used is None:
+            return True
+        expiry = self.limits.keepalive_expiry
+        return expiry is not None and time.monotonic() - self.last_used > expiry
+
+    def idle_time(self) -> float:
+        """Seconds without requests in flight."""
+        if any(lane.active for lane in self.lanes):
+            return 0.0
+        if self.last_used is None:
+            return float("inf")
+        return time.monotonic() - self.last_used
+
+    async def handle_async_request(self, request: Request) -> Response:
+        retry = True
+        kept_warm = self._kept_warm()
+        self.last_used = time.monotonic()
+        while True:
+            lane = await self._acquire()
+            try:
+                response, connected = await self._send(lane, request)
+            except ProtocolError as e:
+                if retry and str(e).startswith("Max outbound streams"):
+                    # The server lowered its limit before the stream was opened: cap
+                    # the connection at its current load and retry on another one
+                    retry = False
+                    lane.limit = max(1, lane.active - 1)
+                    logger.warning(f"Upstream stream limit reached: {e}")
+                    await self._release(lane, settled=True)
+                    continue
+                await self._release(lane, settled=True)
+                raise
+            except BaseException:
+                await self._release(lane, settled=True)
+                raise
+            if kept_warm and not connected and self.handshake_time is not None:
+                metrics.upstream_handshake_saved.inc(
+                    self.name, amount=self.handshake_time
+                )
+            if not lane.settled:
+                await self._settle(lane)
+            response.stream = _LaneStream(response.stream, self, lane)
+            return response
+
+    async def warm(self, build_request: Callable[[], Request], count: int) -> int:
+        """
+        Open up to `count` connections, or keep idle ones alive, with a cheap request
+        on each. Busy HTTP/2 connections are left alone. Return the requests sent.
+        """
+        async with self._condition:
+            if self.http2:
+                lanes = [lane for lane in self.lanes if lane.active == 0][:count]
+                for _ in range(count - len(self.lanes)):
+                    lanes.append(self._new_lane())
+            else:
+                lane = self.lanes[0] if self.lanes else self._new_lane()
+                lanes = [lane] * count
+            for lane in lanes:
+                lane.active += 1
+        await asyncio.gather(
+            *(self._warm_lane(lane, build_request()) for lane in lanes)
+        )
+        return len(lanes)
+
+    async def _warm_lane(self, lane: _Lane, request: Request):
+        try:
+            response, _ = await self._send(lane, request)
+            try:
+                await response.aread()
+            finally:
+                await response.aclose()
+        except Exception as e:
+            logger.debug(f"Upstream connection warm up failed: {type(e).__name__}: {e}")
+        finally:
+            await self._release(lane, settled=True)
+
+    async def _close_lane(self, lane: _Lane):
+        if lane in self.lanes:
+            self.lanes.remove(lane)
+        self._draining.discard(lane)
+        await lane.transport.aclose()
+
+    async def _close_surplus_idle(self):
+        """Close idle HTTP/2 connections beyond the keep-alive limit."""
+        max_idle = self.limits.max_keepalive_connections
+        if not self.http2 or max_idle is None:
+            return
+        idle = [lane for lane in self.lanes if lane.active == 0 and lane.settled]
+        for lane in idle[max_idle:]:
+            await self._close_lane(lane)
+
+    async def retire(self):
+        """
+        Replace all connections: new requests open new ones, idle connections are
+        closed now and busy ones once their streams are finished.
+        """
+        async with self._condition:
+            lanes, self.lanes = self.lanes, []
+            for lane in lanes:
+                lane.retired = True
+                if lane.active:
+                    self._draining.add(lane)
+            self._condition.notify_all()
+        for lane in lanes:
+            if not lane.active:
+                await self._close_lane(lane)
+
+    def pool_usage(self) -> tuple[int, int, int]:
+        """Return (idle, active, waiting): connections and requests waiting for a stream."""
+        idle = active = 0
+        for lane in self.lanes + list(self._draining):
+            if lane.http2:
+                if lane.connected:
+                    if lane.active:
+                        active += 1
+                    else:
+                        idle += 1
+                continue
+            pool = getattr(lane.transport, "_pool", None)
+            connections = pool.connections if pool is not None else []
+            lane_idle = sum(1 for connection in connections if connection.is_idle())
+            idle += lane_idle
+            active += len(connections) - lane_idle
+        return idle, active, self.waiting
+
+    async def aclose(self):
+        for lane in self.lanes + list(self._draining):
+            await self._close_lane(lane)
@@ -1,46 +1,98 @@
-import json
+import inspect
 import logging
+from typing import AsyncIterator, Callable
 
-from . import __version__
+import anyio
 
-excluded_headers = {
-    "content-length",
-    "connection",
-    "server",
-    "date",
-    "keep-alive",
-    "proxy-authenticate",
-    "proxy-authorization",
-    "te",
-    "trailers",
-    "upgrade",
-    "alt-svc",
-}
+from . import __version__
+from .json_codec import JsonCodec
+
+excluded_headers = frozenset(
+    {
+        "content-length",
+        "connection",
+        "server",
+        "date",
+        "keep-alive",
+        "proxy-authenticate",
+        "proxy-authorization",
+        "te",
+        "trailers",
+        "upgrade",
+        "alt-svc",
+    }
+)
+# The body is sent decoded, its encoding no longer applies
+excluded_decoded_headers = excluded_headers | {"content-encoding"}
+# Matched against raw header names
+_excluded_raw_headers = frozenset(name.encode() for name in excluded_headers)
+_excluded_decoded_raw_headers = frozenset(
+    name.encode() for name in excluded_decoded_headers
+)
+
+# Request headers of local clients not forwarded, the remote client sets its own.
+# ASGI header names are lowercase bytes.
+excluded_request_headers = frozenset({b"host", b"authorization"})
 
 
 logger = logging.getLogger(__name__)
 
 
-def filter_headers(headers, decode_response: bool = None):
-    from .config import settings
-
-    if (
-        decode_response is not None
-        and settings.decode_response != decode_response
-        and decode_response
-    ):
-        excluded_headers_set = excluded_headers.copy()
-        excluded_headers_set.add("content-encoding")
-        return {
-            k: v for k, v in headers.items() if k.lower() not in excluded_headers_set
-        }
-    else:
-        excluded_headers_set = excluded_headers.copy()
-        if settings.decode_response:
-            excluded_headers_set.add("content-encoding")
-        return {
-            k: v for k, v in headers.items() if k.lower() not in excluded_headers_set
-        }
+def filter_headers(headers, decode_response: bool = None) -> dict:
+    """
+    Remote response headers forwarded to a local client, in a single pass over the
+    raw httpx header list. Repeated headers are joined like httpx does. Values are
+    decoded as latin-1, the way Starlette encodes them back, so bytes pass unchanged.
+    `decode_response` tells whether the body is sent decoded, DECODE_RESPONSE is used
+    when it is not given.
+    """
+    if decode_response is None:
+        from .config import settings
+
+        decode_response = settings.decode_response
+    excluded = (
+        _excluded_decoded_raw_headers if decode_response else _excluded_raw_headers
+    )
+    filtered = {}
+    for name, value in headers.raw:
+        name = name.lower()
+        if name in excluded:
+            continue
+        name = name.decode("latin-1")
+        if name in filtered:
+            filtered[name] += ", " + value.decode("latin-1")
+        else:
+            filtered[name] = value.decode("latin-1")
+    return filtered
+
+
+def filter_request_headers(raw_headers: list[tuple[bytes, bytes]]) -> list:
+    """
+    Local request headers forwarded to the remote side, in a single pass over the
+    raw ASGI header list. httpx takes the list as is, the client adds its own host,
+    user agent and auth headers.
+    """
+    return [item for item in raw_headers if item[0] not in excluded_request_headers]
+
+
+async def close_after(
+    body_iterator: AsyncIterator[bytes], on_close: Callable
+) -> AsyncIterator[bytes]:
+    """
+    Pass a response body through and call `on_close` (sync or async) once it ends.
+
+    Unlike a response background task, it also runs when the body raises (remote side
+    errors in the middle of a stream) or the client disconnects.
+    """
+    try:
+        async for chunk in body_iterator:
+            yield chunk
+    finally:
+        # The server cancels the response on disconnect: let the cleanup finish
+        with anyio.CancelScope(shield=True):
+            result = on_close()
+            if inspect.isawaitable(result):
+                await result
 
 
 def debug_requests_data(body_bytes: bytes, method: str = "", target_url: str = ""):
@@ -49,9 +101,9 @@ def debug_requests_data(body_bytes: bytes, method: str = "", target_url: str = "
     if settings.debug_request:
         if body_bytes:
             try:
-                data = json.loads(body_bytes.decode())
-            except json.JSONDecodeError:
-                data = body_bytes.decode()
+                data = JsonCodec.loads(body_bytes)
+            except ValueError:
+                data = body_bytes.decode(errors="ignore")
         else:
             data = ""
         logger.debug(